@@ -0,0 +1,190 @@
+import threading
+import time
+from collections import deque
+
+import requests
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling an upstream whose circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for a single upstream.
+    The outcome of the most recent calls is tracked, and the circuit opens when too
+    many of them failed or were slow. While open, calls fail fast with CircuitOpenError
+    instead of waiting on the upstream. Once open_duration has passed, a few trial calls
+    are let through (half-open) and the circuit closes again if they succeed.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window_size: int,
+        min_calls: int,
+        failure_rate: float,
+        slow_call_duration: float,
+        slow_call_rate: float,
+        open_duration: float,
+        half_open_calls: int,
+    ):
+        """
+        :param name: The name of the upstream, used in errors and statistics
+        :param window_size: The number of recent calls the rates are calculated over
+        :param min_calls: The number of calls needed before the circuit may open
+        :param failure_rate: The share of failed calls that opens the circuit
+        :param slow_call_duration: The number of seconds after which a call is slow
+        :param slow_call_rate: The share of slow calls that opens the circuit
+        :param open_duration: The number of seconds the circuit stays open
+        :param half_open_calls: The number of trial calls that must succeed to close it
+        """
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+
+        self._lock = threading.Lock()
+        self._outcomes: deque[tuple[bool, bool]] = deque(maxlen=window_size)
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._trials = 0
+        self._trial_successes = 0
+
+        self.calls = 0
+        self.failures = 0
+        self.slow_calls = 0
+        self.rejected = 0
+        self.opened = 0
+
+    def allow(self):
+        """
+        Check that a call may be made
+        :raises CircuitOpenError: If the circuit is open
+        """
+        with self._lock:
+            if self.state == OPEN:
+                retry_in = self._opened_at + self.open_duration - time.monotonic()
+                if retry_in > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(
+                        f"{self.name} is unavailable, retrying in {retry_in:.0f}s"
+                    )
+                self.state = HALF_OPEN
+                self._trials = 0
+                self._trial_successes = 0
+
+            if self.state == HALF_OPEN:
+                if self._trials >= self.half_open_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"{self.name} is unavailable, probing")
+                self._trials += 1
+
+    def rejects_calls(self) -> bool:
+        """
+        Check whether a call made now would fail fast, without counting it as a call
+        """
+        with self._lock:
+            if self.state == OPEN:
+                return self._opened_at + self.open_duration > time.monotonic()
+            return self.state == HALF_OPEN and self._trials >= self.half_open_calls
+
+    def record(self, success: bool, duration: float):
+        """
+        Record the outcome of a call allowed by allow()
+        :param success: Whether the call succeeded
+        :param duration: The number of seconds the call took
+        """
+        slow = duration >= self.slow_call_duration
+        with self._lock:
+            self.calls += 1
+            self.failures += not success
+            self.slow_calls += slow
+
+            if self.state == HALF_OPEN:
+                if not success or slow:
+                    self._open()
+                else:
+                    self._trial_successes += 1
+                    if self._trial_successes >= self.half_open_calls:
+                        self.state = CLOSED
+                        self._outcomes.clear()
+                return
+
+            if self.state == OPEN:  # A call started before the circuit opened
+                return
+
+            self._outcomes.append((not success, slow))
+            if len(self._outcomes) < self.min_calls:
+                return
+
+            failed = sum(f for f, _ in self._outcomes) / len(self._outcomes)
+            slowed = sum(s for _, s in self._outcomes) / len(self._outcomes)
+            if failed >= self.failure_rate or slowed >= self.slow_call_rate:
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self.opened += 1
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Call fn through the breaker. Exceptions and 5xx responses count as failures.
+        :param fn: The function making the upstream call
+        :return: The result of the call
+        :raises CircuitOpenError: If the circuit is open
+        """
+        self.allow()
+        start = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException:
+            self.record(False, time.monotonic() - start)
+            raise
+        self.record(not _is_server_error(result), time.monotonic() - start)
+        return result
+
+    async def call_async(self, fn, *args, **kwargs):
+        """
+        Await fn through the breaker. Exceptions and 5xx responses count as failures.
+        :param fn: The coroutine function making the upstream call
+        :return: The result of the call
+        :raises CircuitOpenError: If the circuit is open
+        """
+        self.allow()
+        start = time.monotonic()
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException:
+            self.record(False, time.monotonic() - start)
+            raise
+        self.record(not _is_server_error(result), time.monotonic() - start)
+        return result
+
+    def stats(self) -> dict:
+        """
+        Get the breaker's state and counters
+        """
+        with self._lock:
+            return {
+                "state": self.state,
+                "calls": self.calls,
+                "failures": self.failures,
+                "slow_calls": self.slow_calls,
+                "rejected": self.rejected,
+                "opened": self.opened,
+            }
+
+
+def _is_server_error(resp) -> bool:
+    status_code = getattr(resp, "status_code", None)
+    return isinstance(status_code, int) and status_code >= 500
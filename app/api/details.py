@@ -0,0 +1,72 @@
+import re
+from typing import Optional
+
+import config
+from app.cache.ttl import TTLCache
+
+# Fields of an anime's details that differ between users
+USER_FIELDS = frozenset({"my_list_status"})
+# Fields MAL includes in every anime details response
+DEFAULT_FIELDS = frozenset({"id", "title", "main_picture"})
+
+
+class AnimeDetailsCache:
+    """
+    Cache of the global fields of anime details (e.g. num_episodes, titles, genres),
+    shared by every user. A user's own list status of an anime is never cached, as
+    it can change on MyAnimeList at any time, so a request for it always reaches MAL.
+    """
+
+    def __init__(self):
+        self.details = TTLCache(
+            "anime_details",
+            maxsize=config.ANIME_DETAILS_CACHE_SIZE,
+            ttl=config.ANIME_DETAILS_DURATION,
+        )
+
+    def get(self, anime_id, fields: Optional[str]) -> Optional[dict]:
+        """
+        Get an anime's details from the cache
+        :param anime_id: The MAL ID of the anime
+        :param fields: The fields requested from MAL
+        :return: The details, or None if any requested field is not cached
+        """
+        requested = parse_fields(fields)
+        if requested is None or USER_FIELDS & requested:
+            return None
+
+        entry = self.details.get(str(anime_id))
+        global_fields = requested | DEFAULT_FIELDS
+        if entry is None or not global_fields <= entry["fields"]:
+            return None
+        return {k: v for k, v in entry["data"].items() if k in global_fields}
+
+    def store(self, anime_id, fields: Optional[str], details: dict):
+        """
+        Store the global fields of an anime's details fetched from MAL
+        :param anime_id: The MAL ID of the anime
+        :param fields: The fields that were requested from MAL
+        :param details: The details returned by MAL
+        """
+        requested = parse_fields(fields)
+        if requested is None:
+            return
+
+        # MAL omits fields without a value, so every requested field is known
+        global_fields = (requested - USER_FIELDS) | DEFAULT_FIELDS
+        data = {k: v for k, v in details.items() if k not in USER_FIELDS}
+        if entry := self.details.get(str(anime_id)):
+            global_fields |= entry["fields"]
+            data = {**entry["data"], **data}
+        self.details.set(str(anime_id), {"fields": global_fields, "data": data})
+
+
+def parse_fields(fields: Optional[str]) -> Optional[frozenset]:
+    """
+    Parse the fields parameter of an anime details request
+    :param fields: The comma or space separated fields
+    :return: The set of fields, or None if the fields can not be cached
+    """
+    if not fields or "{" in fields:  # Nested fields are not cached
+        return None
+    return frozenset(filter(None, re.split(r"[\s,]+", fields)))
@@ -0,0 +1,108 @@
+import codecs
+import json
+import re
+from typing import Any
+
+# Whitespace and commas between the items of an array
+_SEPARATORS = re.compile(r"[\s,]*")
+# Characters that may follow an item of an array
+_ITEM_ENDS = frozenset(" \t\r\n,]")
+# Characters kept back while looking for the array, in case its key is split across chunks
+_KEY_LOOKBEHIND = 64
+
+
+class ArrayItemParser:
+    """
+    Incrementally parse the items of an array field of a JSON object, as the document
+    arrives in chunks. Only the item being parsed is buffered, so memory use stays flat
+    as the array grows.
+    The rest of the document (e.g. MAL's 'paging') is returned by close().
+    """
+
+    def __init__(self, key: str = "data"):
+        """
+        :param key: The key of the array field to parse
+        """
+        self._start = re.compile(rf'"{re.escape(key)}"\s*:\s*\[')
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._prefix = ""
+        self._suffix = []
+        self._state = "prefix"
+
+    def feed(self, chunk: bytes) -> list[Any]:
+        """
+        Feed the next chunk of the document
+        :param chunk: The chunk of bytes
+        :return: The array items completed by the chunk
+        """
+        return self._parse(self._utf8.decode(chunk))
+
+    def close(self) -> dict:
+        """
+        Finish parsing the document
+        :return: The document, with the array field left empty
+        :raises ValueError: If the document is incomplete or invalid
+        """
+        self._parse(self._utf8.decode(b"", final=True))
+        if self._state != "suffix":
+            raise ValueError("Incomplete JSON document")
+        return json.loads(f"{self._prefix}[]{''.join(self._suffix)}")
+
+    def _parse(self, text: str) -> list[Any]:
+        self._buffer += text
+        if self._state == "prefix":
+            self._find_array()
+        if self._state == "items":
+            return self._parse_items()
+        if self._state == "suffix":
+            self._suffix.append(self._buffer)
+            self._buffer = ""
+        return []
+
+    def _find_array(self):
+        if match := self._start.search(self._buffer):
+            self._prefix += self._buffer[: match.end() - 1]
+            self._buffer = self._buffer[match.end() :]
+            self._state = "items"
+            return
+
+        keep = max(0, len(self._buffer) - _KEY_LOOKBEHIND)
+        self._prefix += self._buffer[:keep]
+        self._buffer = self._buffer[keep:]
+
+    def _parse_items(self) -> list[Any]:
+        items = []
+        buffer = self._buffer
+        pos = 0
+        while True:
+            pos = _SEPARATORS.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            if buffer[pos] == "]":
+                self._state = "suffix"
+                self._suffix.append(buffer[pos + 1 :])
+                self._buffer = ""
+                return items
+
+            try:
+                item, end = self._decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # The item is incomplete, wait for the next chunk
+            if not isinstance(item, (dict, list, str)) and not _ends_item(buffer, end):
+                break  # A number may continue in the next chunk, e.g. 12 of 123
+            items.append(item)
+            pos = end
+
+        # Only copy the buffer once per chunk, not once per item
+        self._buffer = buffer[pos:]
+        return items
+
+
+def _ends_item(buffer: str, end: int) -> bool:
+    """
+    Check whether a scalar decoded up to end is complete, rather than cut off by the
+    end of the chunk (e.g. 1. of 1.5, or 1e of 1e10)
+    """
+    return end < len(buffer) and buffer[end] in _ITEM_ENDS
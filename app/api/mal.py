@@ -1,9 +1,22 @@
+import asyncio
+import contextlib
 import os
+import re
 import secrets
+import time
+from collections.abc import AsyncIterator
+from typing import Optional
 from urllib.parse import urlencode
 
+import httpx
 import requests
 
+import config
+from app.api import transport
+from app.api.details import AnimeDetailsCache
+from app.api.jsonstream import ArrayItemParser
+from app.api.scheduler import THROTTLE_STATUS_CODES, RequestScheduler
+from app.api.singleflight import SingleFlight
 from config import Config
 
 AUTH_URL = "https://myanimelist.net/v1"
@@ -12,11 +25,30 @@ N_BYTES = 96
 QUERY_LIMIT = 100
 TIMEOUT = 10
 CODE_CHALLENGE_METHOD = "plain"
+# The error of MAL's throttled responses, telling them apart from forbidden resources
+RATE_LIMIT_ERROR = re.compile(r"rate.?limit|too many requests", re.IGNORECASE)
 
 REDIRECT_URI = f"{Config.PROTOCOL}://{Config.REDIRECT_URL}/callback"
 CLIENT_ID = os.environ.get("MAL_ID")
 CLIENT_SECRET = os.environ.get("MAL_SECRET")
 
+# All users share the same client id, so every MAL call goes through one scheduler
+scheduler = RequestScheduler(
+    rate=config.MAL_RATE_LIMIT,
+    burst=config.MAL_RATE_BURST,
+    max_wait=config.MAL_QUEUE_MAX_WAIT,
+    max_retries=config.MAL_MAX_RETRIES,
+    backoff_base=config.MAL_BACKOFF_BASE,
+    backoff_cap=config.MAL_BACKOFF_CAP,
+)
+
+# Global anime details are shared by all users
+details_cache = AnimeDetailsCache()
+
+# Identical reads that are in flight at the same time share a single MAL call
+flights = SingleFlight()
+async_flights = SingleFlight()
+
 
 class MyAnimeListAPI:
     """
@@ -64,7 +96,7 @@ class MyAnimeListAPI:
             "redirect_uri": REDIRECT_URI,
         }
 
-        resp = requests.post(url=url, data=data, timeout=TIMEOUT)
+        resp = _send(transport.post, url=url, data=data, timeout=TIMEOUT)
         resp.raise_for_status()
         resp_json = resp.json()
         return {
@@ -89,7 +121,7 @@ class MyAnimeListAPI:
             "refresh_token": refresh_token,
         }
 
-        resp = requests.post(url=url, data=data, timeout=TIMEOUT)
+        resp = _send(transport.post, url=url, data=data, timeout=TIMEOUT)
         resp.raise_for_status()
         return resp.json()
 
@@ -105,7 +137,7 @@ class MyAnimeListAPI:
 
         url = f"{BASE_URL}/users/@me"
         headers = {"Authorization": f"Bearer {token}"}
-        resp = requests.get(url=url, headers=headers, timeout=TIMEOUT)
+        resp = _send(transport.get, url=url, headers=headers, timeout=TIMEOUT)
         resp.raise_for_status()
         return resp.json()
 
@@ -126,10 +158,10 @@ class MyAnimeListAPI:
 
         url = f"{BASE_URL}/anime?q={query}"
         headers = {"Authorization": f"Bearer {token}"}
-        query_params = MyAnimeListAPI.__to_query_string(kwargs)
+        query_params = MyAnimeListAPI._to_query_string(kwargs)
         url += f"&{query_params}" if query_params else ""
 
-        resp = requests.get(url=url, headers=headers, timeout=TIMEOUT)
+        resp = _send(transport.get, url=url, headers=headers, timeout=TIMEOUT)
         resp.raise_for_status()
         return resp.json()
 
@@ -147,12 +179,10 @@ class MyAnimeListAPI:
 
         url = f"{BASE_URL}/users/@me/animelist?limit={limit}"
         headers = {"Authorization": f"Bearer {token}"}
-        query_params = MyAnimeListAPI.__to_query_string(kwargs)
+        query_params = MyAnimeListAPI._to_query_string(kwargs)
         url += f"&{query_params}" if query_params else ""
 
-        resp = requests.get(url=url, headers=headers, timeout=TIMEOUT)
-        resp.raise_for_status()
-        return resp.json()
+        return _get_json_coalesced(url, headers)
 
     @staticmethod
     def get_anime_details(token: str, anime_id: str, **kwargs):
@@ -169,14 +199,20 @@ class MyAnimeListAPI:
         if anime_id is None:
             raise Exception("A Valid Anime ID Must Be Provided")
 
+        cacheable = set(kwargs) <= {"fields"}
+        fields = kwargs.get("fields")
+        if cacheable and (details := details_cache.get(anime_id, fields)):
+            return details
+
         url = f"{BASE_URL}/anime/{anime_id}"
         headers = {"Authorization": f"Bearer {token}"}
-        query_params = MyAnimeListAPI.__to_query_string(kwargs)
+        query_params = MyAnimeListAPI._to_query_string(kwargs)
         url += f"?{query_params}" if query_params else ""
 
-        resp = requests.get(url=url, headers=headers, timeout=TIMEOUT)
-        resp.raise_for_status()
-        return resp.json()
+        details = _get_json_coalesced(url, headers)
+        if cacheable:
+            details_cache.store(anime_id, fields, details)
+        return details
 
     @staticmethod
     def update_watched_status(
@@ -213,12 +249,14 @@ class MyAnimeListAPI:
         if finish_date:
             body["finish_date"] = finish_date
 
-        resp = requests.put(url=url, headers=headers, data=body, timeout=TIMEOUT)
+        resp = _send(
+            transport.put, url=url, headers=headers, data=body, timeout=TIMEOUT
+        )
         resp.raise_for_status()
         return resp.json()
 
     @staticmethod
-    def __to_query_string(kwargs):
+    def _to_query_string(kwargs):
         """
         Convert Keyword arguments to a query string
         :param kwargs: The keyword arguments
@@ -260,3 +298,199 @@ class MyAnimeListAPI:
         if not method or method == "plain":
             return verifier
         return None
+
+
+class AsyncMyAnimeListAPI:
+    """
+    Asynchronous MyAnimeList API wrapper, for the calls that are made concurrently:
+    the pages of a user's full anime list are fetched at the same time
+    """
+
+    @staticmethod
+    async def get_user_anime_list(token: str, limit: int = QUERY_LIMIT, **kwargs):
+        """
+        Get a user's list of anime from MyAnimeList
+        :param token: The user's access token
+        :param limit: The number of results to return
+        :param kwargs: Additional query parameters
+        :return: JSON response
+        """
+        if token is None:
+            raise ValueError("Auth Token Must Be Provided")
+
+        url = f"{BASE_URL}/users/@me/animelist?limit={limit}"
+        headers = {"Authorization": f"Bearer {token}"}
+        query_params = MyAnimeListAPI._to_query_string(kwargs)
+        url += f"&{query_params}" if query_params else ""
+
+        return await _get_json_coalesced_async(url, headers)
+
+    @staticmethod
+    async def stream_user_anime_list(
+        token: str, limit: int = QUERY_LIMIT, **kwargs
+    ) -> AsyncIterator[dict]:
+        """
+        Get a user's list of anime from MyAnimeList, parsing the response as it arrives,
+        so large pages are never held in memory as a whole
+        :param token: The user's access token
+        :param limit: The number of results to return
+        :param kwargs: Additional query parameters
+        :return: The list items, each holding a 'node' and its 'list_status'
+        """
+        if token is None:
+            raise ValueError("Auth Token Must Be Provided")
+
+        url = f"{BASE_URL}/users/@me/animelist?limit={limit}"
+        headers = {"Authorization": f"Bearer {token}"}
+        query_params = MyAnimeListAPI._to_query_string(kwargs)
+        url += f"&{query_params}" if query_params else ""
+
+        async with _stream_async(url, headers) as resp:
+            parser = ArrayItemParser("data")
+            async for chunk in transport.aiter_bytes(resp):
+                for item in parser.feed(chunk):
+                    yield item
+            parser.close()
+
+
+def _send(send, **kwargs) -> requests.Response:
+    """
+    Send a request to MyAnimeList through the scheduler, retrying throttled responses
+    :param send: The transport function used to send the request
+    :param kwargs: The arguments passed to the transport function
+    :return: The response
+    """
+    attempt = 0
+    while True:
+        scheduler.acquire()
+        resp = send(**kwargs)
+        if (delay := _retry_delay(resp, attempt)) is None:
+            return resp
+
+        time.sleep(delay)
+        attempt += 1
+
+
+async def _send_async(send, **kwargs) -> httpx.Response:
+    """
+    Send a request to MyAnimeList through the scheduler, retrying throttled responses
+    :param send: The async transport function used to send the request
+    :param kwargs: The arguments passed to the transport function
+    :return: The response
+    """
+    attempt = 0
+    while True:
+        await scheduler.acquire_async()
+        resp = await send(**kwargs)
+        if (delay := _retry_delay(resp, attempt)) is None:
+            return resp
+
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+@contextlib.asynccontextmanager
+async def _stream_async(url: str, headers: dict):
+    """
+    GET a resource from MyAnimeList through the scheduler without reading its body,
+    retrying throttled responses
+    :param url: The URL of the resource
+    :param headers: The request headers, including the user's authorization
+    :return: A context manager yielding the successful response
+    """
+    attempt = 0
+    while True:
+        await scheduler.acquire_async()
+        async with transport.async_stream(
+            "GET", url, headers=headers, timeout=TIMEOUT
+        ) as resp:
+            if resp.status_code == 403:
+                await transport.aread(resp)  # To tell throttling from forbidden
+            if (delay := _retry_delay(resp, attempt)) is None:
+                if resp.is_error:
+                    await transport.aread(resp)
+                    _raise_for_status(resp)
+                yield resp
+                return
+
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+def _retry_delay(resp, attempt: int) -> Optional[float]:
+    """
+    Get how long to wait before retrying a response
+    :param resp: The response of the attempt
+    :param attempt: The number of retries made so far
+    :return: The delay in seconds, or None if the response should not be retried
+    """
+    if not _is_throttled(resp):
+        return None
+
+    delay = scheduler.on_throttled(attempt, resp.headers.get("Retry-After"))
+    if attempt >= scheduler.max_retries or delay > scheduler.max_wait:
+        return None
+
+    scheduler.record_retry()
+    return delay
+
+
+def _is_throttled(resp) -> bool:
+    """
+    Check whether a response throttles the client id. A 403 only does with a
+    Retry-After header or MAL's rate limit error, otherwise the resource is forbidden
+    to the user and retrying can not help.
+    :param resp: The response, with its body read
+    """
+    if resp.status_code not in THROTTLE_STATUS_CODES:
+        return False
+    if resp.status_code != 403 or "Retry-After" in resp.headers:
+        return True
+    return bool(RATE_LIMIT_ERROR.search(resp.text[:1000]))
+
+
+def _get_json_coalesced(url: str, headers: dict):
+    """
+    GET a JSON resource from MyAnimeList, sharing the call with identical in-flight requests
+    :param url: The URL of the resource
+    :param headers: The request headers, including the user's authorization
+    :return: JSON response
+    """
+
+    def fetch():
+        resp = _send(transport.get, url=url, headers=headers, timeout=TIMEOUT)
+        resp.raise_for_status()
+        return resp.json()
+
+    return flights.do((url, headers["Authorization"]), fetch)
+
+
+async def _get_json_coalesced_async(url: str, headers: dict):
+    """
+    GET a JSON resource from MyAnimeList, sharing the call with identical in-flight requests
+    :param url: The URL of the resource
+    :param headers: The request headers, including the user's authorization
+    :return: JSON response
+    """
+
+    async def fetch():
+        resp = await _send_async(
+            transport.async_get, url=url, headers=headers, timeout=TIMEOUT
+        )
+        _raise_for_status(resp)
+        return resp.json()
+
+    return await async_flights.do_async((url, headers["Authorization"]), fetch)
+
+
+def _raise_for_status(resp: httpx.Response):
+    """
+    Raise an error for unsuccessful httpx responses as a requests.HTTPError,
+    so callers can handle errors from both clients in the same way
+    :param resp: The response to check
+    """
+    if resp.is_error:
+        raise requests.HTTPError(
+            f"{resp.status_code} Error: {resp.reason_phrase} for url: {resp.url}",
+            response=resp,
+        )
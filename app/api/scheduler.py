@@ -0,0 +1,188 @@
+import asyncio
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import requests
+
+# Status codes MAL uses to signal that the client id is being throttled. A 403 is
+# also sent for forbidden resources, see mal._is_throttled.
+THROTTLE_STATUS_CODES = frozenset({403, 429})
+
+
+class RateLimitExceeded(requests.RequestException):
+    """Raised when a request could not be scheduled within the allowed queueing time"""
+
+
+class RequestScheduler:
+    """
+    Global token bucket for requests sharing a single API client id.
+    Calls wait briefly for a free slot instead of failing, throttled responses pause
+    the whole bucket for the duration of their Retry-After header, and are retried
+    with jittered exponential backoff.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        max_wait: float,
+        max_retries: int,
+        backoff_base: float,
+        backoff_cap: float,
+    ):
+        """
+        :param rate: The number of requests allowed per second
+        :param burst: The number of requests that may be sent at once
+        :param max_wait: The maximum number of seconds a request may wait for a slot
+        :param max_retries: The number of times a throttled request is retried
+        :param backoff_base: The base delay, in seconds, of the retry backoff
+        :param backoff_cap: The maximum delay, in seconds, of the retry backoff
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+
+        self.queue_depth = 0
+        self.granted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.retries = 0
+
+    def acquire(self):
+        """
+        Block until a request may be sent
+        :raises RateLimitExceeded: If no slot is available within max_wait seconds
+        """
+        wait = self._reserve()
+        if wait <= 0:
+            return
+
+        with self._lock:
+            self.queue_depth += 1
+        try:
+            time.sleep(wait)
+        finally:
+            with self._lock:
+                self.queue_depth -= 1
+
+    async def acquire_async(self):
+        """
+        Wait, without blocking the event loop, until a request may be sent
+        :raises RateLimitExceeded: If no slot is available within max_wait seconds
+        """
+        wait = self._reserve()
+        if wait <= 0:
+            return
+
+        with self._lock:
+            self.queue_depth += 1
+        try:
+            await asyncio.sleep(wait)
+        finally:
+            with self._lock:
+                self.queue_depth -= 1
+
+    def _reserve(self) -> float:
+        """
+        Reserve a token from the bucket
+        :return: The number of seconds to wait before the token may be used
+        """
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated_at
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+            self._updated_at = now
+
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            wait = max(wait, self._paused_until - now)
+            if wait > self.max_wait:
+                self._tokens += 1
+                self.rejected += 1
+                raise RateLimitExceeded(
+                    f"MyAnimeList request queue is full, retry in {wait:.1f}s"
+                )
+
+            self.granted += 1
+            if wait > 0:
+                self.queued += 1
+            return wait
+
+    def on_throttled(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """
+        Record a throttled response and determine how long to wait before retrying
+        :param attempt: The number of retries already made for the request
+        :param retry_after: The value of the response's Retry-After header
+        :return: The number of seconds to wait before retrying
+        """
+        delay = _parse_retry_after(retry_after)
+        with self._lock:
+            self.throttled += 1
+            if delay is not None:
+                # Every caller shares the client id, so hold back the whole bucket
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+        if delay is None:
+            ceiling = min(self.backoff_cap, self.backoff_base * 2**attempt)
+            delay = random.uniform(0, ceiling)
+        return delay
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def stats(self) -> dict:
+        """
+        Get the scheduler's queue depth and throttling counters
+        """
+        with self._lock:
+            now = time.monotonic()
+            tokens = self._tokens + (now - self._updated_at) * self.rate
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "tokens": round(min(self.burst, tokens), 2),
+                "paused_for": round(max(0.0, self._paused_until - now), 2),
+                "queue_depth": self.queue_depth,
+                "granted": self.granted,
+                "queued": self.queued,
+                "rejected": self.rejected,
+                "throttled": self.throttled,
+                "retries": self.retries,
+            }
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header, given either as seconds or as an HTTP date
+    :param value: The header value
+    :return: The number of seconds to wait, or None if the header is missing or invalid
+    """
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
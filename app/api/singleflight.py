@@ -0,0 +1,86 @@
+import asyncio
+import threading
+from collections.abc import Hashable
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into a single call.
+    The first caller for a key runs the call, while callers arriving before it finishes
+    wait for, and share, its result (or exception). Results are shared as-is, so
+    callers must not mutate them.
+    Futures are thread-safe, so async callers running in different event loops are
+    coalesced as well.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def _join(self, key: Hashable) -> tuple[Future, bool]:
+        """
+        Join the in-flight call for a key, starting one if there is none
+        :return: The call's future, and whether the caller is responsible for running it
+        """
+        with self._lock:
+            if future := self._calls.get(key):
+                self.coalesced += 1
+                return future, False
+
+            future = Future()
+            self._calls[key] = future
+            self.calls += 1
+            return future, True
+
+    def _leave(self, key: Hashable):
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def do(self, key: Hashable, fn, *args, **kwargs):
+        """
+        Run fn, unless a call with the same key is already in flight
+        :param key: The key identifying identical calls
+        :param fn: The function to call
+        :return: The result of the call
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._leave(key)
+        future.set_result(result)
+        return result
+
+    async def do_async(self, key: Hashable, fn, *args, **kwargs):
+        """
+        Await fn, unless a call with the same key is already in flight
+        :param key: The key identifying identical calls
+        :param fn: The coroutine function to call
+        :return: The result of the call
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._leave(key)
+        future.set_result(result)
+        return result
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
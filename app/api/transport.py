@@ -0,0 +1,273 @@
+import asyncio
+import contextlib
+import importlib.util
+import logging
+import threading
+from collections.abc import AsyncIterator
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+from app.api.breaker import CircuitBreaker
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+_async_loop: Optional[asyncio.AbstractEventLoop] = None
+_async_client: Optional[httpx.AsyncClient] = None
+_async_lock = threading.Lock()
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Get the process wide HTTP session used for all upstream requests
+    :return: A session with keep-alive connection pools for each upstream host
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def _build_session() -> requests.Session:
+    """
+    Build a session that keeps a dedicated connection pool for every upstream host,
+    so that MAL, Kitsu and Torrentio calls do not compete for the same sockets
+    """
+    session = requests.Session()
+    for host in config.UPSTREAM_HOSTS:
+        session.mount(
+            f"https://{host}/",
+            HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=config.HTTP_POOL_MAXSIZE,
+                pool_block=config.HTTP_POOL_BLOCK,
+            ),
+        )
+
+    # Fallback pool for any host that is not a known upstream
+    session.mount(
+        "https://",
+        HTTPAdapter(
+            pool_connections=config.HTTP_POOL_CONNECTIONS,
+            pool_maxsize=config.HTTP_POOL_MAXSIZE,
+        ),
+    )
+    return session
+
+
+def get_breaker(url: str) -> CircuitBreaker:
+    """
+    Get the circuit breaker of a URL's host
+    :param url: The URL of the request
+    :return: The breaker shared by every request to the host
+    """
+    host = urlsplit(url).hostname or ""
+    if breaker := _breakers.get(host):
+        return breaker
+
+    with _breakers_lock:
+        return _breakers.setdefault(
+            host,
+            CircuitBreaker(
+                host,
+                window_size=config.BREAKER_WINDOW_SIZE,
+                min_calls=config.BREAKER_MIN_CALLS,
+                failure_rate=config.BREAKER_FAILURE_RATE,
+                slow_call_duration=config.BREAKER_SLOW_CALL_DURATION,
+                slow_call_rate=config.BREAKER_SLOW_CALL_RATE,
+                open_duration=config.BREAKER_OPEN_DURATION,
+                half_open_calls=config.BREAKER_HALF_OPEN_CALLS,
+            ),
+        )
+
+
+def breaker_stats() -> dict:
+    """
+    Get the state and counters of each upstream host's circuit breaker
+    """
+    return {host: breaker.stats() for host, breaker in list(_breakers.items())}
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Send a request through the shared session
+    :param method: The HTTP method
+    :param url: The URL to request
+    :param kwargs: Additional arguments passed to requests
+    :return: The response
+    :raises CircuitOpenError: If the host's circuit breaker is open
+    """
+    return get_breaker(url).call(get_session().request, method, url, **kwargs)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def put(url: str, **kwargs) -> requests.Response:
+    return request("PUT", url, **kwargs)
+
+
+def _get_async_loop() -> asyncio.AbstractEventLoop:
+    """
+    Get the event loop that owns the async client.
+    Views run their coroutines in a new event loop per request, so the client lives
+    in a dedicated loop thread, allowing its connection pool to be reused across
+    requests.
+    """
+    global _async_loop
+    if _async_loop is None:
+        with _async_lock:
+            if _async_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=loop.run_forever, name="http-async", daemon=True
+                ).start()
+                _async_loop = loop
+    return _async_loop
+
+
+def _build_async_client() -> httpx.AsyncClient:
+    http2 = config.HTTP2_ENABLED
+    if http2 and importlib.util.find_spec("h2") is None:
+        logging.warning("HTTP/2 requested but the 'h2' package is not installed")
+        http2 = False
+
+    max_connections = config.HTTP_POOL_MAXSIZE * len(config.UPSTREAM_HOSTS)
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        ),
+    )
+
+
+async def _send(
+    method: str, url: str, stream: bool = False, **kwargs
+) -> httpx.Response:
+    global _async_client
+    if _async_client is None:  # Only ever touched from the transport loop
+        _async_client = _build_async_client()
+    request = _async_client.build_request(method, url, **kwargs)
+    return await _async_client.send(request, stream=stream)
+
+
+async def _next_chunk(chunks: AsyncIterator[bytes]) -> Optional[bytes]:
+    try:
+        return await chunks.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def _run(coro):
+    """
+    Run a coroutine in the transport loop, from any event loop
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, _get_async_loop())
+    return await asyncio.wrap_future(future)
+
+
+async def _request(method: str, url: str, **kwargs) -> httpx.Response:
+    return await _run(_send(method, url, **kwargs))
+
+
+async def async_request(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Send a request through the shared async client, from any event loop
+    :param method: The HTTP method
+    :param url: The URL to request
+    :param kwargs: Additional arguments passed to httpx
+    :return: The response
+    :raises CircuitOpenError: If the host's circuit breaker is open
+    """
+    return await get_breaker(url).call_async(_request, method, url, **kwargs)
+
+
+@contextlib.asynccontextmanager
+async def async_stream(method: str, url: str, **kwargs):
+    """
+    Send a request through the shared async client, from any event loop, without
+    reading the response body. The body is read with aiter_bytes or aread.
+    :param method: The HTTP method
+    :param url: The URL to request
+    :param kwargs: Additional arguments passed to httpx
+    :return: A context manager yielding the response, and closing it on exit
+    :raises CircuitOpenError: If the host's circuit breaker is open
+    """
+    resp = await get_breaker(url).call_async(
+        _request, method, url, stream=True, **kwargs
+    )
+    try:
+        yield resp
+    finally:
+        await _run(resp.aclose())
+
+
+async def aiter_bytes(resp: httpx.Response) -> AsyncIterator[bytes]:
+    """
+    Read the body of a streamed response in chunks, as they arrive.
+    Each chunk is only read once the previous one was consumed, so a slow reader
+    never has the whole body buffered.
+    :param resp: The response of async_stream
+    """
+    chunks = resp.aiter_bytes()
+    while (chunk := await _run(_next_chunk(chunks))) is not None:
+        yield chunk
+
+
+async def aread(resp: httpx.Response) -> bytes:
+    """
+    Read the whole body of a streamed response
+    :param resp: The response of async_stream
+    """
+    return await _run(resp.aread())
+
+
+async def async_get(url: str, **kwargs) -> httpx.Response:
+    return await async_request("GET", url, **kwargs)
+
+
+def prewarm(hosts: tuple[str, ...] = config.UPSTREAM_HOSTS):
+    """
+    Resolve and open a connection to each upstream host, in both the session and the
+    async client, so the first user request does not pay for the DNS lookup, TCP and
+    TLS handshakes
+    :param hosts: The hosts to connect to
+    """
+    session = get_session()
+    for host in hosts:
+        url = f"https://{host}/"
+        try:
+            session.head(url, timeout=config.HTTP_PREWARM_TIMEOUT)
+        except requests.RequestException as e:
+            logging.warning("Failed to pre-warm connection to %s: %s", host, e)
+
+        future = asyncio.run_coroutine_threadsafe(
+            _send("HEAD", url, timeout=config.HTTP_PREWARM_TIMEOUT), _get_async_loop()
+        )
+        try:
+            future.result()
+        except httpx.HTTPError as e:
+            logging.warning("Failed to pre-warm async connection to %s: %s", host, e)
+
+
+def start_prewarm():
+    """
+    Pre-warm the upstream connections in the background
+    """
+    threading.Thread(target=prewarm, name="http-prewarm", daemon=True).start()
@@ -0,0 +1,54 @@
+from typing import Any, NamedTuple
+
+import config
+from app.api import transport
+from app.cache.ttl import TTLCache
+
+TIMEOUT = 10
+
+
+class UpstreamResponse(NamedTuple):
+    """
+    The parsed response of an upstream addon API, as kept in the cache
+    """
+
+    status_code: int
+    data: Any  # The JSON body, or None if the body is not valid JSON
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400 and self.data is not None
+
+
+def upstream_unavailable(url: str) -> bool:
+    """
+    Check whether calls to a URL's host currently fail fast, as its circuit is open.
+    Cached responses of the host are then served as they are, without reloading them.
+    """
+    return transport.get_breaker(url).rejects_calls()
+
+
+def fetch_json(cache: TTLCache, url: str, ttl: float) -> UpstreamResponse:
+    """
+    GET a JSON resource from an upstream addon API (e.g. Kitsu, Torrentio), caching
+    the parsed response. Successful responses are cached for ttl seconds, error
+    responses only for UPSTREAM_ERROR_CACHE_DURATION. Exceptions (timeouts, open
+    circuits) are not cached, caches keeping expired entries serve the last response
+    instead until it is replaced.
+    :param cache: The cache of the upstream's responses
+    :param url: The URL of the resource
+    :param ttl: The number of seconds a successful response is cached for
+    :return: The parsed response
+    """
+
+    def load() -> tuple[UpstreamResponse, float]:
+        resp = transport.get(url, headers=config.REQ_HEADERS, timeout=TIMEOUT)
+        try:
+            data = resp.json()
+        except ValueError:
+            data = None
+
+        result = UpstreamResponse(resp.status_code, data)
+        return result, ttl if result.ok else config.UPSTREAM_ERROR_CACHE_DURATION
+
+    return cache.get_or_load(url, load)
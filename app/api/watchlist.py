@@ -0,0 +1,291 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+import httpx
+import requests
+
+import config
+from app.api.mal import QUERY_LIMIT, AsyncMyAnimeListAPI
+from app.api.singleflight import SingleFlight
+from app.cache.sizing import deep_sizeof
+from app.cache.ttl import TTLCache
+
+# The maximum page size MAL allows for a user's anime list
+MAX_PAGE_LIMIT = 1000
+# The fields the catalog renders or sorts by
+SNAPSHOT_FIELDS = "list_status,media_type,genres,mean,start_date,end_date,synopsis"
+
+# Sort options of the addon, mapped to (key function, descending) to sort locally
+# in the same order MyAnimeList would
+SORT_KEYS = {
+    "list_updated_at": (lambda e: e["list_status"].get("updated_at") or "", True),
+    "anime_title": (lambda e: (e["node"].get("title") or "").lower(), False),
+    "anime_start_date": (lambda e: e["node"].get("start_date") or "", True),
+    "list_score": (lambda e: e["list_status"].get("score") or 0, True),
+}
+
+
+class WatchlistSnapshot:
+    """
+    A user's full anime list, as fetched from MyAnimeList at a point in time
+    """
+
+    def __init__(
+        self,
+        entries: list[dict],
+        full_synced_at: Optional[float] = None,
+        changed_at: float = 0,
+    ):
+        """
+        :param entries: The list entries, each holding a 'node' and its 'list_status'
+        :param full_synced_at: When the full list was last fetched, defaults to now
+        :param changed_at: The last change of the list through the addon that the
+                           snapshot includes
+        """
+        self.entries = entries
+        self.synced_at = time.time()
+        self.full_synced_at = full_synced_at or self.synced_at
+        self.changed_at = changed_at
+
+        # The most recent list update included in the snapshot
+        self.watermark = max(
+            (e["list_status"].get("updated_at") or "" for e in entries), default=""
+        )
+
+    def __sizeof__(self) -> int:
+        return super().__sizeof__() + deep_sizeof([self.entries, self.watermark])
+
+    def is_fresh(self, changed_at: float = 0) -> bool:
+        """
+        Check if the snapshot can be served without syncing it
+        :param changed_at: When the list was last changed through the addon, by any
+                           worker. Compared to the time recorded by that worker, so
+                           the clocks of the workers do not matter.
+        """
+        if changed_at > self.changed_at:
+            return False
+        return time.time() - self.synced_at < config.WATCHLIST_SNAPSHOT_DURATION
+
+    def needs_full_sync(self) -> bool:
+        """
+        Check if the full list should be fetched again. Deleted entries never show up
+        in a delta sync, so the full list is refetched periodically.
+        """
+        return time.time() - self.full_synced_at >= config.WATCHLIST_FULL_SYNC_INTERVAL
+
+    def merge(self, changes: list[dict], changed_at: float = 0) -> "WatchlistSnapshot":
+        """
+        Create a new snapshot with changed entries replaced, and new entries added
+        :param changes: The changed list entries
+        :param changed_at: The last change of the list through the addon, as of the
+                           fetch of the changes
+        :return: The merged snapshot
+        """
+        changed = {e["node"]["id"]: e for e in changes}
+        entries = [changed.pop(e["node"]["id"], e) for e in self.entries]
+        entries.extend(changed.values())
+        return WatchlistSnapshot(
+            entries,
+            full_synced_at=self.full_synced_at,
+            changed_at=max(changed_at, self.changed_at),
+        )
+
+    def page(self, status: str, sort: str, offset: int, limit: int) -> list[dict]:
+        """
+        Get a page of the list entries with the given status
+        :param status: The watch status to filter by (e.g. watching, completed)
+        :param sort: The sort option to order the entries by
+        :param offset: The number of entries to skip
+        :param limit: The number of entries to return
+        :return: The list entries in the page
+        """
+        key, descending = SORT_KEYS.get(sort, SORT_KEYS[config.DEFAULT_SORT_OPTION])
+        entries = [e for e in self.entries if e["list_status"].get("status") == status]
+        entries.sort(key=key, reverse=descending)
+        return entries[offset : offset + limit]
+
+
+class WatchlistStore:
+    """
+    Keeps a snapshot of each user's full anime list, so that catalog pages for every
+    status, sort and offset are served locally instead of making a MAL call per page.
+    Expired snapshots are brought up to date with a delta sync, which only fetches
+    the entries updated since the snapshot was taken. A snapshot also expires once the
+    list was changed through the addon, by this worker (mark_stale) or any other one
+    (the user's watchlist_changed_at).
+    """
+
+    def __init__(self, client: AsyncMyAnimeListAPI):
+        """
+        :param client: The client used to fetch the anime lists
+        """
+        self.client = client
+        self.snapshots = TTLCache(
+            "watchlists",
+            maxsize=config.WATCHLIST_CACHE_SIZE,
+            ttl=config.WATCHLIST_FULL_SYNC_INTERVAL,
+            maxbytes=config.WATCHLIST_CACHE_MAX_BYTES,
+        )
+        self._flights = SingleFlight()
+
+    async def get_page(
+        self,
+        user_id: str,
+        token: str,
+        status: str,
+        sort: str,
+        offset: int,
+        limit: int,
+        nsfw: bool = False,
+        changed_at: float = 0,
+    ) -> dict:
+        """
+        Get a page of a user's anime list
+        :param user_id: The user's MyAnimeList ID
+        :param token: The user's access token
+        :param status: The watch status to filter by (e.g. watching, completed)
+        :param sort: The sort option to order the list by
+        :param offset: The number of entries to skip
+        :param limit: The number of entries to return
+        :param nsfw: Whether to include NSFW entries
+        :param changed_at: When the list was last changed through the addon
+        :return: The page, in the same format as MAL's user anime list response
+        """
+        snapshot = await self.get_snapshot(user_id, token, nsfw, changed_at)
+        return {"data": snapshot.page(status, sort, offset, limit)}
+
+    async def get_snapshot(
+        self, user_id: str, token: str, nsfw: bool = False, changed_at: float = 0
+    ) -> WatchlistSnapshot:
+        """
+        Get the snapshot of a user's anime list, syncing it if missing or expired.
+        An expired snapshot is served as is if it can not be synced.
+        :param user_id: The user's MyAnimeList ID
+        :param token: The user's access token
+        :param nsfw: Whether to include NSFW entries
+        :param changed_at: When the list was last changed through the addon
+        :return: The snapshot
+        """
+        key = (user_id, nsfw)
+        snapshot = self.snapshots.get(key)
+        if snapshot and snapshot.is_fresh(changed_at):
+            return snapshot
+
+        try:
+            synced = await self._flights.do_async(
+                key, self._sync, token, nsfw, snapshot, changed_at
+            )
+        except (requests.RequestException, httpx.TransportError) as e:
+            if snapshot is None:
+                raise
+            # Serve the last good snapshot while MAL is unavailable
+            logging.warning("Serving stale watchlist of user %s: %s", user_id, e)
+            return snapshot
+
+        self.snapshots.set(key, synced)
+        return synced
+
+    async def _sync(
+        self,
+        token: str,
+        nsfw: bool,
+        snapshot: Optional[WatchlistSnapshot],
+        changed_at: float,
+    ) -> WatchlistSnapshot:
+        if snapshot is None or snapshot.needs_full_sync():
+            return await self._fetch_snapshot(token, nsfw, changed_at)
+
+        changes = await self._fetch_changes(token, nsfw, snapshot.watermark)
+        return snapshot.merge(changes, changed_at)
+
+    async def _fetch_snapshot(
+        self, token: str, nsfw: bool, changed_at: float = 0
+    ) -> WatchlistSnapshot:
+        """
+        Fetch a user's full anime list, using the largest page size MAL allows.
+        Most lists fit in the first page, the pages of a longer list are then fetched
+        a few at a time, concurrently.
+        """
+        entries = []
+        offset = 0
+        batch = 1
+        while True:
+            offsets = range(offset, offset + batch * MAX_PAGE_LIMIT, MAX_PAGE_LIMIT)
+            pages = await asyncio.gather(
+                *(self._fetch_page(token, nsfw, page_offset) for page_offset in offsets)
+            )
+            for page in pages:
+                entries.extend(page)
+                # A full page may be followed by another one
+                if len(page) < MAX_PAGE_LIMIT:
+                    return WatchlistSnapshot(entries, changed_at=changed_at)
+            offset += batch * MAX_PAGE_LIMIT
+            batch = config.WATCHLIST_PAGE_CONCURRENCY
+
+    async def _fetch_page(self, token: str, nsfw: bool, offset: int) -> list[dict]:
+        """
+        Fetch a page of a user's full anime list. The page is parsed as it streams in,
+        so its response is never held in memory as a whole.
+        """
+        items = self.client.stream_user_anime_list(
+            token,
+            limit=MAX_PAGE_LIMIT,
+            offset=offset,
+            fields=SNAPSHOT_FIELDS,
+            nsfw=nsfw,
+        )
+        return [_to_entry(item) async for item in items]
+
+    async def _fetch_changes(self, token: str, nsfw: bool, watermark: str) -> list:
+        """
+        Fetch the entries of a user's list updated since the watermark, paging from the
+        most recently updated entry and stopping at the first entry older than it
+        """
+        changes = []
+        offset = 0
+        while True:
+            resp = await self.client.get_user_anime_list(
+                token,
+                limit=QUERY_LIMIT,
+                offset=offset,
+                sort="list_updated_at",
+                fields=SNAPSHOT_FIELDS,
+                nsfw=nsfw,
+            )
+            data = resp.get("data", [])
+            for entry in map(_to_entry, data):
+                if (entry["list_status"].get("updated_at") or "") < watermark:
+                    return changes
+                changes.append(entry)
+
+            if not resp.get("paging", {}).get("next"):
+                return changes
+            offset += len(data)
+
+    def mark_stale(self, user_id: str):
+        """
+        Mark a user's snapshots in this worker as stale, e.g. after their list was
+        updated, so the next read picks up the changes with a delta sync. Other workers
+        learn of the update from the user's watchlist_changed_at.
+        :param user_id: The user's MyAnimeList ID
+        """
+        for nsfw in (False, True):
+            if snapshot := self.snapshots.get((user_id, nsfw)):
+                snapshot.synced_at = 0
+
+    def invalidate(self, user_id: str):
+        """
+        Drop a user's snapshots, so the next read fetches the full list
+        :param user_id: The user's MyAnimeList ID
+        """
+        for nsfw in (False, True):
+            self.snapshots.pop((user_id, nsfw))
+
+
+def _to_entry(list_item: dict) -> dict:
+    return {
+        "node": list_item["node"],
+        "list_status": list_item.get("list_status") or {},
+    }
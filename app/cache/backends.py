@@ -0,0 +1,397 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import weakref
+from abc import ABC, abstractmethod
+from typing import Optional
+from urllib.parse import urlsplit
+
+import config
+
+
+class CacheBackendError(Exception):
+    """Raised when a second tier cache backend can not be reached"""
+
+
+class CacheBackend(ABC):
+    """
+    Second tier cache, shared by the worker processes of a node or a cluster.
+    Values are opaque bytes, serialized by the TTLCache in front of it.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Get a value, or None if it is missing or expired
+        :raises CacheBackendError: If the backend can not be reached
+        """
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: float):
+        """
+        Store a value for ttl seconds
+        :raises CacheBackendError: If the backend can not be reached
+        """
+
+    @abstractmethod
+    def delete(self, key: str):
+        """
+        Remove a value
+        :raises CacheBackendError: If the backend can not be reached
+        """
+
+
+class MemoryBackend(CacheBackend):
+    """
+    Process local backend, for development and tests
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: dict[str, tuple[float, bytes]] = {}
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def set(self, key: str, value: bytes, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+# Backends holding connections, which a forked child must not share with its parent
+_connected: "weakref.WeakSet[CacheBackend]" = weakref.WeakSet()
+
+
+class DiskBackend(CacheBackend):
+    """
+    SQLite backed cache, shared by the worker processes of a node.
+    Each thread opens its own connection on first use, a forked child opens new ones.
+    """
+
+    # Expired entries are purged once every PURGE_INTERVAL writes
+    PURGE_INTERVAL = 1000
+
+    def __init__(self, path: str):
+        """
+        :param path: The path of the database file
+        """
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        _connected.add(self)
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Get the calling thread's connection, as connections can not be shared by threads
+        """
+        if (conn := getattr(self._local, "conn", None)) is None:
+            try:
+                conn = sqlite3.connect(self.path, timeout=config.CACHE_L2_TIMEOUT)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, "
+                    "expires_at REAL NOT NULL, value BLOB NOT NULL)"
+                )
+            except sqlite3.Error as e:
+                raise CacheBackendError(str(e)) from e
+            self._local.conn = conn
+        return conn
+
+    def _forget_connections(self):
+        """
+        Drop the parent's connections in a forked child, without closing them
+        """
+        self._local = threading.local()
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT value FROM cache WHERE key = ? AND expires_at > ?",
+                    (key, time.time()),
+                )
+                .fetchone()
+            )
+        except sqlite3.Error as e:
+            raise CacheBackendError(str(e)) from e
+        return row[0] if row else None
+
+    def set(self, key: str, value: bytes, ttl: float):
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, expires_at, value) VALUES (?, ?, ?)",
+                    (key, now + ttl, value),
+                )
+                self._writes += 1
+                if self._writes % self.PURGE_INTERVAL == 0:
+                    conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        except sqlite3.Error as e:
+            raise CacheBackendError(str(e)) from e
+
+    def delete(self, key: str):
+        try:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            raise CacheBackendError(str(e)) from e
+
+
+class _RedisConnection:
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.reader = sock.makefile("rb")
+
+    def command(self, args):
+        self.sock.sendall(_encode_command(args))
+        return _read_reply(self.reader)
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+class RedisBackend(CacheBackend):
+    """
+    Cache shared by a cluster, on any server speaking the Redis protocol (RESP).
+    Only GET, SET and DEL are used. Each command takes a connection of a small pool,
+    so concurrent requests do not wait on each other's round-trips: a connection is
+    opened when none is idle, and up to pool_size idle ones are kept.
+    After a connection failure or a command timing out, the server is not contacted
+    again for RETRY_DELAY seconds, so an outage or a hung server does not slow down
+    requests.
+    """
+
+    RETRY_DELAY = 5
+
+    def __init__(
+        self, url: str, timeout: float, pool_size: int = config.CACHE_L2_POOL_SIZE
+    ):
+        """
+        :param url: The server's URL, e.g. redis://:password@localhost:6379/0
+        :param timeout: The number of seconds to wait for the server
+        :param pool_size: The maximum number of idle connections kept open
+        """
+        parsed = urlsplit(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self.pool_size = pool_size
+
+        self._lock = threading.Lock()
+        self._idle: list[_RedisConnection] = []
+        self._retry_at = 0.0
+        _connected.add(self)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._command(b"GET", key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self._command(b"SET", key, value, b"PX", int(ttl * 1000))
+
+    def delete(self, key: str):
+        self._command(b"DEL", key)
+
+    def _command(self, *args):
+        conn = self._acquire()
+        try:
+            reply = conn.command(args)
+        except OSError as e:
+            conn.close()
+            if isinstance(e, socket.timeout):
+                self._back_off()
+                logging.warning("Cache at %s timed out: %s", self.host, e)
+            raise CacheBackendError(str(e)) from e
+        except ValueError as e:
+            # Not a RESP reply, e.g. another service listens on the port. The rest of
+            # the reply is still unread, so the connection can not be reused.
+            conn.close()
+            logging.warning("Invalid reply from the cache at %s: %s", self.host, e)
+            raise CacheBackendError(str(e)) from e
+        except CacheBackendError:
+            # An error reply, the connection is still in a usable state
+            self._release(conn)
+            raise
+        self._release(conn)
+        return reply
+
+    def _acquire(self) -> _RedisConnection:
+        with self._lock:
+            if time.monotonic() < self._retry_at:
+                raise CacheBackendError(f"{self.host}:{self.port} is unavailable")
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def _release(self, conn: _RedisConnection):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _connect(self) -> _RedisConnection:
+        conn = None
+        try:
+            conn = _RedisConnection(
+                socket.create_connection((self.host, self.port), timeout=self.timeout)
+            )
+            if self.password:
+                conn.command((b"AUTH", self.password))
+            if self.db:
+                conn.command((b"SELECT", self.db))
+        except (OSError, ValueError, CacheBackendError) as e:
+            if conn is not None:
+                conn.close()
+            self._back_off()
+            logging.warning("Failed to connect to cache at %s: %s", self.host, e)
+            raise CacheBackendError(str(e)) from e
+        return conn
+
+    def _back_off(self):
+        with self._lock:
+            self._retry_at = time.monotonic() + self.RETRY_DELAY
+
+    def _forget_connections(self):
+        """
+        Drop the parent's connections in a forked child, without closing them
+        """
+        self._lock = threading.Lock()
+        self._idle = []
+
+
+def _encode_command(args) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        elif isinstance(arg, int):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def _read_reply(reader):
+    """
+    Read a reply of the server
+    :raises ValueError: If the reply does not follow the protocol
+    """
+    line = reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise OSError("Connection closed by the cache server")
+
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"+":
+        return payload
+    if kind == b"-":
+        raise CacheBackendError(payload.decode(errors="replace"))
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        length = int(payload)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        if len(data) != length + 2:
+            raise OSError("Connection closed by the cache server")
+        return data[:-2]
+    if kind == b"*":
+        length = int(payload)
+        return None if length < 0 else [_read_reply(reader) for _ in range(length)]
+    raise ValueError(f"Invalid reply from the cache server: {line!r}")
+
+
+class _LazyBackend(CacheBackend):
+    """
+    Stands in for the process wide backend, created on first use by the process using
+    it rather than when the caches in front of it are created on import
+    """
+
+    def get(self, key: str) -> Optional[bytes]:
+        return _process_backend().get(key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        _process_backend().set(key, value, ttl)
+
+    def delete(self, key: str):
+        _process_backend().delete(key)
+
+
+_lazy_backend = _LazyBackend()
+_backend: Optional[CacheBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_l2_backend() -> Optional[CacheBackend]:
+    """
+    Get the process wide second tier cache backend, as configured by CACHE_L2_BACKEND.
+    It opens no file or connection until it is first used.
+    :return: The backend, or None if no second tier is configured
+    """
+    if not config.CACHE_L2_BACKEND:
+        return None
+    if config.CACHE_L2_BACKEND not in _BUILDERS:
+        raise ValueError(f"Unknown cache backend: {config.CACHE_L2_BACKEND}")
+    return _lazy_backend
+
+
+def _process_backend() -> CacheBackend:
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _build_backend(config.CACHE_L2_BACKEND)
+    return _backend
+
+
+def _after_fork_in_child():
+    """
+    Drop the parent's backend and connections in a forked child, it opens its own
+    """
+    global _backend, _backend_lock
+    _backend = None
+    _backend_lock = threading.Lock()
+    for backend in list(_connected):
+        backend._forget_connections()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _disk_backend() -> DiskBackend:
+    try:
+        os.makedirs(os.path.dirname(config.CACHE_L2_PATH) or ".", exist_ok=True)
+    except OSError as e:  # e.g. a read-only path, the caches fall back to their L1
+        raise CacheBackendError(str(e)) from e
+    return DiskBackend(config.CACHE_L2_PATH)
+
+
+_BUILDERS = {
+    "memory": MemoryBackend,
+    "disk": _disk_backend,
+    "redis": lambda: RedisBackend(config.CACHE_L2_URL, timeout=config.CACHE_L2_TIMEOUT),
+}
+
+
+def _build_backend(name: str) -> CacheBackend:
+    return _BUILDERS[name]()
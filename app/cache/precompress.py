@@ -0,0 +1,135 @@
+import gzip
+import sys
+import threading
+import zlib
+from typing import Optional
+
+from werkzeug.http import parse_accept_header
+
+import config
+
+try:
+    import brotli  # Installed with flask-compress on CPython
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_INSTALLED = {"br": brotli is not None, "zstd": zstandard is not None, "gzip": True}
+
+# The encodings bodies are precompressed with, in order of preference
+ENCODINGS = [e for e in config.PRECOMPRESS_LEVELS if _INSTALLED.get(e)]
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """
+    Compress a body with one of ENCODINGS, at its PRECOMPRESS_LEVELS level
+    """
+    level = config.PRECOMPRESS_LEVELS[encoding]
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def decode(data: bytes, encoding: str) -> Optional[bytes]:
+    """
+    Decode a body compressed by flask-compress
+    :return: The identity body, or None if the encoding is not supported
+    """
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "deflate":
+        return zlib.decompress(data)
+    if encoding == "br" and brotli:
+        return brotli.decompress(data)
+    return None
+
+
+def choose_encoding(accept_encoding: Optional[str], encodings) -> Optional[str]:
+    """
+    Choose the encoding of a response: the one with the highest q-value among those
+    the client accepts, the server's preference breaking ties
+    :param accept_encoding: The request's Accept-Encoding header
+    :param encodings: The encodings available, in order of preference
+    :return: The encoding, or None for the identity body
+    """
+    accepted = parse_accept_header(accept_encoding)
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = accepted.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class Variants:
+    """
+    A response body and its compressed variants. Variants are encoded by precompress,
+    meant to run off the request path: until then the body is served as is, or in the
+    encodings it was created with.
+    """
+
+    def __init__(self, body: bytes, encoded: Optional[dict[str, bytes]] = None):
+        """
+        :param body: The identity (uncompressed) body
+        :param encoded: Variants the body is already encoded in, by encoding
+        """
+        self.body = body
+        self._lock = threading.Lock()
+        self._encoded: dict[str, Optional[bytes]] = {
+            encoding: variant
+            for encoding, variant in (encoded or {}).items()
+            if encoding in self.encodings and len(variant) < len(body)
+        }
+
+    def __sizeof__(self) -> int:
+        # The identity body and every variant encoded so far
+        encoded = [v for v in list(self._encoded.values()) if v is not None]
+        return super().__sizeof__() + sum(map(sys.getsizeof, [self.body, *encoded]))
+
+    @property
+    def encodings(self) -> list[str]:
+        """
+        Get the encodings the body may be served with, in order of preference
+        """
+        if len(self.body) < config.PRECOMPRESS_MIN_SIZE:
+            return []
+        return ENCODINGS
+
+    @property
+    def available(self) -> list[str]:
+        """
+        Get the encodings the body is encoded in so far, in order of preference
+        """
+        return [e for e in self.encodings if self._encoded.get(e) is not None]
+
+    def precompress(self) -> bool:
+        """
+        Encode the body in every encoding it is not encoded in yet
+        :return: Whether any encoding was added
+        """
+        added = False
+        for encoding in self.encodings:
+            if encoding in self._encoded:
+                continue
+            encoded = compress(self.body, encoding)
+            with self._lock:
+                self._encoded.setdefault(
+                    encoding, encoded if len(encoded) < len(self.body) else None
+                )
+            added = True
+        return added
+
+    def get(self, encoding: Optional[str]) -> tuple[Optional[str], bytes]:
+        """
+        Get the body in an encoding, never compressing it
+        :return: The encoding actually used (None for identity, when the body is not
+                 encoded in it yet or compressing does not make it smaller) and the body
+        """
+        encoded = self._encoded.get(encoding) if encoding else None
+        return (None, self.body) if encoded is None else (encoding, encoded)
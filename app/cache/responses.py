@@ -0,0 +1,340 @@
+import io
+import logging
+import threading
+import time
+from collections.abc import Iterable
+from typing import NamedTuple, Optional
+
+from werkzeug.datastructures import ResponseCacheControl
+from werkzeug.http import (
+    parse_cache_control_header,
+    parse_etags,
+    quote_etag,
+    unquote_etag,
+)
+
+import config
+from app.cache.precompress import Variants, choose_encoding, decode
+from app.cache.ttl import TTLCache, get_refresh_executor
+
+# Request headers removed before running the app for a URL whose response can be
+# cached, so it produces a full response. Conditional requests are then answered from
+# the cache.
+CONDITIONAL_HEADERS = ("HTTP_IF_NONE_MATCH", "HTTP_IF_MODIFIED_SINCE")
+
+# Headers of a full response that are not sent with a 304 Not Modified
+ENTITY_HEADERS = frozenset({"content-length", "content-type", "content-encoding"})
+
+# Headers set for each encoding a cached response is served with
+VARIANT_HEADERS = frozenset({"content-length", "content-encoding", "etag"})
+
+
+class _CachedResponse(NamedTuple):
+    status: str
+    headers: list[tuple[str, str]]  # without the VARIANT_HEADERS
+    variants: Variants
+    etag: Optional[str]  # of the identity body, unquoted
+    weak: bool
+    stored_at: float  # monotonic time the response was stored
+    fresh_until: float
+    revalidate_until: float  # served stale while it is refreshed until then
+    error_until: float  # served stale instead of an error until then
+
+
+class ResponseCache:
+    """
+    WSGI middleware caching public responses of the app in-process, as a shared cache
+    (CDN) would. A response is cached when its Cache-Control is public, with an s-maxage
+    or max-age, and it only varies by Accept-Encoding. Repeat requests and conditional
+    requests (304 Not Modified) are then answered without running the app. Requests for
+    URLs whose last response could not be cached (e.g. private ones or static files)
+    keep their conditional headers, so the app answers them with a 304 itself.
+    Cached bodies are compressed once per encoding in the background, instead of on
+    every response.
+    The stale-while-revalidate and stale-if-error directives of the response are
+    honoured: stale responses are served while they are refreshed in the background,
+    or when the app fails.
+    """
+
+    def __init__(
+        self,
+        app,
+        maxsize: int = config.RESPONSE_CACHE_SIZE,
+        maxbytes: Optional[int] = config.RESPONSE_CACHE_MAX_BYTES,
+    ):
+        """
+        :param app: The WSGI app to wrap
+        :param maxsize: The maximum number of responses to hold
+        :param maxbytes: The maximum number of bytes the bodies and their compressed
+                         variants may hold, unbounded if None
+        """
+        self.app = app
+        # Entries expire at the end of their longest stale window, the fresh
+        # lifetime of each response is tracked in the entry itself
+        self.cache = TTLCache("responses", maxsize=maxsize, ttl=0, maxbytes=maxbytes)
+        self.uncacheable = TTLCache(
+            "uncacheable_responses",
+            maxsize=maxsize,
+            ttl=config.RESPONSE_CACHE_UNCACHEABLE_DURATION,
+        )
+
+        self._lock = threading.Lock()
+        self._refreshing: set[str] = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.stale_errors = 0
+        self.not_modified = 0
+
+    def __call__(self, environ: dict, start_response) -> Iterable[bytes]:
+        if environ.get("REQUEST_METHOD") != "GET" or "HTTP_AUTHORIZATION" in environ:
+            return self.app(environ, start_response)
+
+        key = _cache_key(environ)
+        cached = self.cache.get(key)
+        now = time.monotonic()
+        if cached is not None and now < cached.fresh_until:
+            self._count("hits")
+            return self._serve(cached, environ, start_response)
+        if cached is not None and now < cached.revalidate_until:
+            self._count("stale_hits")
+            self._refresh(key, environ)
+            return self._serve(cached, environ, start_response)
+
+        self._count("misses")
+        stale_on_error = cached is not None and now < cached.error_until
+        conditional = key in self.uncacheable
+        try:
+            status, headers, body = self._run_app(environ, conditional)
+        except Exception:
+            if not stale_on_error:
+                raise
+            logging.exception("Serving a stale response for %s", key)
+            status = "500 INTERNAL SERVER ERROR"
+
+        if stale_on_error and int(status[:3]) >= 500:
+            self._count("stale_errors")
+            return self._serve(cached, environ, start_response)
+
+        if entry := self._store(key, status, headers, body):
+            if conditional:
+                self.uncacheable.pop(key)
+            return self._serve(entry, environ, start_response)
+        if int(status[:3]) < 400 and not status.startswith("304"):
+            # Errors are not remembered, the URL may be cached once it recovers
+            self.uncacheable.set(key, True)
+        return _respond(environ, start_response, status, headers, body)
+
+    def _run_app(
+        self, environ: dict, conditional: bool = False
+    ) -> tuple[str, list[tuple[str, str]], bytes]:
+        """
+        Run the app, buffering its response
+        :param conditional: Whether to keep the request's conditional headers, the
+                            app may then respond with a 304 instead of a full response
+        """
+        if not conditional:
+            environ = {k: v for k, v in environ.items() if k not in CONDITIONAL_HEADERS}
+        captured = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and captured:
+                raise exc_info[1].with_traceback(exc_info[2])
+            captured[:] = [status, headers]
+            return lambda _data: None
+
+        result = self.app(environ, start_response)
+        try:
+            body = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        status, headers = captured
+        return status, headers, body
+
+    def _store(
+        self, key: str, status: str, headers: list[tuple[str, str]], body: bytes
+    ) -> Optional[_CachedResponse]:
+        """
+        Store a response if it may be cached by a shared cache
+        :return: The cached response, or None if it was not cached
+        """
+        if not status.startswith("200"):
+            return None
+
+        header_names = {name.lower() for name, _ in headers}
+        if "set-cookie" in header_names:
+            return None
+        vary = {v.strip().lower() for v in _header(headers, "Vary", "").split(",")}
+        if not vary <= {"", "accept-encoding"}:
+            return None
+
+        cache_control = parse_cache_control_header(
+            _header(headers, "Cache-Control"), cls=ResponseCacheControl
+        )
+        if not cache_control.public or cache_control.no_store or cache_control.no_cache:
+            return None
+        max_age = cache_control.s_maxage or cache_control.max_age
+        if not max_age or max_age <= 0:
+            return None
+
+        # Keep the identity body, and the variant flask-compress compressed it to
+        etag, weak = unquote_etag(_header(headers, "ETag"))
+        encoded = {}
+        if encoding := _header(headers, "Content-Encoding"):
+            encoded[encoding] = body
+            if (body := decode(body, encoding)) is None:
+                return None
+            if etag and etag.endswith(f":{encoding}"):
+                etag = etag[: -len(encoding) - 1]
+
+        stale_revalidate = _int(cache_control.get("stale-while-revalidate"))
+        stale_error = _int(cache_control.get("stale-if-error"))
+        now = time.monotonic()
+        entry = _CachedResponse(
+            status=status,
+            headers=[(k, v) for k, v in headers if k.lower() not in VARIANT_HEADERS],
+            variants=Variants(body, encoded),
+            etag=etag,
+            weak=bool(weak),
+            stored_at=now,
+            fresh_until=now + max_age,
+            revalidate_until=now + max_age + stale_revalidate,
+            error_until=now + max_age + stale_error,
+        )
+        self.cache.set(key, entry, ttl=max_age + max(stale_revalidate, stale_error))
+        if entry.variants.encodings:
+            get_refresh_executor().submit(self._precompress, key, entry.variants)
+        return entry
+
+    def _precompress(self, key: str, variants: Variants):
+        """
+        Encode a cached body in every encoding, then count the variants against the
+        cache's byte budget
+        """
+        try:
+            if variants.precompress():
+                self.cache.resize(key)
+        except Exception as e:
+            logging.warning("Failed to precompress the response for %s: %s", key, e)
+
+    def _serve(
+        self, entry: _CachedResponse, environ: dict, start_response
+    ) -> Iterable[bytes]:
+        encoding = choose_encoding(
+            environ.get("HTTP_ACCEPT_ENCODING"), entry.variants.available
+        )
+        encoding, body = entry.variants.get(encoding)
+
+        age = int(time.monotonic() - entry.stored_at)
+        headers = [
+            *entry.headers,
+            ("Content-Length", str(len(body))),
+            ("Age", str(age)),
+        ]
+        if encoding:
+            headers.append(("Content-Encoding", encoding))
+        if entry.etag:
+            etag = f"{entry.etag}:{encoding}" if encoding else entry.etag
+            headers.append(("ETag", quote_etag(etag, entry.weak)))
+            if _etag_matches(environ, etag):
+                self._count("not_modified")
+        return _respond(environ, start_response, entry.status, headers, body)
+
+    def _refresh(self, key: str, environ: dict):
+        """
+        Run the app again in the background for a stale response, unless it is
+        already being refreshed. The stale response is kept if the app fails.
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        # The request's input stream belongs to the server and is done with
+        environ = {**environ, "wsgi.input": io.BytesIO()}
+
+        def refresh():
+            try:
+                self._store(key, *self._run_app(environ))
+            except Exception as e:
+                logging.warning("Failed to refresh the response for %s: %s", key, e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        get_refresh_executor().submit(refresh)
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def clear(self):
+        """
+        Remove every cached response
+        """
+        self.cache.clear()
+        self.uncacheable.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.cache.name,
+                "size": len(self.cache),
+                "maxsize": self.cache.maxsize,
+                "bytes": self.cache.estimate_bytes(),
+                "maxbytes": self.cache.maxbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_hits": self.stale_hits,
+                "stale_errors": self.stale_errors,
+                "not_modified": self.not_modified,
+            }
+
+
+def _cache_key(environ: dict) -> str:
+    """
+    Get the key of a request's response: its URL. Responses are stored uncompressed,
+    the encoding is chosen for each request.
+    """
+    path = environ.get("SCRIPT_NAME", "") + environ.get("PATH_INFO", "")
+    if query := environ.get("QUERY_STRING"):
+        path += f"?{query}"
+    return path
+
+
+def _respond(
+    environ: dict, start_response, status: str, headers: list, body: bytes
+) -> Iterable[bytes]:
+    """
+    Send a buffered response, or 304 Not Modified if the client's copy is current
+    """
+    etag = _header(headers, "ETag")
+    if (
+        status.startswith("200")
+        and etag
+        and _etag_matches(environ, unquote_etag(etag)[0])
+    ):
+        headers = [(k, v) for k, v in headers if k.lower() not in ENTITY_HEADERS]
+        start_response("304 NOT MODIFIED", headers)
+        return []
+
+    start_response(status, headers)
+    return [body]
+
+
+def _etag_matches(environ: dict, etag: str) -> bool:
+    return parse_etags(environ.get("HTTP_IF_NONE_MATCH")).contains_weak(etag)
+
+
+def _header(headers: list[tuple[str, str]], name: str, default=None):
+    name = name.lower()
+    return next((v for k, v in headers if k.lower() == name), default)
+
+
+def _int(value) -> int:
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return 0
@@ -0,0 +1,34 @@
+import sys
+from typing import Any
+
+# Immutable values shared by every entry (small ints, None, booleans, interned
+# strings) are still counted, so sizes are an upper bound of the memory an entry holds
+_CONTAINERS = (dict, list, tuple, set, frozenset)
+
+
+def deep_sizeof(value: Any) -> int:
+    """
+    Estimate the memory held by a value, in bytes, following the containers it holds.
+    Values of the caches are parsed JSON (dicts, lists, strings and numbers), possibly
+    wrapped in tuples, which is what this is tailored for. Other objects are only
+    measured by sys.getsizeof, classes of cached values count what they hold by
+    overriding __sizeof__.
+    :param value: The value to measure
+    :return: The number of bytes
+    """
+    size = 0
+    seen = set()
+    stack = [value]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, _CONTAINERS):
+            stack.extend(obj)
+    return size
@@ -0,0 +1,64 @@
+from collections.abc import Hashable
+
+# Odd 64-bit multipliers, one per row of the sketch
+_SEEDS = (
+    0x9E3779B97F4A7C15,
+    0xC2B2AE3D27D4EB4F,
+    0x165667B19E3779F9,
+    0xD6E8FEB86659FD93,
+)
+_MASK64 = (1 << 64) - 1
+_MAX_COUNT = 15
+
+# Halves every counter of the table at once, with bytes.translate
+_HALVE = bytes(i >> 1 for i in range(256))
+
+
+class FrequencySketch:
+    """
+    Approximate access frequency of keys, for TinyLFU cache admission: a count-min
+    sketch of small saturating counters, all halved once sample_size accesses have
+    been counted, so the frequencies favour recent popularity.
+    Not thread-safe, the owner serializes calls.
+    """
+
+    def __init__(self, capacity: int):
+        """
+        :param capacity: The number of entries of the cache the sketch is used by
+        """
+        width = 16
+        while width < capacity:
+            width <<= 1
+        self._width = width
+        self._shift = 64 - width.bit_length() + 1
+        self._table = bytearray(width * len(_SEEDS))
+        self.sample_size = 10 * max(capacity, 1)
+        self._additions = 0
+
+    def _indexes(self, key: Hashable) -> list[int]:
+        h = hash(key) & _MASK64
+        return [
+            row * self._width + (((h * seed) & _MASK64) >> self._shift)
+            for row, seed in enumerate(_SEEDS)
+        ]
+
+    def increment(self, key: Hashable):
+        """
+        Count an access to a key
+        """
+        table = self._table
+        for index in self._indexes(key):
+            if table[index] < _MAX_COUNT:
+                table[index] += 1
+
+        self._additions += 1
+        if self._additions >= self.sample_size:
+            self._table = bytearray(self._table.translate(_HALVE))
+            self._additions //= 2
+
+    def estimate(self, key: Hashable) -> int:
+        """
+        Get the estimated number of recent accesses to a key
+        """
+        table = self._table
+        return min(table[index] for index in self._indexes(key))
@@ -0,0 +1,73 @@
+from collections import deque
+from collections.abc import Hashable
+from typing import Optional
+
+
+class WindowedRatio:
+    """
+    Hits and misses counted in fixed size time buckets, to report the hit ratio over
+    recent windows (e.g. the last minute or hour) rather than since the start.
+    Not thread-safe, the owner serializes calls.
+    """
+
+    def __init__(self, bucket_duration: float, max_window: float):
+        """
+        :param bucket_duration: The number of seconds counted by each bucket
+        :param max_window: The number of seconds of the longest window reported
+        """
+        self.bucket_duration = bucket_duration
+        # Each bucket holds [bucket number, hits, misses]
+        self._buckets: deque[list[int]] = deque(
+            maxlen=int(max_window // bucket_duration) + 1
+        )
+
+    def record(self, hit: bool, now: float):
+        bucket = int(now // self.bucket_duration)
+        if not self._buckets or self._buckets[-1][0] != bucket:
+            self._buckets.append([bucket, 0, 0])
+        self._buckets[-1][1 if hit else 2] += 1
+
+    def ratio(self, window: float, now: float) -> Optional[float]:
+        """
+        Get the hit ratio over the last window seconds
+        :return: The ratio, or None if there were no lookups
+        """
+        first = int((now - window) // self.bucket_duration) + 1
+        hits = misses = 0
+        for bucket, bucket_hits, bucket_misses in self._buckets:
+            if bucket >= first:
+                hits += bucket_hits
+                misses += bucket_misses
+        return hits / (hits + misses) if hits + misses else None
+
+
+class TopKeys:
+    """
+    Approximate most frequently looked up keys, with the Space-Saving algorithm: a
+    fixed number of keys are counted, and an unseen key replaces the least counted
+    one, inheriting its count. Frequent keys are reliably found, their counts may be
+    overestimated by at most the count they inherited.
+    Not thread-safe, the owner serializes calls.
+    """
+
+    def __init__(self, capacity: int):
+        """
+        :param capacity: The number of keys counted
+        """
+        self.capacity = capacity
+        self._counts: dict[Hashable, int] = {}
+
+    def add(self, key: Hashable):
+        if key in self._counts:
+            self._counts[key] += 1
+        elif len(self._counts) < self.capacity:
+            self._counts[key] = 1
+        else:
+            least = min(self._counts, key=self._counts.__getitem__)
+            self._counts[key] = self._counts.pop(least) + 1
+
+    def top(self, n: int) -> list[tuple[Hashable, int]]:
+        """
+        Get the n most looked up keys, with their approximate number of lookups
+        """
+        return sorted(self._counts.items(), key=lambda item: item[1], reverse=True)[:n]
@@ -0,0 +1,579 @@
+import json
+import logging
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, NamedTuple, Optional
+
+import config
+from app.api.singleflight import SingleFlight
+from app.cache.backends import CacheBackend, CacheBackendError
+from app.cache.sizing import deep_sizeof
+from app.cache.sketch import FrequencySketch
+from app.cache.stats import TopKeys, WindowedRatio
+
+_MISSING = object()
+
+# Loads a value on a miss, returning it with the number of seconds it stays fresh
+# (None for the cache's ttl)
+Loader = Callable[[], tuple[Any, Optional[float]]]
+
+_refresh_executor: Optional[ThreadPoolExecutor] = None
+_refresh_executor_lock = threading.Lock()
+
+
+def get_refresh_executor() -> ThreadPoolExecutor:
+    """
+    Get the worker pool refreshing stale entries of every cache in the background
+    """
+    global _refresh_executor
+    if _refresh_executor is None:
+        with _refresh_executor_lock:
+            if _refresh_executor is None:
+                _refresh_executor = ThreadPoolExecutor(
+                    max_workers=config.CACHE_REFRESH_WORKERS,
+                    thread_name_prefix="cache-refresh",
+                )
+    return _refresh_executor
+
+
+_registry: list[weakref.ref] = []
+_registry_lock = threading.Lock()
+
+
+def registered_caches() -> list["TTLCache"]:
+    """
+    Get every cache of the process, in the order they were created
+    """
+    with _registry_lock:
+        _registry[:] = [ref for ref in _registry if ref() is not None]
+        return [cache for ref in _registry if (cache := ref()) is not None]
+
+
+def _register(cache: "TTLCache"):
+    with _registry_lock:
+        _registry.append(weakref.ref(cache))
+
+
+class _Entry(NamedTuple):
+    expires_at: float  # monotonic time the value stops being fresh
+    stale_until: float  # monotonic time the value stops being served while reloading
+    value: Any  # as stored, compressed JSON for compressed caches
+    size: int  # estimated bytes held by the value, 0 without a byte budget
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after a time to live.
+    The cache is bounded by its number of entries, and optionally by the estimated
+    number of bytes its values hold, evicting least recently used entries until both
+    fit. A value larger than the whole byte budget is not kept.
+    With admission enabled (TinyLFU), a new entry only replaces the least recently
+    used ones if its key was looked up more often recently than theirs, so one-off
+    lookups of long tail keys do not flush popular entries.
+    Compressed caches hold their values as compressed JSON, decoded on every hit,
+    trading some CPU for fitting a much larger working set in the same memory.
+    Entries loaded by get_or_load may be served stale for a while after they expired,
+    while they are refreshed in the background (stale-while-revalidate). Caches
+    keeping expired entries hold on to them past that, until a load replaces them.
+    An optional second tier (L2), shared with the other workers, is read on a miss
+    and written through on every store.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int,
+        ttl: float,
+        stale: float = 0,
+        l2: Optional[CacheBackend] = None,
+        decode: Optional[Callable[[Any], Any]] = None,
+        maxbytes: Optional[int] = None,
+        sizeof: Callable[[Any], int] = deep_sizeof,
+        compress: bool = False,
+        admission: bool = False,
+        keep_expired: bool = False,
+        defer_refresh: Optional[Callable[[Hashable], bool]] = None,
+    ):
+        """
+        :param name: The name of the cache, used when reporting statistics and as the
+                     namespace of its keys in the second tier
+        :param maxsize: The maximum number of entries to hold
+        :param ttl: The default number of seconds an entry stays fresh
+        :param stale: The number of seconds an expired entry is still served by
+                      get_or_load, while it is refreshed in the background
+        :param l2: The second tier cache, values must be JSON serializable to use it
+        :param decode: Restores a value from its JSON form, when read from the second
+                       tier or from a compressed entry
+        :param maxbytes: The maximum number of bytes the values may hold, unbounded
+                         if None
+        :param sizeof: Estimates the number of bytes held by a value, only used with
+                       a byte budget
+        :param compress: Whether to hold values as compressed JSON, values must be
+                         JSON serializable
+        :param admission: Whether to admit new entries in a full cache by their
+                          frequency (TinyLFU) rather than always
+        :param keep_expired: Whether an entry past its stale window is kept until a
+                             load replaces it, or it is evicted for space. get_or_load
+                             reloads such an entry before returning it, and returns it
+                             as is if the load fails.
+        :param defer_refresh: Whether reloading an entry would fail anyway for now,
+                              e.g. while the upstream it is loaded from fails fast.
+                              Stale and kept entries are then returned by get_or_load
+                              without reloading them.
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale = stale
+        self.l2 = l2
+        self.decode = decode
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.compress = compress
+        self.keep_expired = keep_expired
+        self.defer_refresh = defer_refresh
+        self._sketch = FrequencySketch(maxsize) if admission else None
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+        self._flights = SingleFlight()
+        self._refreshing: set[Hashable] = set()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.l2_hits = 0
+        self.l2_errors = 0
+        self.oversized = 0
+        self.rejections = 0
+        self._ratios = WindowedRatio(
+            config.CACHE_STATS_BUCKET, max(config.CACHE_STATS_WINDOWS.values())
+        )
+        self._top_keys = TopKeys(config.CACHE_STATS_TOP_KEYS)
+        _register(self)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Get a fresh value from the cache
+        :param key: The key of the entry
+        :param default: The value to return if the entry is missing or expired
+        """
+        value, fresh, _ = self._lookup(key, allow_stale=False)
+        return value if fresh else default
+
+    def _lookup(self, key: Hashable, allow_stale: bool) -> tuple[Any, bool, bool]:
+        """
+        Look up an entry in this worker's cache, then in the second tier
+        :return: The value (or _MISSING), whether it is fresh, and whether it is past
+                 its stale window (only for caches keeping expired entries)
+        """
+        value, fresh, expired = self._get_local(key, allow_stale)
+        if value is not _MISSING:
+            return self._unpack(value), fresh, expired
+        if self.l2 is not None:
+            return (*self._get_l2(key, allow_stale), False)
+        return _MISSING, False, False
+
+    def _get_local(self, key: Hashable, allow_stale: bool) -> tuple[Any, bool, bool]:
+        now = time.monotonic()
+        with self._lock:
+            self._top_keys.add(key)
+            if self._sketch is not None:
+                self._sketch.increment(key)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._count_miss(now)
+                return _MISSING, False, False
+
+            expired = entry.stale_until <= now
+            if expired and not self.keep_expired:
+                self._remove(key)
+                self.expirations += 1
+                self._count_miss(now)
+                return _MISSING, False, False
+
+            fresh = entry.expires_at > now
+            if not fresh and not allow_stale:
+                self._count_miss(now)
+                return _MISSING, False, False
+
+            self._entries.move_to_end(key)
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+            self._ratios.record(True, now)
+            return entry.value, fresh, expired
+
+    def _count_miss(self, now: float):
+        self.misses += 1
+        self._ratios.record(False, now)
+
+    def _get_l2(self, key: Hashable, allow_stale: bool) -> tuple[Any, bool]:
+        try:
+            raw = self.l2.get(self._l2_key(key))
+        except CacheBackendError as e:
+            self._l2_failed(e)
+            return _MISSING, False
+        if raw is None:
+            return _MISSING, False
+
+        try:
+            expires_at, value = json.loads(raw)
+            ttl = expires_at - time.time()
+            if ttl + self.stale <= 0 or (ttl <= 0 and not allow_stale):
+                return _MISSING, False
+            if self.decode:
+                value = self.decode(value)
+        except (ValueError, TypeError, zlib.error) as e:
+            # A corrupt value, or one written by something else, is a miss
+            logging.warning(
+                "Cache %s: invalid second tier value %s: %s", self.name, key, e
+            )
+            with self._lock:
+                self.l2_errors += 1
+            self._delete_l2(key)
+            return _MISSING, False
+
+        self._set_local(key, value, ttl)
+        with self._lock:
+            self.l2_hits += 1
+        return value, ttl > 0
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        Store a value in the cache, evicting the least recently used entry when full
+        :param key: The key of the entry
+        :param value: The value to store
+        :param ttl: The number of seconds the entry stays fresh, defaults to the cache's ttl
+        """
+        ttl = self.ttl if ttl is None else ttl
+        self._set_local(key, value, ttl)
+        if self.l2 is None:
+            return
+
+        raw = json.dumps([time.time() + ttl, value]).encode()
+        try:
+            self.l2.set(self._l2_key(key), raw, ttl + self.stale)
+        except CacheBackendError as e:
+            self._l2_failed(e)
+
+    def _set_local(self, key: Hashable, value: Any, ttl: float):
+        value = self._pack(value)
+        size = self._sizeof(value)
+        expires_at = time.monotonic() + ttl
+        with self._lock:
+            replaced = self._remove(key) is not None
+            if self.maxbytes is not None and size > self.maxbytes:
+                self.oversized += 1
+                return
+            if not replaced and self._sketch is not None and not self._admit(key, size):
+                self.rejections += 1
+                return
+
+            entry = _Entry(expires_at, expires_at + self.stale, value, size)
+            self._entries[key] = entry
+            self._bytes += size
+            self._evict()
+
+    def _evict(self):
+        """
+        Evict least recently used entries until the cache fits, the lock must be held
+        """
+        while len(self._entries) > self.maxsize or self._over_budget():
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self.evictions += 1
+
+    def _admit(self, key: Hashable, size: int) -> bool:
+        """
+        Check whether a new entry may evict the entries it would replace: it must have
+        been looked up more often recently than each of them. The lock must be held.
+        """
+        now = time.monotonic()
+        frequency = self._sketch.estimate(key)
+        freed = 0
+        for evicted, (victim_key, victim) in enumerate(self._entries.items()):
+            fits = len(self._entries) - evicted < self.maxsize
+            if fits and not self._over_budget(size - freed):
+                return True
+            # Entries past their stale window make room regardless of their frequency
+            if (
+                victim.stale_until > now
+                and self._sketch.estimate(victim_key) >= frequency
+            ):
+                return False
+            freed += victim.size
+        return True
+
+    def _pack(self, value: Any) -> Any:
+        """
+        Convert a value to the form it is held in
+        """
+        if not self.compress:
+            return value
+        return zlib.compress(
+            json.dumps(value, separators=(",", ":")).encode(),
+            config.CACHE_COMPRESSION_LEVEL,
+        )
+
+    def _unpack(self, value: Any, decode: bool = True) -> Any:
+        """
+        Convert a held value back, to its JSON form only if decode is False
+        """
+        if not self.compress:
+            return value
+        value = json.loads(zlib.decompress(value))
+        return self.decode(value) if decode and self.decode else value
+
+    def _sizeof(self, value: Any) -> int:
+        return 0 if self.maxbytes is None else self.sizeof(value)
+
+    def _over_budget(self, extra: int = 0) -> bool:
+        return self.maxbytes is not None and self._bytes + extra > self.maxbytes
+
+    def _remove(self, key: Hashable) -> Optional[_Entry]:
+        """
+        Remove an entry, the lock must be held
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+        return entry
+
+    def _l2_key(self, key: Hashable) -> str:
+        return f"{self.name}:{key}"
+
+    def _l2_failed(self, error: CacheBackendError):
+        # The second tier is best effort, requests carry on without it
+        with self._lock:
+            self.l2_errors += 1
+        logging.debug("Cache %s: second tier unavailable: %s", self.name, error)
+
+    def get_or_load(self, key: Hashable, loader: Loader) -> Any:
+        """
+        Get a value from the cache, loading and storing it on a miss.
+        Concurrent misses for the same key share a single load, exceptions raised by
+        the loader are not cached. An expired value within the stale window is
+        returned at once, and reloaded in the background. A kept value past its stale
+        window is reloaded first, and only returned if that fails.
+        :param key: The key of the entry
+        :param loader: Returns the value, and the number of seconds it stays fresh
+                       (None for the cache's ttl)
+        :return: The value
+        """
+        allow_stale = self.stale > 0 or self.keep_expired
+        value, fresh, expired = self._lookup(key, allow_stale=allow_stale)
+        if value is _MISSING:
+            return self._flights.do(key, self._load, key, loader)
+        if fresh or (self.defer_refresh is not None and self.defer_refresh(key)):
+            return value
+        if not expired:
+            self._refresh(key, loader)
+            return value
+
+        try:
+            return self._flights.do(key, self._load, key, loader)
+        except Exception as e:
+            logging.warning("Cache %s: serving expired %s: %s", self.name, key, e)
+            return value
+
+    def _load(self, key: Hashable, loader: Loader):
+        value, ttl = loader()
+        self.set(key, value, ttl)
+        return value
+
+    def _refresh(self, key: Hashable, loader: Loader):
+        """
+        Reload a stale entry in the background, unless it is already being reloaded
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            self.refreshes += 1
+
+        def refresh():
+            try:
+                self._flights.do(key, self._load, key, loader)
+            except Exception as e:
+                # The stale value keeps being served until the end of its stale window,
+                # or until it is replaced in caches keeping expired entries
+                logging.warning("Cache %s: failed to refresh %s: %s", self.name, key, e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        get_refresh_executor().submit(refresh)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Remove an entry from the cache
+        :param key: The key of the entry
+        :return: The removed value, or default if there was no entry
+        """
+        with self._lock:
+            entry = self._remove(key)
+        if self.l2 is not None:
+            self._delete_l2(key)
+        return default if entry is None else self._unpack(entry.value)
+
+    def _delete_l2(self, key: Hashable):
+        try:
+            self.l2.delete(self._l2_key(key))
+        except CacheBackendError as e:
+            self._l2_failed(e)
+
+    def resize(self, key: Hashable):
+        """
+        Measure an entry again after its value grew or shrank in place, evicting least
+        recently used entries if the cache no longer fits its byte budget
+        :param key: The key of the entry
+        """
+        if self.maxbytes is None:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            size = self.sizeof(entry.value)
+            self._entries[key] = entry._replace(size=size)
+            self._bytes += size - entry.size
+            self._evict()
+
+    def dump(self, limit: int) -> list[tuple[Hashable, float, Any]]:
+        """
+        Get the most recently used entries that can still be served
+        :param limit: The maximum number of entries to return
+        :return: The (key, expires_at, value) of each entry, most recently used first,
+                 with expires_at as a wall clock timestamp
+        """
+        now = time.monotonic()
+        offset = time.time() - now
+        with self._lock:
+            entries = [
+                (key, entry.expires_at + offset, entry.value)
+                for key, entry in reversed(self._entries.items())
+                if entry.stale_until > now
+            ][:limit]
+        return [
+            (key, expires_at, self._unpack(value, decode=False))
+            for key, expires_at, value in entries
+        ]
+
+    def restore(self, entries: list[tuple[Hashable, float, Any]]) -> int:
+        """
+        Restore entries from a dump, without replacing entries stored since.
+        Restored entries are treated as the least recently used.
+        :param entries: The entries, as returned by dump
+        :return: The number of entries restored
+        """
+        now = time.monotonic()
+        offset = time.time() - now
+        candidates = []
+        for key, expires_at, value in entries:
+            expires_at -= offset
+            if expires_at + self.stale > now:
+                if self.compress:
+                    value = self._pack(value)
+                elif self.decode:
+                    value = self.decode(value)
+                entry = _Entry(expires_at, expires_at + self.stale, value, 0)
+                candidates.append((key, entry._replace(size=self._sizeof(value))))
+
+        restored = 0
+        with self._lock:
+            for key, entry in candidates:
+                if key in self._entries:
+                    continue
+                if len(self._entries) >= self.maxsize or self._over_budget(entry.size):
+                    break
+
+                self._entries[key] = entry
+                self._entries.move_to_end(key, last=False)
+                self._bytes += entry.size
+                restored += 1
+        return restored
+
+    def clear(self):
+        """
+        Remove every entry held by this worker, the second tier is left as is
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry.expires_at > time.monotonic()
+
+    def estimate_bytes(self, sample: int = 100) -> int:
+        """
+        Estimate the number of bytes held by the cache's values. Without a byte budget,
+        the size of the most recently used entries is extrapolated to the whole cache.
+        :param sample: The number of entries measured without a byte budget
+        """
+        if self.maxbytes is not None:
+            return self._bytes
+        with self._lock:
+            size = len(self._entries)
+            values = [e.value for e in islice(reversed(self._entries.values()), sample)]
+        if not values:
+            return 0
+        return sum(map(self.sizeof, values)) * size // len(values)
+
+    def hit_ratios(self) -> dict[str, Optional[float]]:
+        """
+        Get the hit ratio of lookups over each window of CACHE_STATS_WINDOWS, None for
+        windows without lookups. Stale hits count as hits.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                name: self._ratios.ratio(window, now)
+                for name, window in config.CACHE_STATS_WINDOWS.items()
+            }
+
+    def top_keys(self, n: int) -> list[tuple[Hashable, int]]:
+        """
+        Get the n most looked up keys, with their approximate number of lookups
+        """
+        with self._lock:
+            return self._top_keys.top(n)
+
+    def stats(self) -> dict:
+        """
+        Get the cache's size and hit/miss counters
+        """
+        with self._lock:
+            return {
+                "name": self.name,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "bytes": self._bytes,
+                "maxbytes": self.maxbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "stale_hits": self.stale_hits,
+                "refreshes": self.refreshes,
+                "l2_hits": self.l2_hits,
+                "l2_errors": self.l2_errors,
+                "oversized": self.oversized,
+                "rejections": self.rejections,
+            }
@@ -0,0 +1,118 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Optional
+
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from pymongo.synchronous.collection import Collection
+
+import config
+from config import Config
+
+_client: Optional[MongoClient] = None
+_client_lock = threading.Lock()
+
+_health: dict[str, Any] = {"ok": None, "latency_ms": None, "error": None}
+
+
+def get_client() -> MongoClient:
+    """
+    Get this process's MongoDB client, created on first use rather than on import, so
+    importing the app never waits on MongoDB. A forked worker creates its own client,
+    a client's connections and monitoring threads are not shared across a fork.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(
+                    Config.MONGO_URI,
+                    maxPoolSize=config.MONGO_MAX_POOL_SIZE,
+                    minPoolSize=config.MONGO_MIN_POOL_SIZE,
+                    connectTimeoutMS=config.MONGO_CONNECT_TIMEOUT * 1000,
+                    serverSelectionTimeoutMS=config.MONGO_SERVER_SELECTION_TIMEOUT
+                    * 1000,
+                    socketTimeoutMS=config.MONGO_SOCKET_TIMEOUT * 1000,
+                    appname="mal-stremio",
+                )
+    return _client
+
+
+def _forget_client():
+    """
+    Drop the parent's client in a forked child, without closing its connections
+    """
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_client)
+
+
+class LazyCollection:
+    """
+    A collection of this process's MongoDB client, resolved when first used, which
+    may stand in for a Collection at import time
+    """
+
+    def __init__(self, database: str, name: str):
+        """
+        :param database: The name of the database
+        :param name: The name of the collection
+        """
+        self.database = database
+        self.name = name
+        self._resolved: Optional[tuple[MongoClient, Collection]] = None
+
+    def collection(self) -> Collection:
+        client = get_client()
+        resolved = self._resolved
+        if resolved is None or resolved[0] is not client:
+            collection = client.get_database(self.database).get_collection(self.name)
+            resolved = self._resolved = (client, collection)
+        return resolved[1]
+
+    def __getattr__(self, attr: str) -> Any:
+        # Like Collection, private names are not sub-collections. Probing them (as
+        # mock.patch does) must not create the client.
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        return getattr(self.collection(), attr)
+
+
+def check_health() -> bool:
+    """
+    Ping MongoDB, which also opens the first pooled connection
+    :return: Whether MongoDB answered
+    """
+    start = time.perf_counter()
+    try:
+        get_client().admin.command("ping")
+        error = None
+    except PyMongoError as e:
+        error = str(e)
+        logging.error("MongoDB health check failed: %s", e)
+    _health.update(
+        ok=error is None,
+        latency_ms=round((time.perf_counter() - start) * 1000, 1),
+        error=error,
+    )
+    return error is None
+
+
+def start_health_check():
+    """
+    Check MongoDB in the background, so startup never waits on it
+    """
+    threading.Thread(target=check_health, name="mongo-health", daemon=True).start()
+
+
+def health() -> dict:
+    """
+    Get the result of the last health check
+    """
+    return dict(_health)
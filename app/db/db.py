@@ -1,30 +1,50 @@
 import re
-from functools import lru_cache
-from typing import Optional
+from collections.abc import Iterable
+from datetime import datetime, timedelta
+from typing import Any, Optional
 
-from pymongo import MongoClient
-from pymongo.synchronous.collection import Collection
-from pymongo.synchronous.database import Database
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
 
 import config
+from app.cache.backends import get_l2_backend
+from app.cache.ttl import TTLCache
+from app.db.connection import LazyCollection
+from app.db.id_index import IdIndex
+from app.db.users import SESSION_FIELDS, UserRepository
 from app.routes.utils import log_error
 from config import Config
 
-client: MongoClient = MongoClient(Config.MONGO_URI)
-db: Database = client.get_database(Config.MONGO_DB)
-anime_db: Database = client.get_database(Config.MONGO_ANIME_DB)
+# Resolved with this process's client when first used
+UID_map_collection = LazyCollection(Config.MONGO_DB, Config.MONGO_UID_MAP)
+anime_mapping = LazyCollection(Config.MONGO_ANIME_DB, Config.MONGO_ANIME_MAP)
 
-UID_map_collection: Collection = db.get_collection(Config.MONGO_UID_MAP)
-anime_mapping: Collection = anime_db.get_collection(Config.MONGO_ANIME_MAP)
+users = UserRepository(UID_map_collection)
 
+# Kitsu <-> MAL ID mappings, shared with the other workers through the second tier
+id_cache = TTLCache(
+    "anime_ids",
+    maxsize=config.ID_CACHE_SIZE,
+    ttl=config.ID_CACHE_DURATION,
+    l2=get_l2_backend(),
+    decode=tuple,
+)
 
-def get_user(user_id: str) -> Optional[dict]:
+# The whole Kitsu <-> MAL ID mapping, once loaded by the ID index refresher. Lookups
+# only fall back to id_cache and the database until then.
+id_index = IdIndex()
+
+
+def get_user(
+    user_id: str, fields: Optional[Iterable[str]] = SESSION_FIELDS
+) -> Optional[dict]:
     """
-    Get the user details from the database
+    Get the user details from the database, or the cache for session fields
     :param user_id: The user's MyAnimeList ID
+    :param fields: The fields to get, None for every field
     :return: The user details
     """
-    return UID_map_collection.find_one({"uid": user_id})
+    return users.get(user_id, fields)
 
 
 def store_user(user_details: dict) -> bool:
@@ -32,16 +52,105 @@ def store_user(user_details: dict) -> bool:
     Store user details in db
     :param user_details: The user details to store
     """
-    user_id = user_details["id"]
-    user_details["uid"] = user_id
-    data = user_details.copy()
+    return users.store(user_details)
+
+
+def mark_watchlist_changed(user_id: str):
+    """
+    Record that a user's list was changed, for the watchlist snapshots of every worker
+    :param user_id: The user's MyAnimeList ID
+    """
+    try:
+        users.mark_watchlist_changed(user_id)
+    except (
+        PyMongoError
+    ) as e:  # Other workers then only sync once their snapshot expires
+        log_error("DB_ERROR", f"Failed to mark the list of {user_id} changed", str(e))
+
+
+def find_expiring_users(
+    expires_before: datetime, limit: int, exclude: Iterable[str] = ()
+) -> list[dict]:
+    """
+    Find users whose access token expires before the given time, and is not being refreshed
+    :param expires_before: The time the tokens expire before
+    :param limit: The maximum number of users to return
+    :param exclude: The MyAnimeList IDs of users to leave out
+    :return: The users, with only their id and refresh token
+    """
+    token_expiry = {"$add": ["$last_updated", {"$multiply": ["$expires_in", 1000]}]}
+    query = {
+        "refresh_token": {"$exists": True},
+        "refresh_lock": {"$not": {"$gt": datetime.utcnow()}},
+        "$expr": {
+            "$and": [
+                {"$lt": [token_expiry, expires_before]},
+                # Skip tokens MAL already rejected, until the user logs in again
+                {"$ne": ["$refresh_token", "$rejected_refresh_token"]},
+            ]
+        },
+    }
+    if exclude:
+        query["uid"] = {"$nin": list(exclude)}
+    projection = {"_id": 0, "uid": 1, "refresh_token": 1}
+    return list(
+        UID_map_collection.find(query, projection).sort("last_updated", 1).limit(limit)
+    )
+
+
+def acquire_refresh_lock(
+    user_id: str, refresh_token: str, lease: float
+) -> Optional[dict]:
+    """
+    Lock a user's tokens for refreshing, so only one worker refreshes them
+    :param user_id: The user's MyAnimeList ID
+    :param refresh_token: The refresh token the caller is about to use
+    :param lease: The number of seconds the lock is held for, unless released earlier
+    :return: The locked user, or None if the user is locked by another worker or was
+             already refreshed
+    """
+    now = datetime.utcnow()
+    return UID_map_collection.find_one_and_update(
+        {
+            "uid": user_id,
+            "refresh_token": refresh_token,
+            "refresh_lock": {"$not": {"$gt": now}},
+        },
+        {"$set": {"refresh_lock": now + timedelta(seconds=lease)}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def complete_token_refresh(user_id: str, tokens: Optional[dict]) -> Optional[dict]:
+    """
+    Store a user's refreshed tokens, and release the refresh lock
+    :param user_id: The user's MyAnimeList ID
+    :param tokens: The refreshed tokens, or None if the refresh failed
+    :return: The updated user
+    """
+    update = {"$unset": {"refresh_lock": ""}}
+    if tokens:
+        update["$set"] = tokens
+    user = UID_map_collection.find_one_and_update(
+        {"uid": user_id}, update, return_document=ReturnDocument.AFTER
+    )
+    if tokens:
+        users.invalidate(user_id)
+    return user
+
+
+def load_id_mappings() -> list[dict]:
+    """
+    Get every Kitsu <-> MAL ID mapping from db
+    :return: The mappings, with only their mal_id and kitsu_id
+    """
+    return list(anime_mapping.find({}, {"_id": 0, "mal_id": 1, "kitsu_id": 1}))
 
-    if user := UID_map_collection.find_one({"uid": user_id}):
-        return UID_map_collection.update_one(user, {"$set": data}).acknowledged
-    return UID_map_collection.insert_one(data).acknowledged
+
+def _found(anime_id: Optional[int]) -> tuple[bool, str]:
+    return (True, anime_id) if anime_id else (False, "")
 
 
-@lru_cache(maxsize=config.ID_CACHE_SIZE)
 def get_kitsu_id_from_mal_id(mal_id) -> tuple[bool, str]:
     """
     Get kitsu_id from mal_id from db
@@ -49,6 +158,14 @@ def get_kitsu_id_from_mal_id(mal_id) -> tuple[bool, str]:
     :return: A tuple of (found, kitsu_id)
     """
     mal_id = re.sub(r"[^0-9]", "", str(mal_id))
+    if id_index.loaded:
+        return _found(id_index.kitsu_id(int(mal_id or 0)))
+    return id_cache.get_or_load(
+        f"mal:{mal_id}", lambda: (_find_kitsu_id_from_mal_id(mal_id), None)
+    )
+
+
+def _find_kitsu_id_from_mal_id(mal_id: str) -> tuple[bool, str]:
     try:
         mal_id = int(mal_id)
         if res := anime_mapping.find_one({"mal_id": mal_id}):
@@ -62,7 +179,6 @@ def get_kitsu_id_from_mal_id(mal_id) -> tuple[bool, str]:
     return False, ""
 
 
-@lru_cache(maxsize=config.ID_CACHE_SIZE)
 def get_mal_id_from_kitsu_id(kitsu_id) -> tuple[bool, str]:
     """
     Get mal_id from kitsu_id from db
@@ -70,6 +186,14 @@ def get_mal_id_from_kitsu_id(kitsu_id) -> tuple[bool, str]:
     :return: A tuple of (found, mal_id)
     """
     kitsu_id = re.sub(r"[^0-9]", "", str(kitsu_id))
+    if id_index.loaded:
+        return _found(id_index.mal_id(int(kitsu_id or 0)))
+    return id_cache.get_or_load(
+        f"kitsu:{kitsu_id}", lambda: (_find_mal_id_from_kitsu_id(kitsu_id), None)
+    )
+
+
+def _find_mal_id_from_kitsu_id(kitsu_id: str) -> tuple[bool, str]:
     try:
         kitsu_id = int(kitsu_id)
         res = anime_mapping.find_one({"kitsu_id": kitsu_id})
@@ -84,3 +208,60 @@ def get_mal_id_from_kitsu_id(kitsu_id) -> tuple[bool, str]:
     except ValueError:
         log_error("VALUE ERROR", f"Invalid Kitsu ID: {kitsu_id}", "Invalid Kitsu ID")
     return False, ""
+
+
+def get_kitsu_ids_from_mal_ids(mal_ids: Iterable) -> dict[Any, tuple[bool, str]]:
+    """
+    Get the kitsu_ids of many mal_ids at once, those not cached from db in one query
+    :param mal_ids: The MyAnimeList ids of the anime
+    :return: A tuple of (found, kitsu_id) for each of the given mal_ids
+    """
+    return _get_ids(mal_ids, "mal", "mal_id", "kitsu_id")
+
+
+def get_mal_ids_from_kitsu_ids(kitsu_ids: Iterable) -> dict[Any, tuple[bool, str]]:
+    """
+    Get the mal_ids of many kitsu_ids at once, those not cached from db in one query
+    :param kitsu_ids: The kitsu ids of the anime
+    :return: A tuple of (found, mal_id) for each of the given kitsu_ids
+    """
+    return _get_ids(kitsu_ids, "kitsu", "kitsu_id", "mal_id")
+
+
+def _get_ids(
+    anime_ids: Iterable, prefix: str, field: str, other_field: str
+) -> dict[Any, tuple[bool, str]]:
+    """
+    Resolve IDs with the ID index, or id_cache and one $in query per ID_BATCH_SIZE
+    IDs it misses, caching every ID queried (found or not)
+    :param prefix: The prefix of the IDs' keys in id_cache
+    :param field: The mapping field of the given IDs
+    :param other_field: The mapping field of the IDs resolved
+    """
+    digits = {anime_id: re.sub(r"[^0-9]", "", str(anime_id)) for anime_id in anime_ids}
+    if id_index.loaded:
+        # IdIndex.kitsu_id and IdIndex.mal_id are named after the field they resolve
+        lookup = getattr(id_index, other_field)
+        return {anime_id: _found(lookup(int(d or 0))) for anime_id, d in digits.items()}
+
+    resolved = {"": (False, "")}
+    missing = []
+    for d in set(digits.values()) - resolved.keys():
+        if (cached := id_cache.get(f"{prefix}:{d}")) is not None:
+            resolved[d] = cached
+        else:
+            missing.append(int(d))
+
+    missing.sort()
+    projection = {"_id": 0, field: 1, other_field: 1}
+    for i in range(0, len(missing), config.ID_BATCH_SIZE):
+        batch = missing[i : i + config.ID_BATCH_SIZE]
+        found = {}
+        for res in anime_mapping.find({field: {"$in": batch}}, projection):
+            # Like find_one, the first mapping of an ID wins
+            found.setdefault(res.get(field), res.get(other_field))
+        for anime_id in batch:
+            resolved[str(anime_id)] = _found(found.get(anime_id))
+            id_cache.set(f"{prefix}:{anime_id}", resolved[str(anime_id)])
+
+    return {anime_id: resolved[d] for anime_id, d in digits.items()}
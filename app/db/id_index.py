@@ -0,0 +1,183 @@
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left
+from collections.abc import Iterable, Sequence
+from typing import Any, Optional
+
+# 64-bit signed integers
+_TYPECODE = "q"
+
+# Header of index files: a magic number, then the number of MAL and of Kitsu IDs.
+# The arrays follow in native byte order, files are only shared on one machine.
+_HEADER = struct.Struct("=8sQQ")
+_MAGIC = b"IDINDEX1"
+
+# A reload with fewer mappings than this share of the index's is refused: it is far
+# more likely a failed or partial read of the mapping than anime removed from it
+MIN_RELOAD_RATIO = 0.5
+
+
+def _sorted_arrays(pairs: list[tuple[int, int]]) -> tuple[Sequence[int], ...]:
+    """
+    Sort pairs by their first ID, keeping the first pair of duplicated IDs
+    :return: The sorted first IDs, and the second IDs in the same order
+    """
+    pairs.sort(key=lambda pair: pair[0])
+    keys, values = array(_TYPECODE), array(_TYPECODE)
+    for key, value in pairs:
+        if not keys or keys[-1] != key:
+            keys.append(key)
+            values.append(value)
+    return keys, values
+
+
+def _find(arrays: tuple[Sequence[int], ...], key: int) -> Optional[int]:
+    keys, values = arrays
+    i = bisect_left(keys, key)
+    if i < len(keys) and keys[i] == key:
+        return values[i]
+    return None
+
+
+class IdIndex:
+    """
+    The whole MAL <-> Kitsu ID mapping held in memory, as two pairs of sorted integer
+    arrays (one per direction) searched by bisection. Tens of thousands of mappings
+    take well under a megabyte.
+    Loading builds new arrays and swaps them in at once, lookups are never blocked.
+    An empty mapping, or one much smaller than the index, is refused and the index
+    keeps its mappings.
+    An index can be saved to a file that other processes map read-only, sharing its
+    pages rather than each holding a copy.
+    """
+
+    def __init__(self):
+        empty = (array(_TYPECODE), array(_TYPECODE))
+        self._by_mal = empty
+        self._by_kitsu = empty
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def load(
+        self, mappings: Iterable[dict[str, Any]], baseline: Optional[int] = None
+    ) -> int:
+        """
+        Replace the index with a new mapping
+        :param mappings: Documents of the mapping collection, with their mal_id and
+                         kitsu_id, either of which may be missing
+        :param baseline: The number of mappings the new mapping is checked against,
+                         the index's by default
+        :return: The number of mappings loaded
+        :raises ValueError: If the mapping is empty or much smaller than the baseline
+        """
+        pairs = []
+        for mapping in mappings:
+            try:
+                mal_id = int(mapping.get("mal_id") or 0)
+                kitsu_id = int(mapping.get("kitsu_id") or 0)
+            except (TypeError, ValueError):
+                continue
+            if mal_id and kitsu_id:
+                pairs.append((mal_id, kitsu_id))
+
+        by_mal = _sorted_arrays(pairs)
+        by_kitsu = _sorted_arrays([(kitsu_id, mal_id) for mal_id, kitsu_id in pairs])
+        with self._lock:
+            self._check_size(len(by_mal[0]), baseline)
+            self._by_mal, self._by_kitsu = by_mal, by_kitsu
+            self.loaded = True
+        return len(pairs)
+
+    def save(self, path: str):
+        """
+        Write the index to a file, atomically replacing the previous one, so processes
+        mapping the file never see it partially written
+        """
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".id-index-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(
+                    _HEADER.pack(_MAGIC, len(self._by_mal[0]), len(self._by_kitsu[0]))
+                )
+                for ids in (*self._by_mal, *self._by_kitsu):
+                    f.write(ids)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def map(self, path: str) -> int:
+        """
+        Replace the index with the one saved in a file, mapped read-only in memory.
+        Lookups read the mapped pages, shared by every process mapping the file.
+        :return: The number of mappings mapped
+        :raises ValueError: If the file is not a valid index, or is empty or much
+                            smaller than the index
+        """
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, mal_count, kitsu_count = (
+                _HEADER.unpack_from(buffer)
+                if len(buffer) >= _HEADER.size
+                else (b"", 0, 0)
+            )
+            itemsize = array(_TYPECODE).itemsize
+            size = _HEADER.size + 2 * (mal_count + kitsu_count) * itemsize
+            if magic != _MAGIC or len(buffer) != size:
+                raise ValueError(f"{path} is not an ID index")
+
+            with self._lock:
+                self._check_size(mal_count, None)
+                ids = memoryview(buffer)[_HEADER.size :].cast(_TYPECODE)
+                by_kitsu = ids[2 * mal_count :]
+                # Previous mappings are unmapped once no lookup uses them anymore
+                self._by_mal = (ids[:mal_count], ids[mal_count : 2 * mal_count])
+                self._by_kitsu = (by_kitsu[:kitsu_count], by_kitsu[kitsu_count:])
+                self.loaded = True
+        except ValueError:
+            buffer.close()
+            raise
+        return mal_count
+
+    def _check_size(self, size: int, baseline: Optional[int]):
+        """
+        Check the number of MAL IDs of a new mapping, the lock must be held
+        """
+        baseline = len(self) if baseline is None else baseline
+        if size == 0 or size < baseline * MIN_RELOAD_RATIO:
+            raise ValueError(
+                f"Refusing to replace {baseline} ID mappings with {size}, "
+                "keeping the previous ones"
+            )
+
+    def kitsu_id(self, mal_id: int) -> Optional[int]:
+        """
+        Get the Kitsu ID of an anime
+        :return: The Kitsu ID, or None if the MAL ID has no mapping
+        """
+        return _find(self._by_mal, mal_id)
+
+    def mal_id(self, kitsu_id: int) -> Optional[int]:
+        """
+        Get the MAL ID of an anime
+        :return: The MAL ID, or None if the Kitsu ID has no mapping
+        """
+        return _find(self._by_kitsu, kitsu_id)
+
+    def __len__(self) -> int:
+        return len(self._by_mal[0])
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Get the number of bytes held by the arrays, or mapped
+        """
+        arrays = (*self._by_mal, *self._by_kitsu)
+        return sum(len(a) * a.itemsize for a in arrays)
@@ -0,0 +1,122 @@
+import time
+from collections.abc import Iterable
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pymongo.synchronous.collection import Collection
+
+import config
+from app.cache.ttl import TTLCache
+
+TOKEN_FIELDS = ("access_token", "refresh_token", "expires_in", "last_updated")
+OPTION_FIELDS = (
+    "sort_watchlist",
+    "fetch_streams",
+    "track_unlisted_anime",
+    "nsfw_enabled",
+    "catalogs",
+)
+# When the user's list was last changed through the addon, by any worker
+WATCHLIST_FIELDS = ("watchlist_changed_at",)
+# The fields addon requests need: the user's tokens, addon options and list changes
+SESSION_FIELDS = ("uid", *TOKEN_FIELDS, *OPTION_FIELDS, *WATCHLIST_FIELDS)
+# The fields the configure page shows and stores back
+PROFILE_FIELDS = ("id", "uid", "name", "picture", *OPTION_FIELDS)
+
+
+class UserRepository:
+    """
+    Users' MyAnimeList details and addon options, stored by their MyAnimeList ID.
+    Lookups of session fields are served from a short lived in-process cache, so most
+    addon requests do not query the database for the user. This worker's writes
+    invalidate the cache, other workers see them once their cached copy expires.
+    A user is never cached past the expiry of their access token, so an expired token
+    is always checked against the database before refreshing it.
+    """
+
+    def __init__(
+        self,
+        collection: Collection,
+        ttl: float = config.USER_CACHE_DURATION,
+        maxsize: int = config.USER_CACHE_SIZE,
+    ):
+        """
+        :param collection: The collection of users
+        :param ttl: The number of seconds users are cached for
+        :param maxsize: The maximum number of users cached
+        """
+        self.collection = collection
+        self.cache = TTLCache("users", maxsize=maxsize, ttl=ttl)
+
+    def get(
+        self, user_id: str, fields: Optional[Iterable[str]] = SESSION_FIELDS
+    ) -> Optional[dict]:
+        """
+        Get a user
+        :param user_id: The user's MyAnimeList ID
+        :param fields: The fields to get, None for the whole document. Session fields
+                       are served from the cache.
+        :return: The user with the fields it has among those asked for and its uid,
+                 or None if there is no such user
+        """
+        if fields is None:
+            return self.collection.find_one({"uid": user_id})
+
+        fields = {"uid", *fields}
+        if not fields.issubset(SESSION_FIELDS):
+            projection = {"_id": 0, **dict.fromkeys(fields, 1)}
+            return self.collection.find_one({"uid": user_id}, projection)
+
+        user = self.cache.get_or_load(user_id, lambda: self._load_session(user_id))
+        if user is None:
+            return None
+        # A copy, callers may update the user
+        return {field: user[field] for field in fields if field in user}
+
+    def _load_session(self, user_id: str) -> tuple[Optional[dict], float]:
+        projection = {"_id": 0, **dict.fromkeys(SESSION_FIELDS, 1)}
+        user = self.collection.find_one({"uid": user_id}, projection)
+        if user is None:
+            # Not cached, the user may be logging in with another worker
+            return None, 0
+
+        ttl = self.cache.ttl
+        if user.get("last_updated") and user.get("expires_in"):
+            expires_at = user["last_updated"] + timedelta(seconds=user["expires_in"])
+            token_ttl = (expires_at - datetime.utcnow()).total_seconds()
+            ttl = max(min(ttl, token_ttl), 0)
+        return user, ttl
+
+    def store(self, user_details: dict) -> bool:
+        """
+        Insert or update a user in a single round-trip
+        :param user_details: The user details to store, with the user's MyAnimeList
+                             ID as "id". The uid field is set from it.
+        :return: Whether the write was acknowledged
+        """
+        user_id = user_details["id"]
+        user_details["uid"] = user_id
+        data = {key: value for key, value in user_details.items() if key != "_id"}
+
+        result = self.collection.update_one(
+            {"uid": user_id}, {"$set": data}, upsert=True
+        )
+        self.invalidate(user_id)
+        return result.acknowledged
+
+    def mark_watchlist_changed(self, user_id: str):
+        """
+        Record that a user's list was changed, so every worker syncs its snapshot of
+        the list. Other workers see it once their cached copy of the user expires.
+        :param user_id: The user's MyAnimeList ID
+        """
+        self.collection.update_one(
+            {"uid": user_id}, {"$set": {"watchlist_changed_at": time.time()}}
+        )
+        self.invalidate(user_id)
+
+    def invalidate(self, user_id: str):
+        """
+        Drop a user from the cache, after they were updated
+        """
+        self.cache.pop(user_id)
@@ -1,5 +1,8 @@
-from app.api.mal import MyAnimeListAPI
+from app.api.mal import AsyncMyAnimeListAPI, MyAnimeListAPI
+from app.api.watchlist import WatchlistStore
 
 mal_client = MyAnimeListAPI()
+async_mal_client = AsyncMyAnimeListAPI()
+watchlists = WatchlistStore(async_mal_client)
 MAL_ID_PREFIX = "mal"
 IMDB_ID_PREFIX = "tt"
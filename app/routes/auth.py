@@ -5,9 +5,12 @@ import requests
 from flask import Blueprint, flash, request, session, url_for
 from werkzeug.utils import redirect
 
+from app.api.breaker import CircuitOpenError
+from app.api.scheduler import RateLimitExceeded
 from app.db.db import get_user, store_user
 from app.routes import mal_client
 from app.routes.utils import handle_auth_error
+from app.tasks.token_refresh import token_refresher
 
 auth_blueprint = Blueprint("auth", __name__)
 
@@ -37,9 +40,13 @@ def get_valid_user(
         return {}, "Invalid MAL session. Please refresh or login again."
 
     expiration_date = user["last_updated"] + timedelta(seconds=user["expires_in"])
-    if datetime.utcnow() > expiration_date:
-        return {}, "MAL session expired. Please refresh or login again."
-    return user, None
+    if datetime.utcnow() <= expiration_date:
+        return user, None
+
+    # Tokens are normally refreshed in the background before they expire
+    if user.get("refresh_token") and (refreshed := token_refresher.refresh_user(user)):
+        return refreshed, None
+    return {}, "MAL session expired. Please refresh or login again."
 
 
 @auth_blueprint.route("/authorization", methods=["GET", "POST"])
@@ -107,6 +114,9 @@ def callback():
         return redirect(url_for("index"))
     except requests.HTTPError as e:
         return handle_auth_error(e)
+    except (RateLimitExceeded, CircuitOpenError):
+        flash("MyAnimeList is busy right now, please try again shortly.", "warning")
+        return redirect(url_for("index"))
 
 
 @auth_blueprint.route("/refresh")
@@ -119,30 +129,29 @@ def refresh_token():
         flash("Session expired! Please log in to MyAnimeList again.", "danger")
         return redirect(url_for("index"))
 
-    try:
-        user_auth_data = mal_client.refresh_token(user_session["refresh_token"])
-        user_details = {
-            "id": user_session["uid"],
-            "access_token": user_auth_data["access_token"],
-            "refresh_token": user_auth_data["refresh_token"],
-            "expires_in": user_auth_data["expires_in"],
-            "last_updated": datetime.utcnow(),
-        }
+    # The tokens are rotated in the background, so the session's refresh token may
+    # be out of date. The stored one is refreshed, sharing the background refresh's lock.
+    if not (user := get_user(user_session["uid"], fields=None)):
+        flash("No user found. Please re-login to MyAnimeList.", "danger")
+        return redirect(url_for("index"))
 
-        if not store_user(user_details):
-            flash("Failed to update user details.", "danger")
-            return redirect(url_for("index"))
+    try:
+        refreshed = token_refresher.refresh_user(user)
+    except (RateLimitExceeded, CircuitOpenError):
+        flash("MyAnimeList is busy right now, please try again shortly.", "warning")
+        return redirect(url_for("index"))
 
-        _store_user_session(
-            {
-                "uid": user_session["uid"],
-                "refresh_token": user_auth_data["refresh_token"],
-            }
+    if not refreshed:
+        flash(
+            "Failed to refresh the MyAnimeList session. Please log in again.", "danger"
         )
-        flash("MyAnimeList session refreshed.", "success")
         return redirect(url_for("index"))
-    except requests.HTTPError as e:
-        return handle_auth_error(e)
+
+    _store_user_session(
+        {"uid": user_session["uid"], "refresh_token": refreshed["refresh_token"]}
+    )
+    flash("MyAnimeList session refreshed.", "success")
+    return redirect(url_for("index"))
 
 
 @auth_blueprint.route("/logout")
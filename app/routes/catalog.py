@@ -1,7 +1,9 @@
 import ast
+import asyncio
 import random
 import re
 import urllib.parse
+from concurrent.futures import Future
 from typing import Optional
 
 import requests
@@ -9,10 +11,15 @@ from flask import Blueprint, Request, abort, request, url_for
 
 import config
 
-from . import MAL_ID_PREFIX, mal_client
+from ..api.breaker import CircuitOpenError
+from ..api.mal import QUERY_LIMIT
+from ..api.scheduler import RateLimitExceeded
+from ..cache.ttl import get_refresh_executor
+from ..db import db
+from . import MAL_ID_PREFIX, mal_client, watchlists
 from .auth import get_valid_user
 from .manifest import MANIFEST
-from .utils import handle_api_error, respond_with
+from .utils import handle_api_error, log_error, respond_with
 
 catalog_bp = Blueprint("catalog", __name__)
 
@@ -70,20 +77,29 @@ def addon_catalog(
         sort = user.get("sort_watchlist", config.DEFAULT_SORT_OPTION)
         nsfw_enabled = user.get("nsfw_enabled", False)
         response_data = _fetch_anime_list(
-            token, search, catalog_id, offset, sort=sort, nsfw=nsfw_enabled
+            user_id,
+            token,
+            search,
+            catalog_id,
+            offset,
+            sort=sort,
+            nsfw=nsfw_enabled,
+            changed_at=user.get("watchlist_changed_at", 0),
         )
 
-        anime_list = [x["node"] for x in response_data.get("data", [])]
-        filtered_anime_list = filter(lambda x: _has_genre_tag(x, genre), anime_list)
+        transport_url = _get_transport_url(request, user_id)
+        anime_list = (x["node"] for x in response_data.get("data", []))
         meta_previews = [
             _mal_to_meta(
                 anime_item,
                 catalog_type=catalog_type,
                 catalog_id=catalog_id,
-                transport_url=_get_transport_url(request, user_id),
+                transport_url=transport_url,
             )
-            for anime_item in filtered_anime_list
+            for anime_item in anime_list
+            if _has_genre_tag(anime_item, genre)
         ]
+        _prime_kitsu_ids([meta["id"] for meta in meta_previews if meta["id"]])
 
         return respond_with(
             {"metas": meta_previews},
@@ -98,6 +114,24 @@ def addon_catalog(
     except requests.HTTPError as e:
         handle_api_error(e)
         return respond_with({"metas": []}), e.response.status_code
+    except (RateLimitExceeded, CircuitOpenError) as e:
+        return respond_with({"metas": [], "message": str(e)}), 503
+
+
+def _prime_kitsu_ids(meta_ids: list[str]):
+    """
+    Resolve the Kitsu IDs of a catalog page in the background, in a single query, so
+    the metas and streams requested next from the page find them cached
+    """
+    if db.id_index.loaded or not meta_ids:
+        return  # Resolved in memory anyway
+    future = get_refresh_executor().submit(db.get_kitsu_ids_from_mal_ids, meta_ids)
+    future.add_done_callback(_log_priming_error)
+
+
+def _log_priming_error(future: Future):
+    if e := future.exception():
+        log_error("DB_ERROR", "Failed to resolve the Kitsu IDs of a catalog", str(e))
 
 
 def _get_transport_url(req: Request, user_id: str, parameters: str = ""):
@@ -130,7 +164,9 @@ def _has_genre_tag(meta: dict, genre: str = ""):
     )
 
 
-def _fetch_anime_list(token, search, catalog_id, offset, nsfw=False, **kwargs):
+def _fetch_anime_list(
+    user_id, token, search, catalog_id, offset, nsfw=False, changed_at=0, **kwargs
+):
     if search and len(search) < 3:
         raise ValueError("Search query must be at least 3 characters long")
 
@@ -145,13 +181,19 @@ def _fetch_anime_list(token, search, catalog_id, offset, nsfw=False, **kwargs):
             **kwargs,
         )
 
-    return mal_client.get_user_anime_list(
-        token,
-        status=catalog_id,
-        offset=offset,
-        fields=return_fields,
-        nsfw=nsfw,
-        **kwargs,
+    # Watchlists are paged locally from a snapshot of the user's full list, the
+    # pages of a long list are fetched concurrently
+    return asyncio.run(
+        watchlists.get_page(
+            user_id,
+            token,
+            status=catalog_id,
+            sort=kwargs.get("sort", config.DEFAULT_SORT_OPTION),
+            offset=int(offset or 0),
+            limit=QUERY_LIMIT,
+            nsfw=nsfw,
+            changed_at=changed_at,
+        )
     )
 
 
@@ -7,8 +7,10 @@ from flask import Blueprint
 from requests import HTTPError
 
 import config
-from app.db.db import get_mal_id_from_kitsu_id
-from app.routes import MAL_ID_PREFIX, mal_client
+from app.api.breaker import CircuitOpenError
+from app.api.scheduler import RateLimitExceeded
+from app.db.db import get_mal_id_from_kitsu_id, mark_watchlist_changed
+from app.routes import MAL_ID_PREFIX, mal_client, watchlists
 from app.routes.auth import get_valid_user
 from app.routes.manifest import MANIFEST
 from app.routes.utils import handle_api_error, respond_with
@@ -106,12 +108,18 @@ def addon_content_sync(
             start_date=start_date,
             finish_date=finish_date,
         )
+        watchlists.mark_stale(user_id)
+        mark_watchlist_changed(user_id)
         return respond_with(_create_sync_response(status=UpdateStatus.OK))
     except HTTPError as err:
         handle_api_error(err)
         return respond_with(
             _create_sync_response(status=UpdateStatus.FAIL),
         )
+    except (RateLimitExceeded, CircuitOpenError) as err:
+        return respond_with(
+            _create_sync_response(status=UpdateStatus.FAIL, message=str(err)),
+        )
 
 
 def determine_watch_dates(
@@ -122,7 +122,7 @@ def addon_configured_manifest(user_id: str):
     :param user_id: The user's MyAnimeList ID
     :return: JSON response
     """
-    user = get_user(user_id)
+    user = get_user(user_id, fields=["catalogs"])
     if not user:
         return respond_with(
             {"error": f"User ID: {user_id} not found"}, private=True, cache_max_age=1800
@@ -1,20 +1,35 @@
-import functools
-
 import requests
 from flask import Blueprint, abort
 
 import config
 
+from ..api.upstream import UpstreamResponse, fetch_json, upstream_unavailable
+from ..cache.backends import get_l2_backend
+from ..cache.ttl import TTLCache
 from ..db.db import get_kitsu_id_from_mal_id
 from . import IMDB_ID_PREFIX, MAL_ID_PREFIX
 from .auth import get_valid_user
 from .manifest import MANIFEST
-from .utils import handle_api_error, respond_with
+from .utils import log_error, respond_with
 
 meta_bp = Blueprint("meta", __name__)
 
 KITSU_API = "https://anime-kitsu.strem.fun/meta"
 
+kitsu_cache = TTLCache(
+    "kitsu_meta",
+    maxsize=config.META_CACHE_SIZE,
+    ttl=config.META_ON_SUCCESS_DURATION,
+    stale=config.DEFAULT_STALE_WHILE_REVALIDATE,
+    l2=get_l2_backend(),
+    decode=UpstreamResponse._make,
+    maxbytes=config.META_CACHE_MAX_BYTES,
+    compress=True,
+    admission=True,
+    keep_expired=True,
+    defer_refresh=upstream_unavailable,
+)
+
 
 @meta_bp.route("/<_user_id>/meta/<meta_type>/<meta_id>.json")
 def addon_meta(_user_id: str, meta_type: str, meta_id: str):
@@ -51,8 +66,14 @@ def addon_meta(_user_id: str, meta_type: str, meta_id: str):
         else:
             url += f"kitsu:{kitsu_id}.json"
 
-        resp = fetch_from_kitsu_api(url)
-        meta = kitsu_to_meta(resp.json())
+        result = fetch_from_kitsu_api(url)
+        if not result.ok:
+            status_code = result.status_code if result.status_code >= 400 else 502
+            log_error("KITSU_ERROR", f"Failed to fetch {url}", "", status_code)
+            message = f"Kitsu responded with {status_code}"
+            return respond_with({"meta": {}, "message": message}), status_code
+
+        meta = kitsu_to_meta(result.data)
         meta["id"] = meta_id
         meta["type"] = meta_type
         return respond_with(
@@ -62,15 +83,14 @@ def addon_meta(_user_id: str, meta_type: str, meta_id: str):
             stale_error=config.META_ON_SUCCESS_DURATION,
             stremio_response=True,
         )
-    except requests.HTTPError as e:
-        handle_api_error(e)
-        return respond_with({"meta": {}, "message": str(e)}), e.response.status_code
+    except requests.RequestException as e:
+        # Kitsu is unreachable, or its circuit is open
+        return respond_with({"meta": {}, "message": str(e)}), 503
 
 
-@functools.lru_cache(maxsize=config.META_CACHE_SIZE)
-def fetch_from_kitsu_api(url: str):
-    """Fetch metadata from kitsu API and cache the response"""
-    return requests.get(url=url, headers=config.REQ_HEADERS, timeout=10)
+def fetch_from_kitsu_api(url: str) -> UpstreamResponse:
+    """Fetch metadata from kitsu API and cache the parsed response"""
+    return fetch_json(kitsu_cache, url, ttl=config.META_ON_SUCCESS_DURATION)
 
 
 def kitsu_to_meta(kitsu_meta: dict) -> dict:
@@ -0,0 +1,85 @@
+import hmac
+
+from flask import Blueprint, abort, current_app, request
+
+from config import Config
+
+from ..api import transport
+from ..api.mal import scheduler
+from ..cache.responses import ResponseCache
+from ..cache.ttl import TTLCache, registered_caches
+from ..db import connection
+from ..tasks.cache_snapshot import cache_snapshotter
+from ..tasks.id_index_refresh import id_index_refresher
+from ..tasks.token_refresh import token_refresher
+from .utils import respond_with
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+@metrics_bp.route("/metrics")
+def addon_metrics():
+    """
+    Provides operational metrics of the addon, only available to operators
+    :return: JSON response
+    """
+    _require_operator()
+    response_cache = current_app.wsgi_app
+    return respond_with(
+        {
+            "mal_scheduler": scheduler.stats(),
+            "upstreams": transport.breaker_stats(),
+            "mongo": connection.health(),
+            "token_refresh": token_refresher.stats(),
+            "cache_snapshot": cache_snapshotter.stats(),
+            "id_index": id_index_refresher.stats(),
+            "caches": [cache.stats() for cache in registered_caches()],
+            "response_cache": response_cache.stats()
+            if isinstance(response_cache, ResponseCache)
+            else None,
+        }
+    )
+
+
+@metrics_bp.route("/metrics/caches")
+def cache_metrics():
+    """
+    Provides the statistics of every cache of the addon (IDs, metas, streams,
+    watchlists, ...), with hit ratios over recent windows and the most looked up
+    keys, only available to operators
+    :return: JSON response
+    """
+    _require_operator()
+    top = request.args.get("top", default=10, type=int)
+    return respond_with(
+        {"caches": [_cache_report(cache, top) for cache in registered_caches()]}
+    )
+
+
+def _cache_report(cache: TTLCache, top: int) -> dict:
+    stats = cache.stats()
+    lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+    return {
+        **stats,
+        "bytes": cache.estimate_bytes(),
+        "hit_ratio": (stats["hits"] + stats["stale_hits"]) / lookups
+        if lookups
+        else None,
+        "hit_ratios": cache.hit_ratios(),
+        "top_keys": [
+            {"key": key, "lookups": count} for key, count in cache.top_keys(top)
+        ],
+    }
+
+
+def _require_operator():
+    """
+    Abort the request unless it carries the operator's metrics token.
+    Metrics are disabled entirely when no token is configured.
+    """
+    if not Config.METRICS_TOKEN:
+        abort(404)
+
+    auth_header = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(auth_header, f"Bearer {Config.METRICS_TOKEN}"):
+        abort(403)
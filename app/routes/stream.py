@@ -1,15 +1,17 @@
-import functools
 import urllib.parse
 
 import requests
 from flask import Blueprint
 
 import config
+from app.api.upstream import UpstreamResponse, fetch_json, upstream_unavailable
+from app.cache.backends import get_l2_backend
+from app.cache.ttl import TTLCache
 from app.db.db import get_kitsu_id_from_mal_id
 from app.routes import IMDB_ID_PREFIX, MAL_ID_PREFIX
 from app.routes.auth import get_valid_user
 from app.routes.manifest import MANIFEST
-from app.routes.utils import handle_api_error, respond_with
+from app.routes.utils import log_error, respond_with
 
 stream_bp = Blueprint("stream", __name__)
 
@@ -21,6 +23,20 @@ providers = (
 quality_filters = "3Dbrremux,hdrall,dolbyvision,dolbyvisionwithhdr,threed"
 TORRENTIO_API = f"https://torrentio.strem.fun/providers={providers}|qualityfilter={quality_filters}|limit={limit}"
 
+stream_cache = TTLCache(
+    "torrentio_streams",
+    maxsize=config.STREAM_CACHE_SIZE,
+    ttl=config.STREAM_ON_SUCCESS_DURATION,
+    stale=config.STREAM_STALE_WHILE_REVALIDATE,
+    l2=get_l2_backend(),
+    decode=UpstreamResponse._make,
+    maxbytes=config.STREAM_CACHE_MAX_BYTES,
+    compress=True,
+    admission=True,
+    keep_expired=True,
+    defer_refresh=upstream_unavailable,
+)
+
 
 @stream_bp.route("/<user_id>/stream/<content_type>/<content_id>.json")
 def addon_stream(user_id: str, content_type: str, content_id: str):
@@ -82,14 +98,18 @@ def addon_stream(user_id: str, content_type: str, content_id: str):
 
     try:
         url = f"{TORRENTIO_API}/stream/{content_type}/kitsu:{kitsu_id}.json"
-        resp = fetch_streams(url)
-        resp.raise_for_status()
-        return respond_with(resp.json())
-    except requests.HTTPError as e:
-        handle_api_error(e)
+        result = fetch_streams(url)
+        if not result.ok:
+            log_error(
+                "TORRENTIO_ERROR", f"Failed to fetch {url}", "", result.status_code
+            )
+            return respond_with({"streams": [], "message": "Failed to fetch streams"})
+        return respond_with(result.data)
+    except requests.RequestException:
+        # Torrentio is unreachable, or its circuit is open
         return respond_with({"streams": [], "message": "Failed to fetch streams"})
 
 
-@functools.lru_cache(maxsize=config.STREAM_CACHE_SIZE)
-def fetch_streams(url):
-    return requests.get(url, headers=config.REQ_HEADERS, timeout=10)
+def fetch_streams(url) -> UpstreamResponse:
+    """Fetch streams from Torrentio and cache the parsed response"""
+    return fetch_json(stream_cache, url, ttl=config.STREAM_ON_SUCCESS_DURATION)
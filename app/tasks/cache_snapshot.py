@@ -0,0 +1,171 @@
+import atexit
+import gzip
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Optional
+
+import config
+from app.cache.ttl import TTLCache
+from app.db.db import id_cache
+from app.routes.meta import kitsu_cache
+from app.routes.stream import stream_cache
+
+SNAPSHOT_VERSION = 1
+
+
+class CacheSnapshotter:
+    """
+    Periodically saves the most recently used entries of in-process caches to a local
+    file, and restores them when a worker starts, so a redeployed or restarted worker
+    does not start with empty caches.
+    Entries keep their expiry time, entries which expired in the meantime are dropped.
+    """
+
+    def __init__(
+        self,
+        caches: list[TTLCache],
+        path: str = config.CACHE_SNAPSHOT_PATH,
+        interval: float = config.CACHE_SNAPSHOT_INTERVAL,
+        max_entries: int = config.CACHE_SNAPSHOT_MAX_ENTRIES,
+    ):
+        """
+        :param caches: The caches to snapshot, their keys and values must be JSON
+                       serializable and their names unique
+        :param path: The path of the snapshot file
+        :param interval: The number of seconds between snapshots
+        :param max_entries: The maximum number of entries saved per cache
+        """
+        self.caches = {cache.name: cache for cache in caches}
+        self.path = path
+        self.interval = interval
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.saved = 0
+        self.restored = 0
+        self.failed = 0
+        self.last_saved_at: Optional[float] = None
+
+    def save(self) -> int:
+        """
+        Write the hot entries of every cache to the snapshot file, atomically replacing
+        the previous snapshot
+        :return: The number of entries saved
+        """
+        caches = {
+            name: cache.dump(self.max_entries) for name, cache in self.caches.items()
+        }
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "saved_at": time.time(),
+            "caches": caches,
+        }
+        data = gzip.compress(
+            json.dumps(snapshot, separators=(",", ":")).encode(), compresslevel=6
+        )
+
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # Workers sharing the file each write their own temporary file, the last
+        # complete snapshot wins
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".cache-snapshot-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        saved = sum(len(entries) for entries in caches.values())
+        with self._lock:
+            self.saved += saved
+            self.last_saved_at = snapshot["saved_at"]
+        return saved
+
+    def restore(self) -> int:
+        """
+        Load the entries of the snapshot file into the caches, without replacing
+        entries stored since the worker started
+        :return: The number of entries restored
+        """
+        try:
+            with open(self.path, "rb") as f:
+                snapshot = json.loads(gzip.decompress(f.read()))
+        except FileNotFoundError:
+            return 0
+
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            logging.info(
+                "Ignoring cache snapshot of version %s", snapshot.get("version")
+            )
+            return 0
+
+        restored = 0
+        for name, entries in snapshot["caches"].items():
+            if (cache := self.caches.get(name)) is not None:
+                restored += cache.restore(entries)
+        with self._lock:
+            self.restored += restored
+        return restored
+
+    def start(self):
+        """
+        Restore the last snapshot and start saving snapshots in a background thread.
+        The snapshot is also saved when the process exits.
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="cache-snapshot", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self._save_on_exit)
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        # Restoring happens here rather than at import, so it never delays startup.
+        # Requests served meanwhile simply miss, and their entries are kept.
+        try:
+            restored = self.restore()
+            if restored:
+                logging.info("Restored %d cache entries from %s", restored, self.path)
+        except Exception as e:
+            self.failed += 1
+            logging.warning("Failed to restore the cache snapshot: %s", e)
+
+        while not self._stop.wait(self.interval):
+            self._save_logged()
+
+    def _save_on_exit(self):
+        self.stop()
+        self._save_logged()
+
+    def _save_logged(self):
+        try:
+            self.save()
+        except Exception as e:
+            self.failed += 1
+            logging.warning("Failed to save the cache snapshot: %s", e)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "saved": self.saved,
+                "restored": self.restored,
+                "failed": self.failed,
+                "last_saved_at": self.last_saved_at,
+            }
+
+
+cache_snapshotter = CacheSnapshotter([kitsu_cache, stream_cache, id_cache])
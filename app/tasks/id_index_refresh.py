@@ -0,0 +1,190 @@
+import logging
+import math
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import config
+from app.db.db import id_index, load_id_mappings
+from app.db.id_index import IdIndex
+
+try:
+    import fcntl
+except ImportError:  # Windows, every worker reloads the shared file when it is due
+    fcntl = None
+
+# Seconds before retrying a first load that failed, lookups use the database until then
+FIRST_LOAD_RETRY_INTERVAL = 30
+
+
+class IdIndexRefresher:
+    """
+    Loads the whole Kitsu <-> MAL ID mapping into the in-memory ID index when a worker
+    starts, then reloads it periodically in a background thread to pick up new
+    mappings, so resolving IDs never waits on the database.
+    With a shared path, the workers of a machine share one index file instead of each
+    holding a copy: the worker holding the file's lock reloads it from the database
+    once it is older than the interval, and every worker maps the latest file. A failed
+    reload is recorded next to the file, so no worker retries it before the interval.
+    """
+
+    def __init__(
+        self,
+        index: IdIndex,
+        interval: float = config.ID_INDEX_INTERVAL,
+        path: str = config.ID_INDEX_PATH,
+        check_interval: float = config.ID_INDEX_CHECK_INTERVAL,
+    ):
+        """
+        :param index: The index to load
+        :param interval: The number of seconds between reloads
+        :param path: The path of the index file shared by the workers, or "" to load
+                     the index in every worker
+        :param check_interval: The number of seconds between checks for a newer
+                               shared index file
+        """
+        self.index = index
+        self.interval = interval
+        self.path = path
+        self.check_interval = check_interval
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # The inode and modification time of the shared file last mapped
+        self._mapped: Optional[tuple[int, int]] = None
+
+        self.refreshes = 0
+        self.maps = 0
+        self.failed = 0
+        self.last_refreshed_at: Optional[float] = None
+
+    def refresh(self) -> int:
+        """
+        Reload the index from the database, or from the shared index file, reloading
+        the file first if it is out of date and no other worker is reloading it
+        :return: The number of mappings in the index
+        """
+        if not self.path:
+            self._load(self.index)
+            return len(self.index)
+
+        if self._reload_due():
+            self._load_shared()
+        self._map_latest()
+        return len(self.index)
+
+    def _load(self, index: IdIndex, baseline: Optional[int] = None):
+        loaded = index.load(load_id_mappings(), baseline)
+        self.refreshes += 1
+        self.last_refreshed_at = time.time()
+        logging.info("Loaded %d anime ID mappings", loaded)
+
+    def _load_shared(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.lock", "a") as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return  # Another worker is reloading the file
+            # Another worker may have reloaded it while we checked its age
+            if not self._reload_due():
+                return
+            try:
+                # Checked against this worker's index, so a partial read is never shared
+                index = IdIndex()
+                self._load(index, baseline=len(self.index))
+                index.save(self.path)
+            except BaseException:
+                # The file keeps its age, every worker would scan the mapping again
+                # at its next check without recording the failed attempt
+                with open(self._failed_path, "a"):
+                    os.utime(self._failed_path)
+                raise
+
+    @property
+    def _failed_path(self) -> str:
+        return f"{self.path}.failed"
+
+    def _reload_due(self) -> bool:
+        """
+        Check whether the shared file is older than the interval, and no worker failed
+        to reload it since. A failed first load is retried sooner.
+        """
+        if _age(self.path) < self.interval:
+            return False
+        retry_interval = (
+            self.interval if os.path.exists(self.path) else FIRST_LOAD_RETRY_INTERVAL
+        )
+        return _age(self._failed_path) >= retry_interval
+
+    def _map_latest(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return  # Not loaded yet
+        version = (stat.st_ino, stat.st_mtime_ns)
+        if version != self._mapped:
+            mapped = self.index.map(self.path)
+            self._mapped = version
+            self.maps += 1
+            logging.info("Mapped %d anime ID mappings from %s", mapped, self.path)
+
+    def start(self):
+        """
+        Load the index and keep reloading it in a background thread
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="id-index-refresh", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        delay = 0.0
+        while not self._stop.wait(delay):
+            try:
+                self.refresh()
+            except Exception as e:
+                self.failed += 1
+                logging.error("Failed to load the anime ID mappings: %s", e)
+
+            # Spread the reloads of the workers apart, and retry the first load
+            # sooner, lookups use the database until it succeeds
+            if self.path:
+                delay = self.check_interval * random.uniform(0.5, 1)
+            elif self.index.loaded:
+                delay = self.interval * random.uniform(0.75, 1)
+            else:
+                delay = FIRST_LOAD_RETRY_INTERVAL
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.index.loaded,
+            "mappings": len(self.index),
+            "bytes": self.index.nbytes,
+            "refreshes": self.refreshes,
+            "maps": self.maps,
+            "failed": self.failed,
+            "last_refreshed_at": self.last_refreshed_at,
+        }
+
+
+def _age(path: str) -> float:
+    """
+    Get the number of seconds since a file was last modified, inf if it is missing
+    """
+    try:
+        return time.time() - os.stat(path).st_mtime
+    except FileNotFoundError:
+        return math.inf
+
+
+id_index_refresher = IdIndexRefresher(id_index)
@@ -0,0 +1,194 @@
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+import requests
+
+import config
+from app.api.mal import MyAnimeListAPI
+from app.api.singleflight import SingleFlight
+from app.db.db import (
+    acquire_refresh_lock,
+    complete_token_refresh,
+    find_expiring_users,
+    get_user,
+)
+
+# Responses of MAL's token endpoint that mean the refresh token itself is no longer valid
+REJECTED_STATUS_CODES = frozenset({400, 401})
+
+
+class TokenRefresher:
+    """
+    Refreshes users' MyAnimeList access tokens in the background before they expire,
+    so addon requests never find an expired token.
+    Every worker process may run a refresher, a lock on each user ensures their tokens
+    are only refreshed by one of them. Requests finding an expired token share a single
+    refresh within a process, and wait for one already running in another worker.
+    """
+
+    def __init__(
+        self,
+        client: MyAnimeListAPI,
+        window: float = config.TOKEN_REFRESH_WINDOW,
+        interval: float = config.TOKEN_REFRESH_INTERVAL,
+        batch_size: int = config.TOKEN_REFRESH_BATCH_SIZE,
+        rate: float = config.TOKEN_REFRESH_RATE,
+        lease: float = config.TOKEN_REFRESH_LEASE,
+        wait_timeout: float = config.TOKEN_REFRESH_WAIT,
+        poll_interval: float = config.TOKEN_REFRESH_POLL_INTERVAL,
+    ):
+        """
+        :param client: The client used to refresh the tokens
+        :param window: Refresh tokens expiring within this many seconds
+        :param interval: The number of seconds between sweeps for expiring tokens
+        :param batch_size: The number of users fetched from the database at once
+        :param rate: The maximum number of refreshes per second
+        :param lease: The number of seconds a user's refresh lock is held for
+        :param wait_timeout: The number of seconds to wait for another worker's refresh
+        :param poll_interval: The number of seconds between checks for that refresh
+        """
+        self.client = client
+        self.window = window
+        self.interval = interval
+        self.batch_size = batch_size
+        self.rate = rate
+        self.lease = lease
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+
+        self._flights = SingleFlight()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.refreshed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def refresh_user(self, user: dict, wait: bool = True) -> Optional[dict]:
+        """
+        Refresh a user's tokens. Concurrent calls for the same user share one refresh.
+        :param user: The user, holding at least their id and refresh token
+        :param wait: Whether to wait for a refresh already running in another worker,
+                     instead of giving up on it
+        :return: The updated user, or None if the tokens were not refreshed
+        """
+        return self._flights.do(user["uid"], self._refresh_user, user, wait)
+
+    def _refresh_user(self, user: dict, wait: bool) -> Optional[dict]:
+        if not acquire_refresh_lock(user["uid"], user["refresh_token"], self.lease):
+            return self._wait_for_refresh(user) if wait else None
+
+        tokens = None
+        try:
+            auth_data = self.client.refresh_token(user["refresh_token"])
+            tokens = {
+                "access_token": auth_data["access_token"],
+                "refresh_token": auth_data["refresh_token"],
+                "expires_in": auth_data["expires_in"],
+                "last_updated": datetime.utcnow(),
+            }
+            self.refreshed += 1
+        except requests.HTTPError as e:
+            if (
+                e.response is not None
+                and e.response.status_code in REJECTED_STATUS_CODES
+            ):
+                # Stop retrying a revoked refresh token until the user logs in again
+                tokens = {"rejected_refresh_token": user["refresh_token"]}
+                self.rejected += 1
+            else:
+                self.failed += 1
+            logging.warning("Failed to refresh tokens of user %s: %s", user["uid"], e)
+        except requests.RequestException as e:
+            self.failed += 1
+            logging.warning("Failed to refresh tokens of user %s: %s", user["uid"], e)
+
+        updated = complete_token_refresh(user["uid"], tokens)
+        return updated if tokens and "access_token" in tokens else None
+
+    def _wait_for_refresh(self, user: dict) -> Optional[dict]:
+        """
+        Wait for the refresh of a user's tokens by another worker, or one that already
+        completed, to be stored
+        :param user: The user, holding their refresh token from before the refresh
+        :return: The updated user, or None if the refresh failed or did not complete
+                 in time
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            current = get_user(user["uid"], fields=None)
+            if current is None:
+                return None
+            if current.get("refresh_token") != user["refresh_token"]:
+                return current
+
+            # The lock is released once the refresh was stored, or it failed
+            lock = current.get("refresh_lock")
+            if not lock or lock <= datetime.utcnow():
+                return None
+            if time.monotonic() + self.poll_interval > deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def refresh_expiring(self) -> int:
+        """
+        Refresh the tokens of every user whose tokens expire within the window
+        :return: The number of users whose tokens were refreshed
+        """
+        refreshed = 0
+        # Users that failed are retried by the next sweep, and left out of the batches
+        # of this one so they do not hold up the users after them
+        skipped = set()
+        expires_before = datetime.utcnow() + timedelta(seconds=self.window)
+        while not self._stop.is_set():
+            users = find_expiring_users(expires_before, self.batch_size, skipped)
+            for user in users:
+                if self.refresh_user(user, wait=False):
+                    refreshed += 1
+                else:
+                    skipped.add(user["uid"])
+                if self._stop.wait(1 / self.rate):
+                    break
+
+            if len(users) < self.batch_size:
+                break
+        return refreshed
+
+    def start(self):
+        """
+        Start sweeping for expiring tokens in a background thread
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="token-refresh", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        # Spread the sweeps of the workers apart
+        while not self._stop.wait(self.interval * random.uniform(0.5, 1)):
+            try:
+                refreshed = self.refresh_expiring()
+                if refreshed:
+                    logging.info("Refreshed the tokens of %d users", refreshed)
+            except Exception as e:
+                logging.error("Token refresh sweep failed: %s", e)
+
+    def stats(self) -> dict:
+        return {
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+
+token_refresher = TokenRefresher(MyAnimeListAPI())
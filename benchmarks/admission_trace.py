@@ -0,0 +1,102 @@
+"""
+Trace replay benchmark of the hit ratio of the meta and stream caches, with plain LRU
+eviction and with TinyLFU admission.
+
+Synthetic traces model the addon's traffic: a Zipf distributed catalog (popular
+seasonal titles), the same with scans of one-off long tail lookups (a user scrolling
+an obscure completed list), and popularity shifting from season to season. A recorded
+trace, one key per line, can be replayed instead. Run from the repository root:
+
+    python -m benchmarks.admission_trace [--requests 200000] [--trace keys.txt]
+"""
+
+import argparse
+import itertools
+import random
+import time
+
+from app.cache.ttl import TTLCache
+
+CATALOG_SIZE = 50000
+ZIPF_EXPONENT = 0.9
+CACHE_SIZES = (500, 2000, 5000)
+
+
+def _zipf(requests: int, offset: int = 0) -> list[str]:
+    weights = [1 / (rank**ZIPF_EXPONENT) for rank in range(1, CATALOG_SIZE + 1)]
+    cum_weights = list(itertools.accumulate(weights))
+    ranks = random.choices(range(CATALOG_SIZE), cum_weights=cum_weights, k=requests)
+    return [f"meta:{(rank + offset) % CATALOG_SIZE}" for rank in ranks]
+
+
+def _zipf_with_scans(requests: int) -> list[str]:
+    """
+    Zipf lookups, with a third of the requests made by scans of 100 unseen keys
+    """
+    trace = _zipf(requests * 2 // 3)
+    scans = requests - len(trace)
+    scan_keys = (f"tail:{i}" for i in itertools.count())
+    for _ in range(scans // 100):
+        position = random.randrange(len(trace))
+        trace[position:position] = itertools.islice(scan_keys, 100)
+    return trace
+
+
+def _shifting(requests: int) -> list[str]:
+    """
+    Zipf lookups whose most popular titles change four times over the trace
+    """
+    season = requests // 4
+    return [
+        key for i in range(4) for key in _zipf(season, offset=i * CATALOG_SIZE // 7)
+    ]
+
+
+def _replay(trace: list[str], maxsize: int, admission: bool) -> tuple[float, float]:
+    """
+    Replay a trace, loading every missed key into the cache
+    :return: The hit ratio, and the mean microseconds per request
+    """
+    cache = TTLCache("replay", maxsize=maxsize, ttl=86400, admission=admission)
+    hits = 0
+    start = time.perf_counter()
+    for key in trace:
+        if cache.get(key) is None:
+            cache.set(key, True)
+        else:
+            hits += 1
+    elapsed = time.perf_counter() - start
+    return hits / len(trace), elapsed / len(trace) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=200000)
+    parser.add_argument("--trace", help="A file of keys to replay, one per line")
+    args = parser.parse_args()
+    random.seed(0)
+
+    if args.trace:
+        with open(args.trace) as f:
+            traces = {args.trace: [line.strip() for line in f if line.strip()]}
+    else:
+        traces = {
+            "zipf": _zipf(args.requests),
+            "zipf+scans": _zipf_with_scans(args.requests),
+            "shifting": _shifting(args.requests),
+        }
+
+    for name, trace in traces.items():
+        for maxsize in CACHE_SIZES:
+            lru, lru_us = _replay(trace, maxsize, admission=False)
+            tinylfu, tinylfu_us = _replay(trace, maxsize, admission=True)
+            print(
+                f"{name:<11} size={maxsize:<5} "
+                f"lru={lru:6.1%} ({lru_us:.1f}us) "
+                f"tinylfu={tinylfu:6.1%} ({tinylfu_us:.1f}us) "
+                f"gain={(tinylfu - lru) * 100:+.1f}pt"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark of compressed cache entries against plain Python objects, with payloads
+shaped like Kitsu metas and Torrentio streams.
+
+Reports the memory held by each layout and the latency of a hit, which for compressed
+entries includes decompressing and parsing the value. Run from the repository root:
+
+    python -m benchmarks.cache_compression [--entries 2000] [--hits 20000]
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from app.api.upstream import UpstreamResponse
+from app.cache.ttl import TTLCache
+from benchmarks.cache_memory import (
+    allocated_by,
+    episode_count,
+    kitsu_meta,
+    torrentio_streams,
+)
+
+
+def _hit_latencies(cache: TTLCache, keys: list[str], hits: int) -> list[float]:
+    """
+    Get random keys from the cache
+    :return: The latency of each hit, in microseconds
+    """
+    latencies = []
+    for key in random.choices(keys, k=hits):
+        start = time.perf_counter()
+        cache.get(key)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    return latencies
+
+
+def _report(label: str, make_payloads, entries: int, hits: int):
+    keys = [f"key{i}" for i in range(entries)]
+    for compress in (False, True):
+        cache = TTLCache(
+            label,
+            maxsize=entries,
+            ttl=3600,
+            decode=UpstreamResponse._make,
+            compress=compress,
+        )
+        allocated = allocated_by(cache, make_payloads)
+        latencies = sorted(_hit_latencies(cache, keys, hits))
+        print(
+            f"{label:<7} {'compressed' if compress else 'plain':<10} "
+            f"memory={allocated / 2**20:7.1f}MB "
+            f"({allocated / entries / 1024:6.1f}KB/entry) "
+            f"hit p50={statistics.median(latencies):7.1f}us "
+            f"p99={latencies[int(len(latencies) * 0.99)]:8.1f}us"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--entries", type=int, default=2000)
+    parser.add_argument("--hits", type=int, default=20000)
+    args = parser.parse_args()
+
+    def metas():
+        random.seed(0)
+        return [
+            UpstreamResponse(200, kitsu_meta(i, episode_count()))
+            for i in range(args.entries)
+        ]
+
+    def streams():
+        random.seed(0)
+        return [
+            UpstreamResponse(200, torrentio_streams(random.randint(5, 60)))
+            for _ in range(args.entries)
+        ]
+
+    _report("meta", metas, args.entries, args.hits)
+    _report("streams", streams, args.entries, args.hits)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Benchmark of the memory held by the meta and stream caches, filled with payloads shaped
+like Kitsu metas and Torrentio streams.
+
+For each cache, reports the number of entries kept within its byte budget, the bytes
+reported by the cache against the memory actually allocated (tracemalloc), and the
+cost of estimating entry sizes on every store. Run from the repository root:
+
+    python -m benchmarks.cache_memory [--entries 5000] [--budget-mb 64]
+"""
+
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+from app.api.upstream import UpstreamResponse
+from app.cache.ttl import TTLCache
+
+
+def kitsu_meta(kitsu_id: int, episodes: int) -> dict:
+    videos = [
+        {
+            "id": f"kitsu:{kitsu_id}:{ep}",
+            "title": f"Episode {ep}",
+            "released": "2020-01-01T00:00:00.000Z",
+            "season": 1,
+            "episode": ep,
+            "thumbnail": f"https://media.kitsu.app/episodes/thumbnails/{kitsu_id}{ep}/original.jpg",
+            "overview": "An episode synopsis of a few sentences. " * 4,
+        }
+        for ep in range(1, episodes + 1)
+    ]
+    return {
+        "meta": {
+            "id": f"kitsu:{kitsu_id}",
+            "type": "series",
+            "name": f"Anime {kitsu_id}",
+            "genres": ["Action", "Adventure", "Fantasy"],
+            "poster": f"https://media.kitsu.app/anime/poster_images/{kitsu_id}/medium.jpg",
+            "background": f"https://media.kitsu.app/anime/cover_images/{kitsu_id}/original.png",
+            "description": "A synopsis of the series, a paragraph long. " * 10,
+            "releaseInfo": "2020-2021",
+            "imdbRating": "8.1",
+            "links": [{"name": "Action", "category": "Genres", "url": "stremio:///"}],
+            "videos": videos,
+        }
+    }
+
+
+def torrentio_streams(count: int) -> dict:
+    return {
+        "streams": [
+            {
+                "name": "Torrentio\n1080p",
+                "title": "[SubsPlease] Anime - 01 (1080p) [ABCDEF01].mkv\n👤 120 💾 1.4 GB ⚙️ NyaaSi",
+                "infoHash": f"{random.getrandbits(160):040x}",
+                "fileIdx": 0,
+                "behaviorHints": {"bingeGroup": "torrentio|1080p|WEB-DL"},
+            }
+            for _ in range(count)
+        ]
+    }
+
+
+def episode_count() -> int:
+    # Most series are a cour or two, a few run for hundreds of episodes
+    return random.choice([12] * 10 + [24] * 6 + [50] * 2 + [200, 1000])
+
+
+def _fill(cache: TTLCache, payloads: list) -> float:
+    """
+    Store every payload in the cache
+    :return: The mean number of microseconds per store
+    """
+    start = time.perf_counter()
+    for i, payload in enumerate(payloads):
+        cache.set(f"key{i}", payload)
+    return (time.perf_counter() - start) / len(payloads) * 1e6
+
+
+def allocated_by(cache: TTLCache, make_payloads) -> int:
+    """
+    Fill the cache while tracing allocations
+    :return: The number of bytes still allocated once only the cache holds payloads
+    """
+    gc.collect()
+    tracemalloc.start()
+    payloads = make_payloads()
+    _fill(cache, payloads)
+    del payloads
+    gc.collect()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return allocated
+
+
+def _report(label: str, make_payloads, entries: int, budget: int):
+    for maxbytes in (None, budget):
+        per_store = _fill(
+            TTLCache(label, maxsize=entries, ttl=3600, maxbytes=maxbytes),
+            make_payloads(),
+        )
+        cache = TTLCache(label, maxsize=entries, ttl=3600, maxbytes=maxbytes)
+        allocated = allocated_by(cache, make_payloads)
+        stats = cache.stats()
+        reported = f"{stats['bytes'] / 2**20:.1f}MB" if maxbytes else "-"
+        print(
+            f"{label:<7} budget={f'{maxbytes // 2**20}MB' if maxbytes else 'none':<5} "
+            f"entries={stats['size']:>5}/{entries} "
+            f"reported={reported:<7} allocated={allocated / 2**20:.1f}MB "
+            f"store={per_store:.1f}us"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--entries", type=int, default=5000)
+    parser.add_argument("--budget-mb", type=int, default=64)
+    args = parser.parse_args()
+    budget = args.budget_mb * 2**20
+
+    def metas():
+        random.seed(0)
+        return [
+            UpstreamResponse(200, kitsu_meta(i, episode_count()))
+            for i in range(args.entries)
+        ]
+
+    def streams():
+        random.seed(0)
+        return [
+            UpstreamResponse(200, torrentio_streams(random.randint(5, 60)))
+            for _ in range(args.entries)
+        ]
+
+    _report("meta", metas, args.entries, budget)
+    _report("streams", streams, args.entries, budget)
+
+
+if __name__ == "__main__":
+    main()
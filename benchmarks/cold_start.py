@@ -0,0 +1,79 @@
+"""
+Benchmark of a cold start: the time from a fresh interpreter importing the app to its
+first response, as paid by every prefork worker and serverless cold start.
+
+Each run is a new process importing run.py and serving /manifest.json, which needs no
+database, then optionally a user's configured manifest, which does. Run from the
+repository root, with the environment variables of the addon set:
+
+    python -m benchmarks.cold_start [--runs 5] [--user <MAL user ID>]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import run
+from app.db import connection
+imported = time.perf_counter()
+client_on_import = connection._client is not None
+app = run.app.test_client()
+assert app.get("/manifest.json").status_code == 200
+first = time.perf_counter()
+user = sys.argv[1]
+if user:
+    app.get(f"/{user}/manifest.json")
+user_first = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "first": first - start,
+    "user_first": user_first - start if user else None,
+    "client_on_import": client_on_import,
+}))
+"""
+
+
+def _run(user: str, env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", _CHILD, user],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--user", default="", help="A user whose manifest is served")
+    args = parser.parse_args()
+
+    # Background tasks only add noise to the start up being measured
+    env = os.environ | {
+        "HTTP_PREWARM": "0",
+        "TOKEN_REFRESH_ENABLED": "0",
+        "ID_INDEX_ENABLED": "0",
+        "MONGO_HEALTH_CHECK": "0",
+    }
+    runs = [_run(args.user, env) for _ in range(args.runs)]
+
+    def median_ms(key):
+        return statistics.median(run[key] for run in runs) * 1000
+
+    print(f"import:               {median_ms('import'):7.1f}ms")
+    print(f"first response:       {median_ms('first'):7.1f}ms")
+    if args.user:
+        print(f"first user response:  {median_ms('user_first'):7.1f}ms")
+    print(f"mongo client on import: {any(run['client_on_import'] for run in runs)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Benchmark of the first requests served by a worker, with empty caches (cold) and with
+caches restored from a snapshot (warm).
+
+Kitsu and the anime ID database are replaced by stand-ins answering after a fixed
+latency, so the results only depend on the caches. Run from the repository root, with
+the environment variables of the addon set (MongoDB is not contacted):
+
+    python -m benchmarks.cold_vs_warm [--requests 50] [--kitsu-latency 0.15]
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from contextlib import ExitStack
+from unittest.mock import MagicMock, patch
+
+from app.cache.ttl import TTLCache
+from app.db.id_index import IdIndex
+from app.tasks.cache_snapshot import CacheSnapshotter, cache_snapshotter
+from run import app, response_cache
+
+USER = {"uid": "bench", "access_token": "token"}
+
+
+def _fake_kitsu(latency: float):
+    def get(url, **_kwargs):
+        time.sleep(latency)
+        resp = MagicMock(status_code=200)
+        kitsu_id = url.rsplit(":", 1)[-1].removesuffix(".json")
+        resp.json.return_value = {"meta": {"id": f"kitsu:{kitsu_id}", "name": url}}
+        return resp
+
+    return get
+
+
+def _fake_id_lookup(latency: float):
+    def find(mal_id):
+        time.sleep(latency)
+        return True, str(mal_id)
+
+    return find
+
+
+def _serve(client, meta_ids: list[str]) -> list[float]:
+    """
+    Request the meta of every ID once
+    :return: The latency of each request, in milliseconds
+    """
+    latencies = []
+    for meta_id in meta_ids:
+        start = time.perf_counter()
+        resp = client.get(f"/{USER['uid']}/meta/anime/{meta_id}.json")
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert resp.status_code == 200, resp.status_code
+    return latencies
+
+
+def _clear(caches: list[TTLCache]):
+    # Responses are not snapshotted, a restarted worker starts without them
+    if response_cache is not None:
+        response_cache.clear()
+    for cache in caches:
+        cache.clear()
+
+
+def _report(label: str, latencies: list[float]):
+    print(
+        f"{label:<6} first={latencies[0]:8.2f}ms "
+        f"median={statistics.median(latencies):8.2f}ms "
+        f"max={max(latencies):8.2f}ms total={sum(latencies):9.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--kitsu-latency", type=float, default=0.15)
+    parser.add_argument("--db-latency", type=float, default=0.01)
+    args = parser.parse_args()
+
+    caches = list(cache_snapshotter.caches.values())
+    meta_ids = [f"mal_{i}" for i in range(1, args.requests + 1)]
+    client = app.test_client()
+
+    with ExitStack() as stack:
+        tmp_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        stack.enter_context(
+            patch("app.routes.meta.get_valid_user", return_value=(USER, None))
+        )
+        stack.enter_context(
+            patch("app.api.transport.get", _fake_kitsu(args.kitsu_latency))
+        )
+        stack.enter_context(
+            patch(
+                "app.db.db._find_kitsu_id_from_mal_id",
+                _fake_id_lookup(args.db_latency),
+            )
+        )
+        # Resolve IDs through id_cache, even if the ID index loaded meanwhile
+        stack.enter_context(patch("app.db.db.id_index", IdIndex()))
+
+        _clear(caches)
+        _report("cold", _serve(client, meta_ids))
+
+        snapshotter = CacheSnapshotter(caches, os.path.join(tmp_dir, "snapshot.gz"))
+        start = time.perf_counter()
+        saved = snapshotter.save()
+        save_ms = (time.perf_counter() - start) * 1000
+        size = os.path.getsize(snapshotter.path)
+
+        _clear(caches)
+        start = time.perf_counter()
+        restored = snapshotter.restore()
+        restore_ms = (time.perf_counter() - start) * 1000
+        _report("warm", _serve(client, meta_ids))
+
+    print(
+        f"snapshot: {saved} entries, {size} bytes, saved in {save_ms:.2f}ms, "
+        f"{restored} restored in {restore_ms:.2f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
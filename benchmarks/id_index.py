@@ -0,0 +1,141 @@
+"""
+Benchmark of resolving MAL IDs to Kitsu IDs with the in-memory ID index, against a
+database lookup (find_one) and the id_cache in front of it, and of the memory each
+worker holds with its own index against a shared index file.
+
+By default the mapping is synthetic and the database is not contacted, only the
+in-process paths are compared. With --mongo, the mapping is loaded from the
+anime_mapping collection, and uncached find_one and batched ($in) lookups are timed
+too. Run from the repository root, with the environment variables of the addon set:
+
+    python -m benchmarks.id_index [--mappings 20000] [--lookups 100000] [--mongo]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from unittest.mock import patch
+
+from app.db import db
+from app.db.id_index import IdIndex
+
+
+def _synthetic_mappings(count: int) -> list[dict]:
+    kitsu_ids = random.sample(range(1, count * 3), count)
+    mal_ids = random.sample(range(1, count * 3), count)
+    return [{"mal_id": m, "kitsu_id": k} for m, k in zip(mal_ids, kitsu_ids)]
+
+
+def _private_bytes() -> int:
+    """
+    Get the number of bytes of memory written by this process, which it cannot share
+    with other processes (Linux only). Clean file pages mapped by this process alone
+    are left out, other workers mapping the same file share them.
+    """
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Private_Dirty:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def _time(resolve, mal_ids: list[str]) -> float:
+    """
+    :return: The mean number of microseconds per lookup
+    """
+    start = time.perf_counter()
+    for mal_id in mal_ids:
+        resolve(mal_id)
+    return (time.perf_counter() - start) / len(mal_ids) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mappings", type=int, default=20000)
+    parser.add_argument("--lookups", type=int, default=100000)
+    parser.add_argument("--mongo", action="store_true")
+    args = parser.parse_args()
+    random.seed(0)
+
+    if args.mongo:
+        start = time.perf_counter()
+        mappings = db.load_id_mappings()
+        print(f"find mappings: {len(mappings)} in {time.perf_counter() - start:.2f}s")
+    else:
+        mappings = _synthetic_mappings(args.mappings)
+    by_mal = {m["mal_id"]: m for m in mappings if m.get("mal_id")}
+
+    index = IdIndex()
+    start = time.perf_counter()
+    index.load(mappings)
+    load_ms = (time.perf_counter() - start) * 1000
+    print(
+        f"index load:    {len(index)} mappings in {load_ms:.1f}ms, "
+        f"{index.nbytes / 1024:.0f}KB"
+    )
+
+    # Mostly mapped IDs, some unknown ones
+    known = list(by_mal)
+    mal_ids = [
+        f"mal_{random.choice(known) if random.random() < 0.95 else 0}"
+        for _ in range(args.lookups)
+    ]
+
+    if args.mongo:
+        sample = mal_ids[:1000]
+        per_lookup = _time(lambda i: db._find_kitsu_id_from_mal_id(i[4:]), sample)
+        print(f"find_one:      {per_lookup:8.2f}us/lookup")
+        with patch("app.db.db.id_index", IdIndex()):
+            db.id_cache.clear()
+            start = time.perf_counter()
+            db.get_kitsu_ids_from_mal_ids(sample)
+            per_lookup = (time.perf_counter() - start) / len(sample) * 1e6
+        print(f"batch ($in):   {per_lookup:8.2f}us/lookup")
+
+    def find(mal_id):
+        mapping = by_mal.get(int(mal_id), {})
+        return (True, mapping["kitsu_id"]) if mapping.get("kitsu_id") else (False, "")
+
+    # id_cache in front of a database answering instantly, all hits once warm
+    with patch("app.db.db.id_index", IdIndex()):
+        with patch("app.db.db._find_kitsu_id_from_mal_id", find):
+            db.id_cache.clear()
+            cold = _time(db.get_kitsu_id_from_mal_id, mal_ids)
+            warm = _time(db.get_kitsu_id_from_mal_id, mal_ids)
+        print(f"id_cache cold: {cold:8.2f}us/lookup (no database latency)")
+        print(
+            f"id_cache warm: {warm:8.2f}us/lookup, "
+            f"{db.id_cache.estimate_bytes() / 1024:.0f}KB"
+        )
+        db.id_cache.clear()
+
+    with patch("app.db.db.id_index", index):
+        per_lookup = _time(db.get_kitsu_id_from_mal_id, mal_ids)
+    print(f"index:         {per_lookup:8.2f}us/lookup")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "id-index.bin")
+        index.save(path)
+        # Write the file back, its cached pages count as dirty until then
+        os.sync()
+        mapped = IdIndex()
+        has_smaps = os.path.exists("/proc/self/smaps_rollup")
+        before = _private_bytes() if has_smaps else 0
+        mapped.map(path)
+        for mal_id in known:
+            mapped.kitsu_id(mal_id)
+        if has_smaps:
+            private = max(_private_bytes() - before, 0)
+            print(
+                f"private memory per worker: {index.nbytes / 1024:.0f}KB loaded, "
+                f"{private / 1024:.0f}KB mapped"
+            )
+        with patch("app.db.db.id_index", mapped):
+            per_lookup = _time(db.get_kitsu_id_from_mal_id, mal_ids)
+        print(f"mapped index:  {per_lookup:8.2f}us/lookup")
+
+
+if __name__ == "__main__":
+    main()
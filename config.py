@@ -21,6 +21,7 @@ class Config:
     COMPRESS_ALGORITHM = ["gzip"]
     COMPRESS_BR_LEVEL = 4
     DEBUG = os.getenv("FLASK_DEBUG", False)
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
 
     # MongoDB
     MONGO_URI = os.getenv("MONGO_URI", "")
@@ -45,12 +46,120 @@ REQ_HEADERS = {
     "Accept": "application/json",
 }
 
+# Upstream HTTP connection pools
+UPSTREAM_HOSTS = (
+    "api.myanimelist.net",
+    "myanimelist.net",
+    "anime-kitsu.strem.fun",
+    "torrentio.strem.fun",
+)
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", 10))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 20))
+HTTP_POOL_BLOCK = False  # Open extra (non-pooled) connections when a pool is full
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "0") == "1"  # Async client, requires 'h2'
+HTTP_PREWARM = os.getenv("HTTP_PREWARM", "1") == "1"
+HTTP_PREWARM_TIMEOUT = 5
+
+# MongoDB connections, opened by each worker process when first used
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 20))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_CONNECT_TIMEOUT = float(os.getenv("MONGO_CONNECT_TIMEOUT", 5))  # seconds
+MONGO_SERVER_SELECTION_TIMEOUT = float(  # seconds
+    os.getenv("MONGO_SERVER_SELECTION_TIMEOUT", 5)
+)
+MONGO_SOCKET_TIMEOUT = float(os.getenv("MONGO_SOCKET_TIMEOUT", 10))  # seconds
+MONGO_HEALTH_CHECK = os.getenv("MONGO_HEALTH_CHECK", "1") == "1"  # at startup
+
+# Circuit breaker of each upstream host
+BREAKER_WINDOW_SIZE = 20  # recent calls the failure and slow call rates cover
+BREAKER_MIN_CALLS = 10
+BREAKER_FAILURE_RATE = 0.5
+BREAKER_SLOW_CALL_DURATION = 5  # seconds
+BREAKER_SLOW_CALL_RATE = 0.8
+BREAKER_OPEN_DURATION = 30  # seconds to fail fast before probing the upstream again
+BREAKER_HALF_OPEN_CALLS = 2
+
+# MyAnimeList request scheduling, shared by every user of the MAL client id
+MAL_RATE_LIMIT = float(os.getenv("MAL_RATE_LIMIT", 3))  # requests per second
+MAL_RATE_BURST = int(os.getenv("MAL_RATE_BURST", 10))
+MAL_QUEUE_MAX_WAIT = 3  # seconds a request may wait for a slot before failing
+MAL_MAX_RETRIES = 2
+MAL_BACKOFF_BASE = 0.5  # seconds
+MAL_BACKOFF_CAP = 4  # seconds
+
+# Background refresh of MyAnimeList access tokens before they expire
+TOKEN_REFRESH_ENABLED = os.getenv("TOKEN_REFRESH_ENABLED", "1") == "1"
+TOKEN_REFRESH_WINDOW = 86400 * 2  # refresh tokens expiring within 2 days
+TOKEN_REFRESH_INTERVAL = 600  # seconds between sweeps for expiring tokens
+TOKEN_REFRESH_BATCH_SIZE = 50
+TOKEN_REFRESH_RATE = 1  # refreshes per second, leaving room for user requests
+TOKEN_REFRESH_LEASE = 60  # seconds a worker holds a user's refresh lock
+TOKEN_REFRESH_WAIT = 10  # seconds a request waits for another worker's refresh
+TOKEN_REFRESH_POLL_INTERVAL = 0.25  # seconds between checks for that refresh
+
+# In-memory index of the whole Kitsu <-> MAL ID mapping, reloaded periodically
+ID_INDEX_ENABLED = os.getenv("ID_INDEX_ENABLED", "1") == "1"
+ID_INDEX_INTERVAL = 3600  # seconds between reloads of the mapping
+# Index file shared by the workers of a machine, each mapping it rather than holding
+# a copy, e.g. /tmp/mal-stremio/id-index.bin. Every worker loads its own if not set.
+ID_INDEX_PATH = os.getenv("ID_INDEX_PATH", "")
+ID_INDEX_CHECK_INTERVAL = 10  # seconds between checks for a newer shared index file
+ID_BATCH_SIZE = 1000  # IDs resolved per database query by the batch ID lookups
+
+# Second tier cache, shared by all workers: "" (disabled), "memory", "disk" or "redis"
+CACHE_L2_BACKEND = os.getenv("CACHE_L2_BACKEND", "")
+CACHE_L2_PATH = os.getenv("CACHE_L2_PATH", "/tmp/mal-stremio/cache.sqlite3")
+CACHE_L2_URL = os.getenv("CACHE_L2_URL", "redis://localhost:6379/0")
+CACHE_L2_TIMEOUT = 0.25  # seconds
+CACHE_L2_POOL_SIZE = 8  # idle connections kept to the Redis backend, per worker
+CACHE_REFRESH_WORKERS = 4  # threads refreshing stale cache entries in the background
+CACHE_COMPRESSION_LEVEL = 1  # zlib level of compressed caches, favouring speed
+CACHE_STATS_BUCKET = 60  # seconds, the resolution of windowed hit ratios
+CACHE_STATS_WINDOWS = {"1m": 60, "5m": 300, "15m": 900, "1h": 3600}
+CACHE_STATS_TOP_KEYS = 50  # most looked up keys tracked per cache
+
+# Snapshot of the hottest cache entries, restored when a worker starts.
+# Disabled unless a path is set, e.g. /tmp/mal-stremio/cache-snapshot.json.gz
+CACHE_SNAPSHOT_PATH = os.getenv("CACHE_SNAPSHOT_PATH", "")
+CACHE_SNAPSHOT_INTERVAL = 300  # seconds between snapshots
+CACHE_SNAPSHOT_MAX_ENTRIES = 5000  # most recently used entries saved per cache
+
+# In-process cache of public responses, answering repeat requests without the views
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_SIZE = 10000
+# Seconds a URL whose response could not be cached has its conditional requests
+# answered by the app rather than the cache
+RESPONSE_CACHE_UNCACHEABLE_DURATION = 600
+# Counting each body with its compressed variants
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_MB", 128)) * 1024 * 1024
+# Cached response bodies are compressed once per encoding in the background, in order
+# of preference, at moderate levels: higher ones cost several times the CPU for a few
+# percent smaller bodies. Encodings whose package is not installed (brotli, zstandard)
+# are skipped.
+PRECOMPRESS_LEVELS = {"br": 5, "zstd": 3, "gzip": 6}
+PRECOMPRESS_MIN_SIZE = 500  # bytes, smaller bodies are served uncompressed
+
 # LRU Cache sizes
 META_CACHE_SIZE = 25000
 ID_CACHE_SIZE = 50000
 STREAM_CACHE_SIZE = 20000
+WATCHLIST_CACHE_SIZE = 5000
+WATCHLIST_PAGE_CONCURRENCY = 4  # pages of a long anime list fetched at the same time
+ANIME_DETAILS_CACHE_SIZE = 20000
+USER_CACHE_SIZE = 10000
+
+# Memory budgets of the caches holding upstream responses, which vary widely in size
+# (a long running series' meta holds hundreds of videos)
+META_CACHE_MAX_BYTES = int(os.getenv("META_CACHE_MAX_MB", 256)) * 1024 * 1024
+STREAM_CACHE_MAX_BYTES = int(os.getenv("STREAM_CACHE_MAX_MB", 128)) * 1024 * 1024
+WATCHLIST_CACHE_MAX_BYTES = int(os.getenv("WATCHLIST_CACHE_MAX_MB", 256)) * 1024 * 1024
 
 # Cache durations
+ID_CACHE_DURATION = 86400  # 1 day
+USER_CACHE_DURATION = 60  # 1 minute, other workers' writes are seen after at most this
+WATCHLIST_SNAPSHOT_DURATION = 600  # 10 minutes, then refreshed with a delta sync
+WATCHLIST_FULL_SYNC_INTERVAL = 86400  # 1 day
+ANIME_DETAILS_DURATION = 86400  # 1 day, shared by all users
 DEFAULT_STALE_WHILE_REVALIDATE = 600  # 10 minutes
 DEFAULT_STALE_IF_ERROR = 300  # 5 minutes
 MANIFEST_DURATION = 3600  # 1 hour
@@ -64,6 +173,7 @@ STREAM_ON_FAIL_TO_FETCH_DURATION = 3600  # 1 hour
 STREAM_ON_INVALID_DURATION = 86400 * 365  # 1 year
 STREAM_ON_NO_KITSU_ID_DURATION = 86400  # 1 day
 STREAM_STALE_WHILE_REVALIDATE = 5  # 5 seconds
+UPSTREAM_ERROR_CACHE_DURATION = 30  # Kitsu and Torrentio error responses
 CONTENT_SYNC_NO_UPDATE_DURATION = 86400  # 1 day
 CONTENT_SYNC_ON_INVALID_DURATION = 86400 * 365  # 1 year
 
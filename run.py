@@ -1,4 +1,6 @@
 import logging
+import threading
+from typing import Optional
 
 from flask import (
     Flask,
@@ -14,13 +16,21 @@ from flask_compress import Compress
 from waitress import serve
 
 import config
+from app.api import transport
+from app.cache.responses import ResponseCache
+from app.db import connection
 from app.db.db import get_user, store_user
+from app.db.users import PROFILE_FIELDS
 from app.routes.auth import auth_blueprint
 from app.routes.catalog import catalog_bp
 from app.routes.content_sync import content_sync_bp
 from app.routes.manifest import manifest_blueprint
 from app.routes.meta import meta_bp
+from app.routes.metrics import metrics_bp
 from app.routes.stream import stream_bp
+from app.tasks.cache_snapshot import cache_snapshotter
+from app.tasks.id_index_refresh import id_index_refresher
+from app.tasks.token_refresh import token_refresher
 from config import Config
 
 app = Flask(__name__, template_folder="./templates", static_folder="./static")
@@ -31,11 +41,57 @@ app.register_blueprint(catalog_bp)
 app.register_blueprint(meta_bp)
 app.register_blueprint(content_sync_bp)
 app.register_blueprint(stream_bp)
+app.register_blueprint(metrics_bp)
 
 Compress(app)
 
+response_cache: Optional[ResponseCache] = None
+if config.RESPONSE_CACHE_ENABLED:
+    response_cache = ResponseCache(app.wsgi_app)
+    app.wsgi_app = response_cache
+
 logging.basicConfig(format="%(asctime)s %(message)s")
 
+_services_started = False
+_services_lock = threading.Lock()
+
+
+def start_background_services():
+    """
+    Start the background tasks of this process, once. They are started by serving the
+    app rather than importing it, so tests and tools importing the app never run them.
+    """
+    global _services_started
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+
+    if config.HTTP_PREWARM:
+        transport.start_prewarm()
+
+    if config.MONGO_HEALTH_CHECK:
+        connection.start_health_check()
+
+    if config.TOKEN_REFRESH_ENABLED:
+        token_refresher.start()
+
+    if config.ID_INDEX_ENABLED:
+        id_index_refresher.start()
+
+    if config.CACHE_SNAPSHOT_PATH:
+        cache_snapshotter.start()
+
+
+@app.before_request
+def start_on_first_request():
+    """
+    Start the background tasks on the first request of deployments importing the app
+    (serverless) instead of running this module
+    """
+    if not _services_started and not app.testing:
+        start_background_services()
+
 
 @app.route("/")
 def index():
@@ -62,7 +118,7 @@ def configure(user_id: str = ""):
     if not (user_session := session.get("user")):
         return redirect(url_for("index"))
 
-    if not (user := get_user(user_session["uid"])):
+    if not (user := get_user(user_session["uid"], fields=PROFILE_FIELDS)):
         flash("User not found.", "danger")
         return redirect(url_for("index"))
 
@@ -144,4 +200,5 @@ def __handle_addon_options(addon_config_options):
 
 
 if __name__ == "__main__":
+    start_background_services()
     serve(app, host="0.0.0.0", port=5000)
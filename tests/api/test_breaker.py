@@ -0,0 +1,151 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from app.api.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+def _response(status_code):
+    resp = requests.Response()
+    resp.status_code = status_code
+    return resp
+
+
+def _fail():
+    raise requests.Timeout("read timed out")
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = patch("app.api.breaker.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.breaker = CircuitBreaker(
+            "kitsu",
+            window_size=10,
+            min_calls=4,
+            failure_rate=0.5,
+            slow_call_duration=5,
+            slow_call_rate=0.8,
+            open_duration=30,
+            half_open_calls=2,
+        )
+
+    def _trip(self):
+        for _ in range(4):
+            with self.assertRaises(requests.Timeout):
+                self.breaker.call(_fail)
+
+    def test_opens_after_failures(self):
+        """
+        Test that the circuit opens once the failure rate is reached, and then fails fast
+        """
+        self.breaker.call(_response, 200)
+        self.breaker.call(_response, 503)
+        self.assertEqual(CLOSED, self.breaker.state)
+
+        with self.assertRaises(requests.Timeout):
+            self.breaker.call(_fail)
+        self.breaker.call(_response, 200)
+        self.assertEqual(OPEN, self.breaker.state)
+
+        fn = MagicMock()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(fn)
+        fn.assert_not_called()
+        self.assertEqual(1, self.breaker.stats()["rejected"])
+
+    def test_client_errors_are_not_failures(self):
+        """
+        Test that 4xx responses do not open the circuit
+        """
+        for _ in range(10):
+            self.breaker.call(_response, 404)
+        self.assertEqual(CLOSED, self.breaker.state)
+
+    def test_opens_after_slow_calls(self):
+        """
+        Test that the circuit opens when most calls are slow, even if they succeed
+        """
+
+        def slow():
+            self.now += 6
+            return _response(200)
+
+        for _ in range(4):
+            self.breaker.call(slow)
+        self.assertEqual(OPEN, self.breaker.state)
+
+    def test_half_open_trials_close_the_circuit(self):
+        """
+        Test that successful trial calls close the circuit after open_duration
+        """
+        self._trip()
+        self.now += 31
+
+        self.breaker.call(_response, 200)
+        self.assertEqual(HALF_OPEN, self.breaker.state)
+        self.breaker.call(_response, 200)
+        self.assertEqual(CLOSED, self.breaker.state)
+
+    def test_half_open_limits_trial_calls(self):
+        """
+        Test that only half_open_calls trials are in flight at once
+        """
+        self._trip()
+        self.now += 31
+
+        self.breaker.allow()
+        self.breaker.allow()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.allow()
+
+    def test_rejects_calls(self):
+        """
+        Test that rejects_calls reports whether a call would fail fast, without
+        using up a trial call
+        """
+        self.assertFalse(self.breaker.rejects_calls())
+        self._trip()
+        self.assertTrue(self.breaker.rejects_calls())
+
+        self.now += 31
+        self.assertFalse(self.breaker.rejects_calls())
+        self.breaker.allow()
+        self.assertFalse(self.breaker.rejects_calls())
+        self.breaker.allow()
+        self.assertTrue(self.breaker.rejects_calls())
+
+    def test_failed_trial_reopens_the_circuit(self):
+        """
+        Test that a failed trial call opens the circuit again
+        """
+        self._trip()
+        self.now += 31
+
+        with self.assertRaises(requests.Timeout):
+            self.breaker.call(_fail)
+        self.assertEqual(OPEN, self.breaker.state)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(_response, 200)
+        self.assertEqual(2, self.breaker.stats()["opened"])
+
+
+class TestAsyncCircuitBreaker(unittest.IsolatedAsyncioTestCase):
+    async def test_call_async(self):
+        """
+        Test that async calls are tracked the same way
+        """
+        breaker = CircuitBreaker("mal", 10, 2, 0.5, 5, 0.8, 30, 1)
+
+        async def fail():
+            raise requests.ConnectionError()
+
+        for _ in range(2):
+            with self.assertRaises(requests.ConnectionError):
+                await breaker.call_async(fail)
+        with self.assertRaises(CircuitOpenError):
+            await breaker.call_async(fail)
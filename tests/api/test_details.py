@@ -0,0 +1,52 @@
+import unittest
+
+from app.api.details import AnimeDetailsCache, parse_fields
+
+DETAILS = {
+    "id": 1,
+    "title": "Death Parade",
+    "main_picture": {"medium": "https://example.com/poster.jpg"},
+    "num_episodes": 12,
+    "my_list_status": {"status": "watching", "num_episodes_watched": 3},
+}
+
+
+class TestAnimeDetailsCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = AnimeDetailsCache()
+
+    def test_global_fields_are_shared_between_users(self):
+        """
+        Test that global fields cached for one user are served to another user
+        """
+        self.cache.store(1, "num_episodes my_list_status", DETAILS)
+
+        details = self.cache.get(1, "num_episodes")
+        self.assertEqual(12, details["num_episodes"])
+        self.assertNotIn("my_list_status", details)
+
+    def test_list_status_is_not_cached(self):
+        """
+        Test that a request for a user's list status is always a miss, as the user
+        may have changed it on MyAnimeList
+        """
+        self.cache.store(1, "num_episodes my_list_status", DETAILS)
+        self.assertIsNone(self.cache.get(1, "num_episodes my_list_status"))
+
+        unlisted = {k: v for k, v in DETAILS.items() if k != "my_list_status"}
+        self.cache.store(2, "num_episodes,my_list_status", unlisted)
+        self.assertIsNone(self.cache.get(2, "num_episodes,my_list_status"))
+        self.assertEqual(12, self.cache.get(2, "num_episodes")["num_episodes"])
+
+    def test_uncached_fields(self):
+        """
+        Test that a request for fields that were never fetched is a miss
+        """
+        self.cache.store(1, "num_episodes", DETAILS)
+        self.assertIsNone(self.cache.get(1, "num_episodes genres"))
+        self.assertIsNone(self.cache.get(1, None))
+
+    def test_parse_fields(self):
+        self.assertEqual({"a", "b", "c"}, parse_fields("a b,c"))
+        self.assertIsNone(parse_fields("my_list_status{status}"))
+        self.assertIsNone(parse_fields(""))
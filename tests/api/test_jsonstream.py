@@ -0,0 +1,79 @@
+import json
+import unittest
+
+from app.api.jsonstream import ArrayItemParser
+
+DOCUMENT = {
+    "data": [
+        {
+            "node": {"id": i, "title": f"Anime {i} – “quoted” ]}}", "genres": []},
+            "list_status": {"status": "watching", "score": i % 10},
+        }
+        for i in range(50)
+    ],
+    "paging": {"next": "https://api.myanimelist.net/v1/users/@me/animelist?offset=50"},
+}
+
+
+def _parse(body: bytes, chunk_size: int):
+    parser = ArrayItemParser("data")
+    items = []
+    for i in range(0, len(body), chunk_size):
+        items.extend(parser.feed(body[i : i + chunk_size]))
+    return items, parser.close()
+
+
+class TestArrayItemParser(unittest.TestCase):
+    def test_items_are_parsed_across_chunks(self):
+        """
+        Test that the items and the rest of the document survive any chunk boundary,
+        including ones splitting multibyte characters
+        """
+        body = json.dumps(DOCUMENT, ensure_ascii=False, indent=2).encode()
+        for chunk_size in (1, 7, 64, 1024, len(body)):
+            items, rest = _parse(body, chunk_size)
+            self.assertEqual(DOCUMENT["data"], items)
+            self.assertEqual({"data": [], "paging": DOCUMENT["paging"]}, rest)
+
+    def test_items_are_yielded_before_the_document_ends(self):
+        """
+        Test that complete items are returned as soon as their chunk arrives
+        """
+        body = json.dumps(DOCUMENT).encode()
+        parser = ArrayItemParser("data")
+        items = parser.feed(body[: len(body) // 2])
+        self.assertGreater(len(items), 0)
+        self.assertEqual(DOCUMENT["data"][: len(items)], items)
+
+    def test_array_after_other_fields(self):
+        """
+        Test that fields preceding the array are kept
+        """
+        items, rest = _parse(b'{"paging": {}, "data": [1, 2, 3]}', 4)
+        self.assertEqual([1, 2, 3], items)
+        self.assertEqual({"paging": {}, "data": []}, rest)
+
+    def test_scalar_split_across_chunks(self):
+        """
+        Test that a number cut off at the end of a chunk is not returned until it ends
+        """
+        parser = ArrayItemParser("data")
+        self.assertEqual([], parser.feed(b'{"data":[12'))
+        self.assertEqual([123, 4], parser.feed(b"3,4]}"))
+        self.assertEqual({"data": []}, parser.close())
+
+        for chunk_size in range(1, 8):
+            items, _ = _parse(b'{"data": [1.5e10, -42, true, null, "a"]}', chunk_size)
+            self.assertEqual([1.5e10, -42, True, None, "a"], items)
+
+    def test_empty_array(self):
+        items, rest = _parse(b'{"data": [], "paging": {}}', 3)
+        self.assertEqual([], items)
+        self.assertEqual({"data": [], "paging": {}}, rest)
+
+    def test_incomplete_document(self):
+        """
+        Test that a truncated document is reported
+        """
+        with self.assertRaises(ValueError):
+            _parse(json.dumps(DOCUMENT).encode()[:-200], 64)
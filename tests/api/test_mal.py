@@ -1,5 +1,8 @@
 import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
+import requests
 
 from app.api.mal import (
     CLIENT_ID,
@@ -7,6 +10,7 @@ from app.api.mal import (
     QUERY_LIMIT,
     REDIRECT_URI,
     TIMEOUT,
+    AsyncMyAnimeListAPI,
     MyAnimeListAPI,
 )
 
@@ -40,7 +44,7 @@ class TestMyAnimeListAPI(unittest.TestCase):
         self.assertIsNotNone(auth_url)
         self.assertIsNotNone(code_verifier)
 
-    @patch("requests.post")
+    @patch("app.api.transport.post")
     def test_get_access_token(self, mock_post):
         """
         Test that the get_access_token function returns a valid access token
@@ -78,7 +82,7 @@ class TestMyAnimeListAPI(unittest.TestCase):
             timeout=TIMEOUT,
         )
 
-    @patch("requests.post")
+    @patch("app.api.transport.post")
     def test_refresh_token(self, mock_post):
         """
         Test that the refresh_token function returns a valid access token
@@ -109,7 +113,7 @@ class TestMyAnimeListAPI(unittest.TestCase):
             timeout=TIMEOUT,
         )
 
-    @patch("requests.get")
+    @patch("app.api.transport.get")
     def test_get_user_details(self, mock_get):
         """
         Test that the get_user_details function returns user details
@@ -135,7 +139,7 @@ class TestMyAnimeListAPI(unittest.TestCase):
             timeout=TIMEOUT,
         )
 
-    @patch("requests.get")
+    @patch("app.api.transport.get")
     def test_get_anime_list(self, mock_get):
         """
         Test that the get_anime_list function returns a list of anime
@@ -169,7 +173,7 @@ class TestMyAnimeListAPI(unittest.TestCase):
             timeout=TIMEOUT,
         )
 
-    @patch("requests.get")
+    @patch("app.api.transport.get")
     def test_get_user_anime_list(self, mock_get):
         """
         Test that the get_user_anime_list function returns a list of user's anime
@@ -202,7 +206,7 @@ class TestMyAnimeListAPI(unittest.TestCase):
             timeout=TIMEOUT,
         )
 
-    @patch("requests.put")
+    @patch("app.api.transport.put")
     def test_update_watched_status(self, mock_put):
         """
         Test that the update_watched_status function updates watched status
@@ -233,3 +237,185 @@ class TestMyAnimeListAPI(unittest.TestCase):
             data={"status": "watching", "num_watched_episodes": 5},
             timeout=TIMEOUT,
         )
+
+    @patch("app.api.transport.get")
+    def test_anime_details_are_shared_between_users(self, mock_get):
+        """
+        Test that global anime details fetched for one user are reused for others
+        """
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.json.return_value = {
+            "id": 1535,
+            "title": "Death Note",
+            "num_episodes": 37,
+        }
+
+        self.mal_api.get_anime_details("token_a", "1535", fields="num_episodes")
+        details = self.mal_api.get_anime_details(
+            "token_b", "1535", fields="num_episodes"
+        )
+
+        self.assertEqual(37, details["num_episodes"])
+        mock_get.assert_called_once()
+
+    @patch("app.api.transport.get")
+    def test_list_status_is_always_fetched(self, mock_get):
+        """
+        Test that a user's list status is fetched from MAL on every request
+        """
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.json.return_value = {
+            "id": 1575,
+            "title": "Code Geass",
+            "num_episodes": 25,
+        }
+
+        fields = "num_episodes my_list_status"
+        self.mal_api.get_anime_details("valid_access_token", "1575", fields=fields)
+        mock_get.return_value.json.return_value = {
+            "id": 1575,
+            "title": "Code Geass",
+            "num_episodes": 25,
+            "my_list_status": {"status": "completed"},
+        }
+        details = self.mal_api.get_anime_details(
+            "valid_access_token", "1575", fields=fields
+        )
+
+        self.assertEqual("completed", details["my_list_status"]["status"])
+        self.assertEqual(2, mock_get.call_count)
+
+    @patch("app.api.mal.time.sleep")
+    @patch("app.api.transport.get")
+    def test_throttled_request_is_retried(self, mock_get, mock_sleep):
+        """
+        Test that a throttled request is retried after its Retry-After delay
+        """
+        throttled = MagicMock(status_code=429, headers={"Retry-After": "1"})
+        ok = MagicMock(status_code=200, headers={})
+        ok.json.return_value = {"data": []}
+        mock_get.side_effect = [throttled, ok]
+
+        user_anime_list = self.mal_api.get_user_anime_list("valid_access_token")
+        self.assertEqual({"data": []}, user_anime_list)
+        self.assertEqual(2, mock_get.call_count)
+        mock_sleep.assert_any_call(1.0)
+
+    @patch("app.api.mal.time.sleep")
+    @patch("app.api.transport.get")
+    def test_forbidden_request_is_not_retried(self, mock_get, mock_sleep):
+        """
+        Test that a 403 without a Retry-After header or rate limit error is raised
+        rather than retried
+        """
+        forbidden = requests.Response()
+        forbidden.status_code = 403
+        forbidden._content = b'{"error": "forbidden", "message": ""}'
+        mock_get.return_value = forbidden
+
+        with self.assertRaises(requests.HTTPError):
+            self.mal_api.get_user_anime_list("valid_access_token")
+        mock_get.assert_called_once()
+        mock_sleep.assert_not_called()
+
+    @patch("app.api.mal.time.sleep")
+    @patch("app.api.transport.get")
+    def test_rate_limited_forbidden_request_is_retried(self, mock_get, mock_sleep):
+        """
+        Test that a 403 with MAL's rate limit error is retried
+        """
+        throttled = requests.Response()
+        throttled.status_code = 403
+        throttled._content = b'{"error": "rate_limit_exceeded"}'
+        ok = MagicMock(status_code=200, headers={})
+        ok.json.return_value = {"data": []}
+        mock_get.side_effect = [throttled, ok]
+
+        self.assertEqual(
+            {"data": []}, self.mal_api.get_user_anime_list("valid_access_token")
+        )
+        self.assertEqual(2, mock_get.call_count)
+
+
+class TestAsyncMyAnimeListAPI(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        """
+        Set up the test class
+        """
+        self.mal_api = AsyncMyAnimeListAPI()
+
+    @patch("app.api.transport.async_get", new_callable=AsyncMock)
+    async def test_get_user_anime_list(self, mock_get):
+        """
+        Test that the async get_user_anime_list function returns a list of user's anime
+        """
+        mock_get.return_value = httpx.Response(
+            200,
+            json={"data": [{"node": {"id": 1, "title": "Naruto"}}]},
+            request=httpx.Request("GET", "https://api.myanimelist.net"),
+        )
+
+        user_anime_list = await self.mal_api.get_user_anime_list(
+            "valid_access_token", status="watching"
+        )
+        self.assertEqual("Naruto", user_anime_list["data"][0]["node"]["title"])
+        mock_get.assert_awaited_once_with(
+            url=f"https://api.myanimelist.net/v1/users/@me/animelist?limit={QUERY_LIMIT}&status=watching",
+            headers={"Authorization": "Bearer valid_access_token"},
+            timeout=TIMEOUT,
+        )
+
+    @patch("app.api.transport.async_get", new_callable=AsyncMock)
+    async def test_error_raises_http_error(self, mock_get):
+        """
+        Test that error responses are raised as requests.HTTPError
+        """
+        mock_get.return_value = httpx.Response(
+            401,
+            json={"error": "invalid_token"},
+            request=httpx.Request("GET", "https://api.myanimelist.net"),
+        )
+
+        with self.assertRaises(requests.HTTPError) as ctx:
+            await self.mal_api.get_user_anime_list("expired_token")
+        self.assertEqual(401, ctx.exception.response.status_code)
+        self.assertEqual("invalid_token", ctx.exception.response.json()["error"])
+
+    async def test_stream_user_anime_list(self):
+        """
+        Test that the list items are parsed from the streamed response
+        """
+        body = {
+            "data": [{"node": {"id": i, "title": f"Anime {i}"}} for i in range(3)],
+            "paging": {},
+        }
+        client = httpx.AsyncClient(
+            transport=httpx.MockTransport(
+                lambda request: httpx.Response(200, json=body)
+            )
+        )
+
+        with patch("app.api.transport._async_client", client):
+            items = [
+                item
+                async for item in self.mal_api.stream_user_anime_list(
+                    "valid_access_token", limit=1000
+                )
+            ]
+        self.assertEqual([0, 1, 2], [item["node"]["id"] for item in items])
+
+    async def test_stream_error_raises_http_error(self):
+        """
+        Test that streamed error responses are raised as requests.HTTPError
+        """
+        client = httpx.AsyncClient(
+            transport=httpx.MockTransport(
+                lambda request: httpx.Response(401, json={"error": "invalid_token"})
+            )
+        )
+
+        with patch("app.api.transport._async_client", client):
+            with self.assertRaises(requests.HTTPError) as ctx:
+                async for _ in self.mal_api.stream_user_anime_list("expired_token"):
+                    pass
+        self.assertEqual("invalid_token", ctx.exception.response.json()["error"])
@@ -0,0 +1,95 @@
+import unittest
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from app.api.scheduler import RateLimitExceeded, RequestScheduler, _parse_retry_after
+
+
+def _scheduler(**kwargs):
+    params = {
+        "rate": 10,
+        "burst": 2,
+        "max_wait": 1,
+        "max_retries": 2,
+        "backoff_base": 0.5,
+        "backoff_cap": 4,
+    }
+    params.update(kwargs)
+    return RequestScheduler(**params)
+
+
+class TestRequestScheduler(unittest.TestCase):
+    @patch("app.api.scheduler.time.sleep")
+    def test_burst_is_not_queued(self, mock_sleep):
+        """
+        Test that requests within the burst size are sent immediately
+        """
+        scheduler = _scheduler()
+        scheduler.acquire()
+        scheduler.acquire()
+
+        mock_sleep.assert_not_called()
+        self.assertEqual(2, scheduler.stats()["granted"])
+        self.assertEqual(0, scheduler.stats()["queued"])
+
+    @patch("app.api.scheduler.time.sleep")
+    def test_requests_over_burst_are_queued(self, mock_sleep):
+        """
+        Test that a request over the burst size waits for the next token
+        """
+        scheduler = _scheduler()
+        for _ in range(3):
+            scheduler.acquire()
+
+        mock_sleep.assert_called_once()
+        self.assertAlmostEqual(0.1, mock_sleep.call_args[0][0], places=2)
+        self.assertEqual(1, scheduler.stats()["queued"])
+
+    @patch("app.api.scheduler.time.sleep")
+    def test_queue_overflow_is_rejected(self, _mock_sleep):
+        """
+        Test that a request that would wait longer than max_wait fails
+        """
+        scheduler = _scheduler(rate=1, burst=1, max_wait=1)
+        scheduler.acquire()
+        scheduler.acquire()  # waits ~1 second
+        with self.assertRaises(RateLimitExceeded):
+            scheduler.acquire()
+        self.assertEqual(1, scheduler.stats()["rejected"])
+
+    def test_retry_after_pauses_bucket(self):
+        """
+        Test that a Retry-After header holds back every following request
+        """
+        scheduler = _scheduler(max_wait=1)
+        delay = scheduler.on_throttled(0, "30")
+
+        self.assertEqual(30, delay)
+        self.assertEqual(1, scheduler.stats()["throttled"])
+        self.assertGreater(scheduler.stats()["paused_for"], 29)
+        with self.assertRaises(RateLimitExceeded):
+            scheduler.acquire()
+
+    def test_backoff_without_retry_after(self):
+        """
+        Test that the backoff is jittered and capped without a Retry-After header
+        """
+        scheduler = _scheduler(backoff_base=0.5, backoff_cap=4)
+        for attempt in range(6):
+            delay = scheduler.on_throttled(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(4, 0.5 * 2**attempt))
+        self.assertEqual(0, scheduler.stats()["paused_for"])
+
+    def test_parse_retry_after(self):
+        """
+        Test that Retry-After is parsed from seconds and HTTP dates
+        """
+        self.assertEqual(5, _parse_retry_after("5"))
+        self.assertIsNone(_parse_retry_after(None))
+        self.assertIsNone(_parse_retry_after("soon"))
+
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=60)
+        delay = _parse_retry_after(format_datetime(retry_at, usegmt=True))
+        self.assertAlmostEqual(60, delay, delta=2)
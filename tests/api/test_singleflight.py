@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from app.api.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_are_coalesced(self):
+        """
+        Test that concurrent calls with the same key share one call
+        """
+        flights = SingleFlight()
+        started = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return {"meta": "shared"}
+
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            leader = pool.submit(flights.do, "kitsu:1", fetch)
+            started.wait()
+            followers = [pool.submit(flights.do, "kitsu:1", fetch) for _ in range(4)]
+            results = [leader.result()] + [f.result() for f in followers]
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual(4, flights.coalesced)
+        for result in results:
+            self.assertIs(results[0], result)
+        self.assertEqual(0, flights.in_flight())
+
+    def test_different_keys_are_not_coalesced(self):
+        """
+        Test that calls with different keys run independently
+        """
+        flights = SingleFlight()
+        self.assertEqual(1, flights.do("a", lambda: 1))
+        self.assertEqual(2, flights.do("b", lambda: 2))
+        self.assertEqual(2, flights.calls)
+        self.assertEqual(0, flights.coalesced)
+
+    def test_exception_is_shared(self):
+        """
+        Test that followers receive the leader's exception, and the key is released
+        """
+        flights = SingleFlight()
+        started = threading.Event()
+
+        def fail():
+            started.set()
+            time.sleep(0.1)
+            raise ValueError("upstream down")
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            leader = pool.submit(flights.do, "key", fail)
+            started.wait()
+            follower = pool.submit(flights.do, "key", fail)
+            with self.assertRaises(ValueError):
+                leader.result()
+            with self.assertRaises(ValueError):
+                follower.result()
+
+        self.assertEqual("ok", flights.do("key", lambda: "ok"))
+
+    def test_async_calls_across_event_loops_are_coalesced(self):
+        """
+        Test that async callers in different event loops share one call
+        """
+        flights = SingleFlight()
+        started = threading.Event()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            started.set()
+            await asyncio.sleep(0.2)
+            return {"data": []}
+
+        def run():
+            return asyncio.run(flights.do_async("watching", fetch))
+
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            leader = pool.submit(run)
+            started.wait()
+            followers = [pool.submit(run) for _ in range(2)]
+            results = [leader.result()] + [f.result() for f in followers]
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual(2, flights.coalesced)
+        self.assertEqual([{"data": []}] * 3, results)
@@ -0,0 +1,75 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
+import requests
+
+import config
+from app.api import transport
+from app.api.breaker import CircuitOpenError
+
+
+class TestTransport(unittest.TestCase):
+    def test_session_is_shared(self):
+        """
+        Test that every call gets the same pooled session
+        """
+        self.assertIs(transport.get_session(), transport.get_session())
+
+    def test_upstream_hosts_have_dedicated_pools(self):
+        """
+        Test that each upstream host is mounted with its own adapter
+        """
+        session = transport.get_session()
+        adapters = {
+            host: session.get_adapter(f"https://{host}/x")
+            for host in config.UPSTREAM_HOSTS
+        }
+        self.assertEqual(len(config.UPSTREAM_HOSTS), len(set(adapters.values())))
+        for adapter in adapters.values():
+            self.assertEqual(config.HTTP_POOL_MAXSIZE, adapter._pool_maxsize)
+
+    @patch("app.api.transport.get_session")
+    def test_request_uses_session(self, mock_session):
+        """
+        Test that the module level helpers delegate to the shared session
+        """
+        transport.get("https://api.myanimelist.net/v1/users/@me", timeout=1)
+        mock_session.return_value.request.assert_called_once_with(
+            "GET", "https://api.myanimelist.net/v1/users/@me", timeout=1
+        )
+
+    @patch("app.api.transport._send", new_callable=AsyncMock)
+    @patch("app.api.transport.get_session")
+    def test_prewarm_ignores_errors(self, mock_session, mock_send):
+        """
+        Test that a failing host does not stop the other hosts from being pre-warmed,
+        in both the session and the async client
+        """
+        session = MagicMock()
+        session.head.side_effect = [requests.ConnectionError("down"), None]
+        mock_session.return_value = session
+        mock_send.side_effect = [httpx.ConnectError("down"), None]
+
+        transport.prewarm(("a.example", "b.example"))
+        self.assertEqual(2, session.head.call_count)
+        self.assertEqual(2, mock_send.await_count)
+        self.assertEqual(("HEAD", "https://b.example/"), mock_send.call_args.args)
+
+    @patch("app.api.transport.get_session")
+    def test_open_circuit_fails_fast(self, mock_session):
+        """
+        Test that requests to a host with an open circuit are not sent
+        """
+        breaker = transport.get_breaker("https://down.example/meta")
+        self.assertIs(breaker, transport.get_breaker("https://down.example/other"))
+        mock_session.return_value.request.side_effect = requests.Timeout()
+        for _ in range(config.BREAKER_MIN_CALLS):
+            with self.assertRaises(requests.Timeout):
+                transport.get("https://down.example/meta")
+
+        mock_session.return_value.request.reset_mock()
+        with self.assertRaises(CircuitOpenError):
+            transport.get("https://down.example/meta")
+        mock_session.return_value.request.assert_not_called()
+        self.assertEqual("open", transport.breaker_stats()["down.example"]["state"])
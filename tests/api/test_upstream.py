@@ -0,0 +1,121 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import requests
+
+import config
+from app.api.upstream import fetch_json, upstream_unavailable
+from app.cache.ttl import TTLCache
+
+URL = "https://anime-kitsu.strem.fun/meta/series/kitsu:9969.json"
+
+
+def _response(status_code, body=None):
+    resp = MagicMock()
+    resp.status_code = status_code
+    if body is None:
+        resp.json.side_effect = ValueError("No JSON")
+    else:
+        resp.json.return_value = body
+    return resp
+
+
+class TestFetchJson(unittest.TestCase):
+    def setUp(self):
+        self.cache = TTLCache("test", maxsize=10, ttl=60)
+
+    @patch("app.api.transport.get")
+    def test_success_is_cached(self, mock_get):
+        """
+        Test that the parsed payload of a successful response is cached for its ttl
+        """
+        mock_get.return_value = _response(200, {"meta": {"id": "kitsu:9969"}})
+
+        with patch.object(self.cache, "set", wraps=self.cache.set) as mock_set:
+            result = fetch_json(self.cache, URL, ttl=3600)
+            mock_set.assert_called_once_with(URL, result, 3600)
+        self.assertTrue(result.ok)
+        self.assertEqual("kitsu:9969", result.data["meta"]["id"])
+
+        self.assertEqual(result, fetch_json(self.cache, URL, ttl=3600))
+        mock_get.assert_called_once()
+
+    @patch("app.api.transport.get")
+    def test_errors_are_cached_briefly(self, mock_get):
+        """
+        Test that error responses, and responses without JSON, get the short error ttl
+        """
+        for resp in (_response(503, {"error": "unavailable"}), _response(200)):
+            self.cache.clear()
+            mock_get.return_value = resp
+            with patch.object(self.cache, "set", wraps=self.cache.set) as mock_set:
+                result = fetch_json(self.cache, URL, ttl=3600)
+                mock_set.assert_called_once_with(
+                    URL, result, config.UPSTREAM_ERROR_CACHE_DURATION
+                )
+            self.assertFalse(result.ok)
+
+    @patch("app.api.transport.get")
+    def test_exceptions_are_not_cached(self, mock_get):
+        """
+        Test that a timeout is retried on the next request
+        """
+        mock_get.side_effect = [requests.Timeout(), _response(200, {"streams": []})]
+
+        with self.assertRaises(requests.Timeout):
+            fetch_json(self.cache, URL, ttl=3600)
+        self.assertEqual({"streams": []}, fetch_json(self.cache, URL, ttl=3600).data)
+
+    @patch("app.cache.ttl.get_refresh_executor")
+    @patch("app.api.transport.get_session")
+    @patch("app.api.transport.get_breaker")
+    def test_last_response_is_served_until_replaced(
+        self, mock_get_breaker, mock_get_session, mock_executor
+    ):
+        """
+        Test that the last response is served past the stale window while the host
+        fails, without calling it while its circuit is open, and is replaced once a
+        call succeeds
+        """
+        breaker = mock_get_breaker.return_value
+        breaker.rejects_calls.return_value = False
+        breaker.call.side_effect = lambda fn, *args, **kwargs: fn(*args, **kwargs)
+        session = mock_get_session.return_value
+        session.request.return_value = _response(200, {"meta": {"name": "old"}})
+
+        now = [100.0]
+        with patch("app.cache.ttl.time.monotonic", lambda: now[0]):
+            cache = TTLCache(
+                "test",
+                maxsize=10,
+                ttl=60,
+                stale=30,
+                keep_expired=True,
+                defer_refresh=upstream_unavailable,
+            )
+            fetch_json(cache, URL, ttl=60)
+            now[0] += 3600
+
+            # Failures before the circuit opens
+            session.request.side_effect = requests.Timeout()
+            self.assertEqual("old", fetch_json(cache, URL, ttl=60).data["meta"]["name"])
+
+            breaker.rejects_calls.return_value = True
+            breaker.call.reset_mock()
+            self.assertEqual("old", fetch_json(cache, URL, ttl=60).data["meta"]["name"])
+            breaker.call.assert_not_called()
+            mock_executor.return_value.submit.assert_not_called()
+
+            breaker.rejects_calls.return_value = False
+            session.request.side_effect = None
+            session.request.return_value = _response(200, {"meta": {"name": "new"}})
+            self.assertEqual("new", fetch_json(cache, URL, ttl=60).data["meta"]["name"])
+
+    @patch("app.api.transport.get_breaker")
+    def test_upstream_unavailable(self, mock_get_breaker):
+        """
+        Test that a host is unavailable while its breaker rejects calls
+        """
+        for rejects in (False, True):
+            mock_get_breaker.return_value.rejects_calls.return_value = rejects
+            self.assertEqual(rejects, upstream_unavailable(URL))
@@ -0,0 +1,206 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+import requests
+
+import config
+from app.api.breaker import CircuitOpenError
+from app.api.mal import QUERY_LIMIT
+from app.api.watchlist import MAX_PAGE_LIMIT, WatchlistStore
+
+
+def _entry(anime_id, status, score=0, updated_at="", title="", start_date=""):
+    return {
+        "node": {"id": anime_id, "title": title, "start_date": start_date},
+        "list_status": {"status": status, "score": score, "updated_at": updated_at},
+    }
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+def _stream_pages(entries):
+    """Stream the page of entries at each requested offset"""
+    return lambda token, limit, offset, **kwargs: _aiter(
+        entries[offset : offset + limit]
+    )
+
+
+class TestWatchlistStore(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        entries = [
+            _entry(i, "completed", score=i % 10, updated_at=f"2024-01-01T{i:05d}")
+            for i in range(2500)
+        ]
+        entries.append(_entry(9001, "watching", title="Naruto"))
+        self.client = MagicMock()
+        self.client.stream_user_anime_list = MagicMock(
+            side_effect=_stream_pages(entries)
+        )
+        self.store = WatchlistStore(self.client)
+
+    async def test_full_list_is_fetched_with_max_page_size(self):
+        """
+        Test that the snapshot pages through the whole list with the largest page size
+        """
+        snapshot = await self.store.get_snapshot("123", "token")
+        self.assertEqual(2501, len(snapshot.entries))
+        calls = self.client.stream_user_anime_list.call_args_list
+        self.assertEqual(
+            [0, 1000, 2000, 3000, 4000], [c.kwargs["offset"] for c in calls]
+        )
+        for call in calls:
+            self.assertEqual(MAX_PAGE_LIMIT, call.kwargs["limit"])
+
+    async def test_pages_are_fetched_concurrently(self):
+        """
+        Test that the pages after the first are fetched at the same time
+        """
+        fetching = 0
+        peak = 0
+        stream = self.client.stream_user_anime_list.side_effect
+
+        async def slow_stream(*args, **kwargs):
+            nonlocal fetching, peak
+            fetching += 1
+            peak = max(peak, fetching)
+            await asyncio.sleep(0.01)
+            async for item in stream(*args, **kwargs):
+                yield item
+            fetching -= 1
+
+        self.client.stream_user_anime_list.side_effect = slow_stream
+        snapshot = await self.store.get_snapshot("123", "token")
+        ids = [e["node"]["id"] for e in snapshot.entries]
+        self.assertEqual([*range(2500), 9001], ids)
+        self.assertEqual(config.WATCHLIST_PAGE_CONCURRENCY, peak)
+
+    async def test_snapshots_are_bounded_in_bytes(self):
+        """
+        Test that snapshots are measured against the cache's memory budget
+        """
+        self.store.snapshots.maxbytes = 1024
+        await self.store.get_snapshot("123", "token")
+        self.assertEqual(0, len(self.store.snapshots))
+        self.assertEqual(0, self.store.snapshots.stats()["bytes"])
+
+    async def test_pages_are_served_locally(self):
+        """
+        Test that scrolling through every status and offset makes no further MAL calls
+        """
+        seen = []
+        for offset in range(0, 2500, 100):
+            page = await self.store.get_page(
+                "123", "token", "completed", "list_updated_at", offset, 100
+            )
+            seen.extend(e["node"]["id"] for e in page["data"])
+        watching = await self.store.get_page(
+            "123", "token", "watching", "list_updated_at", 0, 100
+        )
+
+        self.assertEqual(5, self.client.stream_user_anime_list.call_count)
+        self.assertEqual(list(range(2499, -1, -1)), seen)
+        self.assertEqual([9001], [e["node"]["id"] for e in watching["data"]])
+
+    async def test_local_sort(self):
+        """
+        Test that entries are sorted locally the way MyAnimeList sorts them
+        """
+        page = await self.store.get_page(
+            "123", "token", "completed", "list_score", 0, 20
+        )
+        scores = [e["list_status"]["score"] for e in page["data"]]
+        self.assertEqual([9] * 20, scores)
+
+    async def test_invalidate(self):
+        """
+        Test that an invalidated snapshot is fetched again
+        """
+        await self.store.get_snapshot("123", "token")
+        self.store.invalidate("123")
+        self.client.stream_user_anime_list.side_effect = _stream_pages([])
+        snapshot = await self.store.get_snapshot("123", "token")
+        self.assertEqual([], snapshot.entries)
+
+    async def test_delta_sync_merges_changes(self):
+        """
+        Test that an expired snapshot is refreshed with a single delta request
+        """
+        snapshot = await self.store.get_snapshot("123", "token")
+        snapshot.synced_at = time.time() - 3600  # expire the snapshot
+
+        changes = {
+            "data": [
+                _entry(9001, "completed", updated_at="2025-01-01T00000"),
+                _entry(9002, "watching", updated_at="2025-01-01T00000"),
+                _entry(2499, "completed", updated_at="2024-01-01T02499"),
+                _entry(2498, "completed", updated_at="2024-01-01T02498"),
+            ],
+            "paging": {"next": "https://api.myanimelist.net/next"},
+        }
+        self.client.get_user_anime_list = AsyncMock(return_value=changes)
+
+        snapshot = await self.store.get_snapshot("123", "token")
+        self.client.get_user_anime_list.assert_awaited_once()
+        call = self.client.get_user_anime_list.await_args
+        self.assertEqual("list_updated_at", call.kwargs["sort"])
+
+        self.assertEqual(2502, len(snapshot.entries))
+        self.assertEqual("2025-01-01T00000", snapshot.watermark)
+        watching = snapshot.page("watching", "list_updated_at", 0, 100)
+        self.assertEqual([9002], [e["node"]["id"] for e in watching])
+
+    async def test_mark_stale(self):
+        """
+        Test that a stale snapshot is delta synced instead of refetched in full
+        """
+        await self.store.get_snapshot("123", "token")
+        self.store.mark_stale("123")
+        self.client.get_user_anime_list = AsyncMock(
+            return_value={"data": [], "paging": {}}
+        )
+
+        snapshot = await self.store.get_snapshot("123", "token")
+        self.assertEqual(2501, len(snapshot.entries))
+        self.assertEqual(
+            QUERY_LIMIT, self.client.get_user_anime_list.await_args.kwargs["limit"]
+        )
+
+    async def test_change_by_other_worker(self):
+        """
+        Test that a snapshot is delta synced once the list was changed by another
+        worker, and only once per change
+        """
+        await self.store.get_snapshot("123", "token")
+        self.client.get_user_anime_list = AsyncMock(
+            return_value={"data": [], "paging": {}}
+        )
+
+        await self.store.get_snapshot("123", "token", changed_at=1000.0)
+        await self.store.get_snapshot("123", "token", changed_at=1000.0)
+        self.client.get_user_anime_list.assert_awaited_once()
+
+        snapshot = await self.store.get_snapshot("123", "token", changed_at=2000.0)
+        self.assertEqual(2, self.client.get_user_anime_list.await_count)
+        self.assertEqual(2000.0, snapshot.changed_at)
+
+    async def test_stale_snapshot_is_served_while_mal_is_down(self):
+        """
+        Test that an expired snapshot is served when it can not be synced
+        """
+        snapshot = await self.store.get_snapshot("123", "token")
+        snapshot.synced_at = 0
+        self.client.get_user_anime_list = AsyncMock(
+            side_effect=CircuitOpenError("api.myanimelist.net is unavailable")
+        )
+
+        self.assertIs(snapshot, await self.store.get_snapshot("123", "token"))
+
+        self.store.invalidate("123")
+        self.client.stream_user_anime_list.side_effect = CircuitOpenError()
+        with self.assertRaises(requests.RequestException):
+            await self.store.get_snapshot("123", "token")
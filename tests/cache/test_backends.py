@@ -0,0 +1,339 @@
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from app.cache import backends
+from app.cache.backends import (
+    CacheBackend,
+    CacheBackendError,
+    DiskBackend,
+    MemoryBackend,
+    RedisBackend,
+    get_l2_backend,
+)
+from app.cache.ttl import TTLCache
+
+
+class _RESPHandler(socketserver.StreamRequestHandler):
+    """Serves the subset of the Redis protocol used by RedisBackend"""
+
+    def handle(self):
+        store = self.server.store
+        while line := self.rfile.readline():
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+
+            command = args[0].upper()
+            if command == b"GET":
+                entry = store.get(args[1])
+                if entry is None or entry[0] <= time.time():
+                    self.wfile.write(b"$-1\r\n")
+                else:
+                    self.wfile.write(b"$%d\r\n%s\r\n" % (len(entry[1]), entry[1]))
+            elif command == b"SET":
+                store[args[1]] = (time.time() + int(args[4]) / 1000, args[2])
+                self.wfile.write(b"+OK\r\n")
+            elif command == b"DEL":
+                self.wfile.write(b":%d\r\n" % int(store.pop(args[1], None) is not None))
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+class _RESPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _RESPHandler)
+        self.store = {}
+
+
+class BackendTests:
+    """Tests run against every backend"""
+
+    backend = None
+
+    def test_get_set_delete(self):
+        self.assertIsNone(self.backend.get("missing"))
+        self.backend.set("a", b"value", ttl=60)
+        self.assertEqual(b"value", self.backend.get("a"))
+        self.backend.delete("a")
+        self.assertIsNone(self.backend.get("a"))
+
+    def test_expiry(self):
+        self.backend.set("a", b"value", ttl=0.05)
+        time.sleep(0.1)
+        self.assertIsNone(self.backend.get("a"))
+
+
+class TestMemoryBackend(BackendTests, unittest.TestCase):
+    def setUp(self):
+        self.backend = MemoryBackend()
+
+
+class TestDiskBackend(BackendTests, unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "cache.sqlite3")
+        self.backend = DiskBackend(self.path)
+
+    def test_shared_between_workers(self):
+        """
+        Test that a value stored by one worker is read by another
+        """
+        self.backend.set("a", b"value", ttl=60)
+        self.assertEqual(b"value", DiskBackend(self.path).get("a"))
+
+    def test_database_is_opened_on_first_use(self):
+        """
+        Test that creating the backend opens no connection
+        """
+        backend = DiskBackend(self.path)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertIsNone(backend.get("a"))
+        self.assertTrue(os.path.exists(self.path))
+
+    @unittest.skipUnless(hasattr(os, "fork"), "fork is not available")
+    def test_forked_child_opens_its_connection(self):
+        """
+        Test that a forked process does not use its parent's connection
+        """
+        self.backend.set("a", b"value", ttl=60)
+        parent_conn = self.backend._connect()
+        pid = os.fork()
+        if pid == 0:  # The child reports through its exit status
+            new = self.backend._connect() is not parent_conn
+            os._exit(0 if new and self.backend.get("a") == b"value" else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, os.waitstatus_to_exitcode(status))
+        self.assertIs(parent_conn, self.backend._connect())
+
+
+class TestRedisBackend(BackendTests, unittest.TestCase):
+    def setUp(self):
+        self.server = _RESPServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        host, port = self.server.server_address
+        self.backend = RedisBackend(f"redis://{host}:{port}/0", timeout=1)
+
+    def test_unreachable_server(self):
+        """
+        Test that an unreachable server raises, and is not retried right away
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        host, port = self.server.server_address
+        backend = RedisBackend(f"redis://{host}:{port}/0", timeout=1)
+
+        with self.assertRaises(CacheBackendError):
+            backend.get("a")
+        with self.assertRaises(CacheBackendError):
+            backend.get("a")
+        self.assertGreater(backend._retry_at, time.monotonic())
+
+    def test_timed_out_server_is_not_retried_right_away(self):
+        """
+        Test that a server not answering a command is not contacted again right away
+        """
+        hung = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(hung.close)
+        host, port = hung.getsockname()
+        backend = RedisBackend(f"redis://{host}:{port}/0", timeout=0.1)
+
+        with self.assertRaises(CacheBackendError):
+            backend.get("a")
+        self.assertGreater(backend._retry_at, time.monotonic())
+
+        start = time.monotonic()
+        with self.assertRaises(CacheBackendError):
+            backend.get("a")
+        self.assertLess(time.monotonic() - start, 0.05)
+
+    def test_invalid_reply_closes_connection(self):
+        """
+        Test that a reply not following the protocol raises, and its connection is
+        not reused
+        """
+        other = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(other.close)
+
+        def reply():
+            conn, _ = other.accept()
+            with conn:
+                conn.recv(1024)
+                conn.sendall(b":not a number\r\n")
+
+        threading.Thread(target=reply, daemon=True).start()
+        host, port = other.getsockname()
+        backend = RedisBackend(f"redis://{host}:{port}/0", timeout=1)
+
+        with self.assertRaises(CacheBackendError):
+            backend.get("a")
+        self.assertEqual([], backend._idle)
+
+    def test_connections_are_pooled(self):
+        """
+        Test that commands reuse idle connections, opening one per concurrent command
+        """
+        for _ in range(3):
+            self.backend.set("a", b"value", ttl=60)
+        self.assertEqual(1, len(self.backend._idle))
+        idle = self.backend._idle[0]
+
+        # Commands in flight at the same time each take a connection
+        connections = [self.backend._acquire() for _ in range(3)]
+        self.assertIs(idle, connections[0])
+        self.assertEqual(3, len(set(map(id, connections))))
+        for conn in connections:
+            self.backend._release(conn)
+        self.assertEqual(3, len(self.backend._idle))
+        self.assertEqual(b"value", self.backend.get("a"))
+
+    def test_idle_connections_are_bounded(self):
+        """
+        Test that connections beyond the pool size are closed once released
+        """
+        host, port = self.server.server_address
+        backend = RedisBackend(f"redis://{host}:{port}/0", timeout=1, pool_size=2)
+        connections = [backend._acquire() for _ in range(3)]
+        for conn in connections:
+            backend._release(conn)
+        self.assertEqual(2, len(backend._idle))
+
+
+class TestGetL2Backend(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "l2", "cache.sqlite3")
+        for name, value in [
+            ("CACHE_L2_BACKEND", "disk"),
+            ("CACHE_L2_PATH", self.path),
+        ]:
+            patcher = patch(f"app.cache.backends.config.{name}", value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch.object(backends, "_backend", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_backend_is_created_on_first_use(self):
+        """
+        Test that the backend is only created once a cache uses it
+        """
+        l2 = get_l2_backend()
+        self.assertIsNone(backends._backend)
+        self.assertFalse(os.path.exists(self.path))
+
+        l2.set("a", b"value", ttl=60)
+        self.assertIsInstance(backends._backend, DiskBackend)
+        self.assertEqual(b"value", get_l2_backend().get("a"))
+
+    def test_unwritable_path(self):
+        """
+        Test that a backend path that can not be created raises a backend error
+        """
+        with patch("app.cache.backends.os.makedirs", side_effect=PermissionError):
+            with self.assertRaises(CacheBackendError):
+                get_l2_backend().get("a")
+        self.assertIsNone(backends._backend)
+
+    def test_no_backend(self):
+        with patch("app.cache.backends.config.CACHE_L2_BACKEND", ""):
+            self.assertIsNone(get_l2_backend())
+        with patch("app.cache.backends.config.CACHE_L2_BACKEND", "unknown"):
+            with self.assertRaises(ValueError):
+                get_l2_backend()
+
+    @unittest.skipUnless(hasattr(os, "fork"), "fork is not available")
+    def test_forked_child_creates_its_backend(self):
+        """
+        Test that a forked process does not use its parent's backend
+        """
+        get_l2_backend().set("a", b"value", ttl=60)
+        parent_backend = backends._backend
+        pid = os.fork()
+        if pid == 0:  # The child reports through its exit status
+            forgotten = backends._backend is None
+            value = get_l2_backend().get("a")
+            new = backends._backend is not parent_backend
+            os._exit(0 if forgotten and new and value == b"value" else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, os.waitstatus_to_exitcode(status))
+        self.assertIs(parent_backend, backends._backend)
+
+
+class TestCacheBackend(unittest.TestCase):
+    def test_interface_is_abstract(self):
+        """
+        Test that a backend must implement every method of the interface
+        """
+
+        class PartialBackend(CacheBackend):
+            def get(self, key):
+                return None
+
+        with self.assertRaises(TypeError):
+            PartialBackend()
+
+
+class TestTwoTierCache(unittest.TestCase):
+    def setUp(self):
+        self.l2 = MemoryBackend()
+
+    def _worker_cache(self):
+        return TTLCache("test", maxsize=10, ttl=60, l2=self.l2, decode=tuple)
+
+    def test_entries_are_shared_between_workers(self):
+        """
+        Test that an entry loaded by one worker is served to another from the second tier
+        """
+        loader = MagicMock(return_value=((True, "9969"), None))
+        self.assertEqual((True, "9969"), self._worker_cache().get_or_load("a", loader))
+
+        other = self._worker_cache()
+        self.assertEqual((True, "9969"), other.get_or_load("a", loader))
+        loader.assert_called_once()
+        self.assertEqual(1, other.stats()["l2_hits"])
+        self.assertIn("a", other)
+
+    def test_unavailable_second_tier(self):
+        """
+        Test that the cache keeps working when the second tier fails
+        """
+        l2 = MagicMock()
+        l2.get.side_effect = CacheBackendError("down")
+        l2.set.side_effect = CacheBackendError("down")
+        cache = TTLCache("test", maxsize=10, ttl=60, l2=l2)
+
+        self.assertEqual(1, cache.get_or_load("a", lambda: (1, None)))
+        self.assertEqual(1, cache.get("a"))
+        self.assertEqual(2, cache.stats()["l2_errors"])
+
+    def test_invalid_second_tier_value_is_a_miss(self):
+        """
+        Test that a corrupt or foreign value in the second tier is loaded again, and
+        removed from it
+        """
+        self.l2.delete = MagicMock(wraps=self.l2.delete)
+        for raw in (b"not json", b"[1]", b"[1e12, 5]"):
+            self.l2.set("test:a", raw, ttl=60)
+            self.l2.delete.reset_mock()
+            loader = MagicMock(return_value=((True, "9969"), None))
+            cache = self._worker_cache()
+
+            self.assertEqual((True, "9969"), cache.get_or_load("a", loader))
+            loader.assert_called_once()
+            self.l2.delete.assert_called_once_with("test:a")
+            self.assertEqual(1, cache.stats()["l2_errors"])
@@ -0,0 +1,54 @@
+import gzip
+import unittest
+from unittest.mock import patch
+
+from app.cache.precompress import Variants, choose_encoding, decode
+
+
+class TestChooseEncoding(unittest.TestCase):
+    def test_server_preference_breaks_ties(self):
+        self.assertEqual("br", choose_encoding("gzip, br", ["br", "gzip"]))
+
+    def test_client_quality_wins(self):
+        self.assertEqual("gzip", choose_encoding("gzip, br;q=0.5", ["br", "gzip"]))
+
+    def test_identity(self):
+        self.assertIsNone(choose_encoding("br;q=0, deflate", ["br", "gzip"]))
+        self.assertIsNone(choose_encoding(None, ["br", "gzip"]))
+
+
+class TestVariants(unittest.TestCase):
+    def test_gzip_variant(self):
+        body = b'{"videos": []}' * 100
+        variants = Variants(body)
+        self.assertTrue(variants.precompress())
+        encoding, encoded = variants.get("gzip")
+        self.assertEqual("gzip", encoding)
+        self.assertEqual(body, decode(encoded, "gzip"))
+        self.assertFalse(variants.precompress())
+
+    def test_body_is_not_compressed_on_get(self):
+        body = b'{"videos": []}' * 100
+        variants = Variants(body)
+        self.assertEqual((None, body), variants.get("gzip"))
+        self.assertEqual([], variants.available)
+
+    def test_encoded_variant(self):
+        body = b'{"videos": []}' * 100
+        variants = Variants(body, {"gzip": gzip.compress(body), "deflate": b"x"})
+        self.assertEqual(["gzip"], variants.available)
+        self.assertEqual("gzip", variants.get("gzip")[0])
+
+    @patch("app.cache.precompress.config.PRECOMPRESS_MIN_SIZE", 0)
+    def test_incompressible_body_is_served_as_is(self):
+        variants = Variants(b"x")
+        variants.precompress()
+        self.assertEqual((None, b"x"), variants.get("gzip"))
+
+    @patch("app.cache.precompress.config.PRECOMPRESS_MIN_SIZE", 10)
+    def test_encodings_of_small_bodies(self):
+        self.assertEqual([], Variants(b"short").encodings)
+        self.assertIn("gzip", Variants(b"long enough body").encodings)
+
+    def test_decode_unsupported_encoding(self):
+        self.assertIsNone(decode(gzip.compress(b"body"), "compress"))
@@ -0,0 +1,271 @@
+import gzip
+import json
+import unittest
+from unittest.mock import patch
+
+from flask import Flask, abort
+from flask_compress import Compress
+
+from app.cache.precompress import ENCODINGS
+from app.cache.responses import ResponseCache
+from app.routes.utils import respond_with
+
+
+def _make_app():
+    app = Flask(__name__)
+    app.calls = 0
+
+    @app.route("/public")
+    def public():
+        app.calls += 1
+        return respond_with(
+            {"calls": app.calls},
+            cache_max_age=60,
+            stale_revalidate=30,
+            stale_error=120,
+        )
+
+    @app.route("/private")
+    def private():
+        app.calls += 1
+        return respond_with({"calls": app.calls}, private=True, cache_max_age=60)
+
+    @app.route("/profile")
+    def profile():
+        app.calls += 1
+        return respond_with({"name": "user"}, private=True, cache_max_age=60)
+
+    @app.route("/flaky")
+    def flaky():
+        app.calls += 1
+        if app.calls == 1:
+            abort(500)
+        return respond_with({"calls": app.calls}, cache_max_age=60)
+
+    @app.route("/large")
+    def large():
+        app.calls += 1
+        return respond_with(
+            {"videos": [{"id": i} for i in range(200)]}, cache_max_age=60
+        )
+
+    @app.route("/failing")
+    def failing():
+        app.calls += 1
+        if app.calls > 1:
+            abort(500)
+        return respond_with({"calls": app.calls}, cache_max_age=60, stale_error=120)
+
+    Compress(app)
+    return app
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.app = _make_app()
+        self.response_cache = ResponseCache(self.app.wsgi_app, maxsize=10)
+        self.app.wsgi_app = self.response_cache
+        self.client = self.app.test_client()
+
+        self.now = 1000.0
+        patcher = patch("app.cache.responses.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("app.cache.ttl.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Precompress bodies as soon as they are stored
+        patcher = patch("app.cache.responses.get_refresh_executor")
+        patcher.start().return_value.submit.side_effect = lambda fn, *args: fn(*args)
+        self.addCleanup(patcher.stop)
+
+    def test_public_response_is_cached(self):
+        """
+        Test that repeat requests for a public response do not run the view
+        """
+        first = self.client.get("/public")
+        second = self.client.get("/public")
+        self.assertEqual({"calls": 1}, second.json)
+        self.assertEqual(first.headers["ETag"], second.headers["ETag"])
+        self.assertEqual(1, self.app.calls)
+        self.assertEqual(1, self.response_cache.stats()["hits"])
+
+    def test_private_response_is_not_cached(self):
+        """
+        Test that private responses always run the view
+        """
+        self.client.get("/private")
+        self.assertEqual({"calls": 2}, self.client.get("/private").json)
+
+    def test_not_modified(self):
+        """
+        Test that a conditional request matching the cached ETag gets a 304
+        """
+        etag = self.client.get("/public").headers["ETag"]
+        response = self.client.get("/public", headers={"If-None-Match": etag})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(b"", response.data)
+        self.assertEqual(etag, response.headers["ETag"])
+        self.assertEqual(1, self.app.calls)
+
+    def test_conditional_miss_is_cached(self):
+        """
+        Test that a first conditional request still fills the cache
+        """
+        etag = _make_app().test_client().get("/public").headers["ETag"]
+        response = self.client.get("/public", headers={"If-None-Match": etag})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(200, self.client.get("/public").status_code)
+        self.assertEqual(1, self.app.calls)
+
+    def test_uncacheable_not_modified(self):
+        """
+        Test that the app answers conditional requests for an uncacheable response
+        """
+        etag = self.client.get("/profile").headers["ETag"]
+        response = self.client.get("/profile", headers={"If-None-Match": etag})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(2, self.app.calls)
+
+    def test_error_is_not_remembered_as_uncacheable(self):
+        """
+        Test that an error response does not stop the URL from being cached
+        """
+        self.assertEqual(500, self.client.get("/flaky").status_code)
+        self.assertEqual(0, len(self.response_cache.uncacheable))
+        self.assertEqual({"calls": 2}, self.client.get("/flaky").json)
+        self.assertEqual({"calls": 2}, self.client.get("/flaky").json)
+
+    def test_encodings_share_one_response(self):
+        """
+        Test that every accepted encoding is served from a single run of the view
+        """
+        identity = self.client.get("/large")
+        gzipped = self.client.get("/large", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(1, self.app.calls)
+        self.assertIsNone(identity.headers.get("Content-Encoding"))
+        self.assertEqual("gzip", gzipped.headers["Content-Encoding"])
+        self.assertEqual(identity.data, gzip.decompress(gzipped.data))
+        self.assertNotEqual(identity.headers["ETag"], gzipped.headers["ETag"])
+
+    def test_compressed_miss_is_stored_uncompressed(self):
+        """
+        Test that a body compressed by flask-compress is stored uncompressed
+        """
+        self.client.get("/large", headers={"Accept-Encoding": "gzip"})
+        response = self.client.get("/large")
+        self.assertEqual(200, len(json.loads(response.data)["videos"]))
+        self.assertEqual(str(len(response.data)), response.headers["Content-Length"])
+
+    def test_body_is_compressed_once_per_encoding(self):
+        """
+        Test that a body is compressed once per encoding, in the background
+        """
+        with patch("app.cache.precompress.compress", return_value=b"encoded") as mock:
+            for encoding in ["gzip", *ENCODINGS, *ENCODINGS]:
+                self.client.get("/large", headers={"Accept-Encoding": encoding})
+        # The gzip variant of flask-compress is kept
+        compressed = [call.args[1] for call in mock.call_args_list]
+        self.assertEqual([e for e in ENCODINGS if e != "gzip"], compressed)
+        self.assertEqual(1, self.app.calls)
+
+    def test_compressed_miss_is_served_before_precompression(self):
+        """
+        Test that the variant flask-compress produced is served while the others are
+        not compressed yet
+        """
+        self.response_cache._precompress = lambda *_args: None
+        headers = {"Accept-Encoding": "gzip"}
+        gzipped = self.client.get("/large", headers=headers)
+        self.assertEqual("gzip", gzipped.headers["Content-Encoding"])
+        self.assertEqual(
+            "gzip",
+            self.client.get("/large", headers=headers).headers["Content-Encoding"],
+        )
+        identity = self.client.get("/large", headers={"Accept-Encoding": "br"})
+        self.assertIsNone(identity.headers.get("Content-Encoding"))
+        self.assertEqual(1, self.app.calls)
+
+    def test_byte_budget_counts_variants(self):
+        """
+        Test that cached bodies and their compressed variants count against the byte
+        budget, evicting the least recently used responses
+        """
+        self.response_cache.cache.maxbytes = 10**6
+        self.response_cache._precompress = lambda *_args: None
+        self.client.get("/large")
+        identity = self.response_cache.stats()["bytes"]
+        self.assertGreater(identity, 2000)
+
+        entry = self.response_cache.cache.get("/large")
+        entry.variants.precompress()
+        self.response_cache.cache.resize("/large")
+        with_variants = self.response_cache.stats()["bytes"]
+        self.assertGreater(with_variants, identity)
+
+        self.response_cache.cache.maxbytes = with_variants + 100
+        self.client.get("/public")
+        self.assertEqual(1, len(self.response_cache.cache))
+        self.assertNotIn("/large", self.response_cache.cache)
+
+    def test_small_bodies_are_not_compressed(self):
+        """
+        Test that bodies below the minimum size are served uncompressed
+        """
+        self.client.get("/public")
+        response = self.client.get("/public", headers={"Accept-Encoding": "gzip"})
+        self.assertIsNone(response.headers.get("Content-Encoding"))
+
+    def test_not_modified_compressed(self):
+        """
+        Test that a conditional request matching a compressed variant gets a 304
+        """
+        headers = {"Accept-Encoding": "gzip"}
+        etag = self.client.get("/large", headers=headers).headers["ETag"]
+        response = self.client.get("/large", headers={**headers, "If-None-Match": etag})
+        self.assertEqual(304, response.status_code)
+
+    def test_stale_while_revalidate(self):
+        """
+        Test that a stale response is served while it is refreshed in the background
+        """
+        self.client.get("/public")
+        self.now += 70
+
+        with patch("app.cache.responses.get_refresh_executor") as mock_executor:
+            mock_executor.return_value.submit.side_effect = lambda fn: fn()
+            response = self.client.get("/public")
+        self.assertEqual({"calls": 1}, response.json)
+        self.assertEqual(2, self.app.calls)
+        self.assertEqual({"calls": 2}, self.client.get("/public").json)
+
+    def test_expired_response_is_reloaded(self):
+        """
+        Test that a response past its stale window runs the view again
+        """
+        self.client.get("/public")
+        self.now += 100
+        self.assertEqual({"calls": 2}, self.client.get("/public").json)
+
+    def test_stale_if_error(self):
+        """
+        Test that a stale response is served instead of a server error
+        """
+        self.client.get("/failing")
+        self.now += 90
+
+        response = self.client.get("/failing")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({"calls": 1}, response.json)
+        self.assertEqual(1, self.response_cache.stats()["stale_errors"])
+
+        self.now += 100
+        self.assertEqual(500, self.client.get("/failing").status_code)
+
+    def test_age_header(self):
+        """
+        Test that cached responses report their age
+        """
+        self.client.get("/public")
+        self.now += 12.5
+        self.assertEqual("12", self.client.get("/public").headers["Age"])
@@ -0,0 +1,81 @@
+import json
+import sys
+import unittest
+from unittest.mock import patch
+
+from app.api.watchlist import WatchlistSnapshot
+from app.cache.responses import ResponseCache
+from app.cache.sizing import deep_sizeof
+from app.cache.ttl import TTLCache
+
+
+class TestDeepSizeof(unittest.TestCase):
+    def test_counts_nested_values(self):
+        """
+        Test that the size of a value includes the values it holds
+        """
+        videos = [{"id": f"kitsu:1:{i}", "title": "Episode " * 10} for i in range(100)]
+        meta = {"meta": {"name": "Series", "videos": videos}}
+        self.assertGreater(deep_sizeof(meta), sys.getsizeof(videos) * 10)
+        self.assertLess(deep_sizeof({"meta": {}}), deep_sizeof(meta))
+
+    def test_shared_values_are_counted_once(self):
+        """
+        Test that a value referenced twice is only counted once
+        """
+        shared = "x" * 1000
+        value = [shared, shared]
+        self.assertEqual(
+            sys.getsizeof(value) + sys.getsizeof(shared), deep_sizeof(value)
+        )
+
+    def test_watchlist_snapshot(self):
+        """
+        Test that a watchlist snapshot is measured with the entries it holds
+        """
+        entries = [
+            {
+                "node": {
+                    "id": i,
+                    "title": f"Anime {i}",
+                    "genres": [{"name": "Action"}],
+                },
+                "list_status": {"status": "watching", "updated_at": f"2024-01-{i}"},
+            }
+            for i in range(500)
+        ]
+        snapshot = WatchlistSnapshot(entries)
+        self.assertGreaterEqual(deep_sizeof(snapshot), deep_sizeof(entries))
+
+        cache = TTLCache("watchlists", maxsize=10, ttl=60)
+        cache.set(("123", False), snapshot)
+        self.assertGreaterEqual(cache.estimate_bytes(), deep_sizeof(entries))
+
+    def test_cached_response(self):
+        """
+        Test that a cached response is measured with its body and every variant
+        """
+        body = json.dumps([{"id": i, "name": f"video {i}"} for i in range(10000)])
+
+        def app(_environ, start_response):
+            start_response(
+                "200 OK",
+                [
+                    ("Content-Type", "application/json"),
+                    ("Cache-Control", "max-age=60, public"),
+                ],
+            )
+            return [body.encode()]
+
+        responses = ResponseCache(app)
+        with patch.object(responses, "_precompress"):
+            responses(
+                {"REQUEST_METHOD": "GET", "PATH_INFO": "/meta"}, lambda *_args: None
+            )
+        identity = responses.cache.estimate_bytes()
+        self.assertGreater(identity, len(body))
+
+        entry = responses.cache.get("/meta")
+        entry.variants.precompress()
+        responses.cache.resize("/meta")
+        self.assertGreater(responses.cache.estimate_bytes(), identity + 1000)
@@ -0,0 +1,27 @@
+import unittest
+
+from app.cache.sketch import FrequencySketch
+
+
+class TestFrequencySketch(unittest.TestCase):
+    def test_estimate(self):
+        sketch = FrequencySketch(capacity=100)
+        for _ in range(5):
+            sketch.increment("hot")
+        sketch.increment("cold")
+        self.assertEqual(5, sketch.estimate("hot"))
+        self.assertEqual(1, sketch.estimate("cold"))
+        self.assertEqual(0, sketch.estimate("unseen"))
+
+    def test_counters_saturate(self):
+        sketch = FrequencySketch(capacity=100)
+        for _ in range(100):
+            sketch.increment("hot")
+        self.assertEqual(15, sketch.estimate("hot"))
+
+    def test_counters_are_halved(self):
+        sketch = FrequencySketch(capacity=100)
+        sketch.sample_size = 10
+        for _ in range(10):
+            sketch.increment("hot")
+        self.assertEqual(5, sketch.estimate("hot"))
@@ -0,0 +1,39 @@
+import unittest
+
+from app.cache.stats import TopKeys, WindowedRatio
+
+
+class TestWindowedRatio(unittest.TestCase):
+    def test_ratio_over_windows(self):
+        ratios = WindowedRatio(bucket_duration=60, max_window=3600)
+        for _ in range(3):
+            ratios.record(False, now=0)
+        ratios.record(True, now=3000)
+        ratios.record(False, now=3590)
+        ratios.record(True, now=3595)
+
+        self.assertEqual(0.5, ratios.ratio(60, now=3599))
+        self.assertAlmostEqual(2 / 3, ratios.ratio(900, now=3599))
+        self.assertEqual(2 / 6, ratios.ratio(3600, now=3599))
+
+    def test_old_buckets_are_dropped(self):
+        ratios = WindowedRatio(bucket_duration=60, max_window=300)
+        ratios.record(True, now=0)
+        for minute in range(1, 7):
+            ratios.record(False, now=minute * 60)
+        self.assertEqual(0, ratios.ratio(3600, now=400))
+        self.assertIsNone(ratios.ratio(60, now=2000))
+
+
+class TestTopKeys(unittest.TestCase):
+    def test_frequent_keys_are_found(self):
+        top_keys = TopKeys(capacity=10)
+        for i in range(100):
+            top_keys.add("hot")
+            top_keys.add(f"cold{i}")
+            if i % 2:
+                top_keys.add("warm")
+
+        top = top_keys.top(2)
+        self.assertEqual(["hot", "warm"], [key for key, _ in top])
+        self.assertGreaterEqual(top[0][1], 100)
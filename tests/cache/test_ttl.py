@@ -0,0 +1,311 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from app.cache.ttl import TTLCache, registered_caches
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_get_and_set(self):
+        cache = TTLCache("test", maxsize=10, ttl=60)
+        cache.set("a", 1)
+        self.assertEqual(1, cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual({"hits": 1, "misses": 1}, _counters(cache, "hits", "misses"))
+
+    def test_lru_eviction(self):
+        cache = TTLCache("test", maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertEqual(1, cache.stats()["evictions"])
+
+    @patch("app.cache.ttl.time.monotonic")
+    def test_expiry(self, mock_time):
+        mock_time.return_value = 100
+        cache = TTLCache("test", maxsize=10, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=10)
+
+        mock_time.return_value = 111
+        self.assertEqual(1, cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(1, cache.stats()["expirations"])
+
+    @patch("app.cache.ttl.time.monotonic")
+    def test_get_or_load(self, mock_time):
+        mock_time.return_value = 100
+        cache = TTLCache("test", maxsize=10, ttl=60)
+        loader = MagicMock(return_value=("value", 5))
+
+        self.assertEqual("value", cache.get_or_load("a", loader))
+        self.assertEqual("value", cache.get_or_load("a", loader))
+        loader.assert_called_once()
+
+        mock_time.return_value = 106  # expired by the loader's ttl
+        cache.get_or_load("a", loader)
+        self.assertEqual(2, loader.call_count)
+
+    def test_get_or_load_does_not_cache_exceptions(self):
+        cache = TTLCache("test", maxsize=10, ttl=60)
+        loader = MagicMock(side_effect=[ValueError(), ("value", None)])
+
+        with self.assertRaises(ValueError):
+            cache.get_or_load("a", loader)
+        self.assertEqual("value", cache.get_or_load("a", loader))
+
+    def test_dump_and_restore(self):
+        cache = TTLCache("test", maxsize=10, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=0)
+        cache.set("c", 3)
+        entries = cache.dump(limit=10)
+        self.assertEqual(["c", "a"], [key for key, _, _ in entries])
+
+        restored = TTLCache("test", maxsize=2, ttl=60, decode=str)
+        restored.set("d", "new")
+        self.assertEqual(1, restored.restore(entries))
+        self.assertIn("c", restored)
+        self.assertNotIn("a", restored)
+
+        # Restored entries are the least recently used
+        restored.set("e", "newer")
+        self.assertNotIn("c", restored)
+        self.assertEqual("new", restored.get("d"))
+
+        restored = TTLCache("test", maxsize=10, ttl=60, decode=str)
+        restored.restore(entries)
+        self.assertEqual("3", restored.get("c"))
+
+    def test_byte_budget(self):
+        cache = TTLCache("test", maxsize=10, ttl=60, maxbytes=10, sizeof=len)
+        cache.set("a", "aaaa")
+        cache.set("b", "bbbb")
+        cache.set("c", "cccc")
+        self.assertNotIn("a", cache)
+        self.assertEqual(8, cache.stats()["bytes"])
+
+        # Replacing an entry frees its bytes first
+        cache.set("c", "c")
+        self.assertIn("b", cache)
+        self.assertEqual(5, cache.stats()["bytes"])
+
+        cache.pop("b")
+        self.assertEqual(1, cache.stats()["bytes"])
+
+    def test_resize(self):
+        cache = TTLCache("test", maxsize=10, ttl=60, maxbytes=10, sizeof=len)
+        cache.set("a", ["a"])
+        cache.set("b", ["b"])
+        cache.get("b").extend("b" * 8)
+        cache.resize("b")
+        self.assertEqual(10, cache.stats()["bytes"])
+
+        # Growing past the budget evicts the least recently used entries
+        cache.get("b").append("b")
+        cache.resize("b")
+        self.assertNotIn("a", cache)
+        self.assertEqual(10, cache.stats()["bytes"])
+
+    def test_oversized_value_is_not_kept(self):
+        cache = TTLCache("test", maxsize=10, ttl=60, maxbytes=10, sizeof=len)
+        cache.set("a", "aaaa")
+        cache.set("b", "b" * 11)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertEqual(1, cache.stats()["oversized"])
+
+    def test_compressed_values(self):
+        cache = TTLCache("test", maxsize=10, ttl=60, decode=tuple, compress=True)
+        value = (200, {"videos": [{"title": "Episode"}] * 100})
+        cache.set("a", value)
+        self.assertEqual(value, cache.get("a"))
+        self.assertIsNot(cache.get("a"), cache.get("a"))
+        self.assertEqual(value, cache.pop("a"))
+
+    def test_compressed_values_use_less_memory(self):
+        value = {"videos": [{"title": f"Episode {i}"} for i in range(100)]}
+        plain = TTLCache("test", maxsize=10, ttl=60, maxbytes=2**20)
+        compressed = TTLCache("test", maxsize=10, ttl=60, maxbytes=2**20, compress=True)
+        plain.set("a", value)
+        compressed.set("a", value)
+        self.assertLess(compressed.stats()["bytes"] * 5, plain.stats()["bytes"])
+
+    def test_compressed_dump_and_restore(self):
+        cache = TTLCache("test", maxsize=10, ttl=60, decode=tuple, compress=True)
+        cache.set("a", (200, {"meta": {}}))
+        entries = cache.dump(limit=10)
+        self.assertEqual([200, {"meta": {}}], entries[0][2])
+
+        restored = TTLCache("test", maxsize=10, ttl=60, decode=tuple, compress=True)
+        restored.restore(entries)
+        self.assertEqual((200, {"meta": {}}), restored.get("a"))
+
+    def test_registered_caches(self):
+        cache = TTLCache("test_registry", maxsize=10, ttl=60)
+        self.assertIn(cache, registered_caches())
+
+    @patch("app.cache.ttl.time")
+    def test_hit_ratios_and_top_keys(self, mock_time):
+        mock_time.monotonic.return_value = 1000
+        cache = TTLCache("test", maxsize=10, ttl=3600)
+        cache.set("a", 1)
+        for _ in range(3):
+            cache.get("a")
+        cache.get("b")
+
+        self.assertEqual(0.75, cache.hit_ratios()["1m"])
+        mock_time.monotonic.return_value = 1200
+        self.assertIsNone(cache.hit_ratios()["1m"])
+        self.assertEqual(0.75, cache.hit_ratios()["1h"])
+        self.assertEqual([("a", 3), ("b", 1)], cache.top_keys(5))
+
+    def test_estimate_bytes(self):
+        cache = TTLCache("test", maxsize=10, ttl=60)
+        self.assertEqual(0, cache.estimate_bytes())
+        cache.set("a", "x" * 1000)
+        cache.set("b", "y" * 1000)
+        self.assertGreater(cache.estimate_bytes(sample=1), 2000)
+
+    def test_admission_rejects_infrequent_keys(self):
+        cache = TTLCache("test", maxsize=2, ttl=60, admission=True)
+        for key in ["a", "b"]:
+            for _ in range(3):
+                cache.get(key)
+            cache.set(key, key)
+
+        # A key looked up once does not replace frequently looked up ones
+        cache.get_or_load("c", lambda: ("c", None))
+        self.assertNotIn("c", cache)
+        self.assertIn("a", cache)
+        self.assertEqual(1, cache.stats()["rejections"])
+
+        for _ in range(5):
+            cache.get("c")
+        cache.set("c", "c")
+        self.assertIn("c", cache)
+        self.assertNotIn("a", cache)
+
+    def test_admission_with_room(self):
+        cache = TTLCache("test", maxsize=2, ttl=60, admission=True)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(2, len(cache))
+
+        # Replacing an entry is always admitted
+        cache.set("a", 3)
+        self.assertEqual(3, cache.get("a"))
+
+
+def _counters(cache, *names):
+    stats = cache.stats()
+    return {name: stats[name] for name in names}
+
+
+class TestStaleWhileRevalidate(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        patcher = patch("app.cache.ttl.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = TTLCache("test", maxsize=10, ttl=60, stale=30)
+
+    def _wait_for_refresh(self):
+        for _ in range(100):
+            if not self.cache._refreshing:
+                return
+            time.sleep(0.01)
+        self.fail("The stale entry was not refreshed")
+
+    def test_stale_value_is_served_while_refreshing(self):
+        """
+        Test that an expired entry is returned at once, and reloaded in the background
+        """
+        loaded = threading.Event()
+
+        def loader():
+            loaded.wait(1)
+            return "fresh", None
+
+        self.cache.set("a", "stale")
+        self.now += 61
+
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual("stale", self.cache.get_or_load("a", loader))
+        self.assertEqual("stale", self.cache.get_or_load("a", loader))
+        self.assertEqual(1, self.cache.stats()["refreshes"])
+
+        loaded.set()
+        self._wait_for_refresh()
+        self.assertEqual("fresh", self.cache.get_or_load("a", loader))
+        self.assertEqual(2, self.cache.stats()["stale_hits"])
+
+    def test_failed_refresh_keeps_stale_value(self):
+        """
+        Test that the stale value is kept when the refresh fails
+        """
+        self.cache.set("a", "stale")
+        self.now += 61
+
+        loader = MagicMock(side_effect=ConnectionError())
+        self.assertEqual("stale", self.cache.get_or_load("a", loader))
+        self._wait_for_refresh()
+        loader.assert_called_once()
+        self.assertEqual("stale", self.cache.get_or_load("a", loader))
+
+    def test_value_past_stale_window_is_reloaded(self):
+        """
+        Test that an entry past its stale window is loaded in the foreground
+        """
+        self.cache.set("a", "stale")
+        self.now += 91
+
+        self.assertEqual("fresh", self.cache.get_or_load("a", lambda: ("fresh", None)))
+        self.assertEqual(0, self.cache.stats()["refreshes"])
+
+    def test_kept_value_is_served_until_replaced(self):
+        """
+        Test that a kept entry past its stale window is served when reloading it fails,
+        and only dropped once a load succeeds
+        """
+        self.cache.keep_expired = True
+        self.cache.set("a", "expired")
+        self.now += 3600
+
+        loader = MagicMock(side_effect=ConnectionError())
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual("expired", self.cache.get_or_load("a", loader))
+        self.assertEqual("expired", self.cache.get_or_load("a", loader))
+        self.assertEqual(2, loader.call_count)
+        self.assertEqual(0, self.cache.stats()["refreshes"])
+
+        self.assertEqual("fresh", self.cache.get_or_load("a", lambda: ("fresh", None)))
+        self.assertEqual("fresh", self.cache.get("a"))
+
+    def test_deferred_refresh_serves_value_as_is(self):
+        """
+        Test that stale and kept entries are not reloaded while refreshes are deferred
+        """
+        defer = True
+        self.cache.keep_expired = True
+        self.cache.defer_refresh = lambda _key: defer
+        self.cache.set("stale", "stale")
+        self.cache.set("expired", "expired", ttl=1)
+        self.now += 61
+
+        loader = MagicMock(return_value=("fresh", None))
+        self.assertEqual("stale", self.cache.get_or_load("stale", loader))
+        self.assertEqual("expired", self.cache.get_or_load("expired", loader))
+        loader.assert_not_called()
+        self.assertEqual(0, self.cache.stats()["refreshes"])
+
+        defer = False
+        self.assertEqual("fresh", self.cache.get_or_load("expired", loader))
+        self.assertEqual("stale", self.cache.get_or_load("stale", loader))
+        self._wait_for_refresh()
+        self.assertEqual("fresh", self.cache.get_or_load("stale", loader))
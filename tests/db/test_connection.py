@@ -0,0 +1,88 @@
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+
+from pymongo.errors import ServerSelectionTimeoutError
+
+from app.db import connection
+
+
+class TestConnection(unittest.TestCase):
+    def setUp(self):
+        self.previous = connection._client
+        connection._client = None
+        # Clients connect in the background, none of the tests needs a server
+        patcher = patch.object(
+            connection.Config, "MONGO_URI", "mongodb://127.0.0.1:27017/"
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        if connection._client is not None:
+            connection._client.close()
+        connection._client = self.previous
+
+    @patch("config.MONGO_MAX_POOL_SIZE", 7)
+    def test_client_is_created_once(self):
+        """
+        Test that the client is created on first use, with the configured pool
+        """
+        client = connection.get_client()
+        self.assertIs(client, connection.get_client())
+        self.assertEqual(7, client.options.pool_options.max_pool_size)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "fork is not available")
+    def test_forked_child_creates_its_client(self):
+        """
+        Test that a forked process does not use its parent's client
+        """
+        parent_client = connection.get_client()
+        pid = os.fork()
+        if pid == 0:  # The child reports through its exit status
+            forgotten = connection._client is None
+            new = connection.get_client() is not parent_client
+            os._exit(0 if forgotten and new else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, os.waitstatus_to_exitcode(status))
+        self.assertIs(parent_client, connection.get_client())
+
+    def test_lazy_collection(self):
+        """
+        Test that a lazy collection resolves to the collection of the current client
+        """
+        collection = connection.LazyCollection("database", "users")
+        self.assertIsNone(connection._client)
+        self.assertEqual("database.users", collection.full_name)
+
+        client = connection.get_client()
+        self.assertIs(client, collection.collection().database.client)
+        connection._client = None
+        self.assertIsNot(client, collection.collection().database.client)
+        client.close()
+
+    def test_private_attributes_do_not_create_the_client(self):
+        """
+        Test that probing a lazy collection's private attributes does not connect
+        """
+        collection = connection.LazyCollection("database", "users")
+        self.assertFalse(hasattr(collection, "__func__"))
+        self.assertIsNone(connection._client)
+
+    @patch("app.db.connection.get_client")
+    def test_health_check(self, mock_get_client):
+        """
+        Test that health checks report whether MongoDB answered a ping
+        """
+        self.assertTrue(connection.check_health())
+        mock_get_client.return_value.admin.command.assert_called_once_with("ping")
+        self.assertTrue(connection.health()["ok"])
+
+        mock_get_client.return_value = MagicMock()
+        mock_get_client.return_value.admin.command.side_effect = (
+            ServerSelectionTimeoutError("unreachable")
+        )
+        self.assertFalse(connection.check_health())
+        health = connection.health()
+        self.assertFalse(health["ok"])
+        self.assertEqual("unreachable", health["error"])
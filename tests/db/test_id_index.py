@@ -0,0 +1,246 @@
+import mmap
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from app.db import db
+from app.db.id_index import IdIndex
+
+MAPPINGS = [
+    {"mal_id": 1, "kitsu_id": 10},
+    {"mal_id": 5, "kitsu_id": 3},
+    {"mal_id": 3, "kitsu_id": 7},
+    {"mal_id": 8},
+    {"kitsu_id": 40, "mal_id": None},
+    {"mal_id": "9", "kitsu_id": "90"},
+    {"mal_id": "invalid", "kitsu_id": 4},
+]
+
+
+class TestIdIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = IdIndex()
+
+    def test_lookups(self):
+        """
+        Test that IDs are resolved in both directions
+        """
+        self.assertEqual(4, self.index.load(MAPPINGS))
+        self.assertTrue(self.index.loaded)
+        self.assertEqual(10, self.index.kitsu_id(1))
+        self.assertEqual(7, self.index.kitsu_id(3))
+        self.assertEqual(90, self.index.kitsu_id(9))
+        self.assertEqual(5, self.index.mal_id(3))
+        self.assertEqual(1, self.index.mal_id(10))
+
+    def test_missing_mappings(self):
+        """
+        Test that IDs without a mapping, or a partial one, are not resolved
+        """
+        self.index.load(MAPPINGS)
+        self.assertIsNone(self.index.kitsu_id(8))
+        self.assertIsNone(self.index.mal_id(40))
+        self.assertIsNone(self.index.mal_id(4))
+        self.assertIsNone(self.index.kitsu_id(0))
+        self.assertIsNone(self.index.kitsu_id(1000))
+
+    def test_duplicates_keep_first(self):
+        """
+        Test that the first mapping of a duplicated ID is kept
+        """
+        self.index.load([{"mal_id": 2, "kitsu_id": 20}, {"mal_id": 2, "kitsu_id": 21}])
+        self.assertEqual(20, self.index.kitsu_id(2))
+        self.assertEqual(1, len(self.index))
+
+    def test_load_replaces(self):
+        """
+        Test that loading replaces the previous mapping
+        """
+        self.index.load(MAPPINGS)
+        self.index.load([{"mal_id": 2, "kitsu_id": 20}, {"mal_id": 4, "kitsu_id": 6}])
+        self.assertIsNone(self.index.kitsu_id(1))
+        self.assertEqual(20, self.index.kitsu_id(2))
+        self.assertEqual(2 * 4 * 8, self.index.nbytes)
+
+    def test_empty_or_truncated_load_is_refused(self):
+        """
+        Test that an empty mapping, or one much smaller than the index, is refused
+        """
+        with self.assertRaises(ValueError):
+            self.index.load([])
+        self.assertFalse(self.index.loaded)
+
+        self.index.load(MAPPINGS)
+        with self.assertRaises(ValueError):
+            self.index.load([{"mal_id": 2, "kitsu_id": 20}])
+        self.assertEqual(10, self.index.kitsu_id(1))
+        self.assertIsNone(self.index.kitsu_id(2))
+        self.assertEqual(4, len(self.index))
+
+    def test_save_and_map(self):
+        """
+        Test that a saved index is mapped with the same lookups
+        """
+        self.index.load(MAPPINGS)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "index.bin")
+            self.index.save(path)
+
+            mapped = IdIndex()
+            self.assertEqual(4, mapped.map(path))
+            # The mapping stays readable once the file is replaced
+            IdIndex().save(path)
+        self.assertTrue(mapped.loaded)
+        self.assertEqual(10, mapped.kitsu_id(1))
+        self.assertEqual(5, mapped.mal_id(3))
+        self.assertIsNone(mapped.kitsu_id(8))
+        self.assertEqual(self.index.nbytes, mapped.nbytes)
+
+    def test_map_invalid_file(self):
+        """
+        Test that mapping a file which is not a complete index fails
+        """
+        self.index.load(MAPPINGS)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "index.bin")
+            self.index.save(path)
+            with open(path, "r+b") as f:
+                f.truncate(os.path.getsize(path) - 8)
+            with self.assertRaises(ValueError):
+                IdIndex().map(path)
+
+            with open(path, "wb") as f:
+                f.write(b"garbage")
+            with self.assertRaises(ValueError):
+                IdIndex().map(path)
+
+    def test_map_empty_or_truncated_index_is_refused(self):
+        """
+        Test that mapping an empty index, or one much smaller than the index, fails
+        and keeps the index's mappings
+        """
+        self.index.load(MAPPINGS)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "index.bin")
+            IdIndex().save(path)
+            with self.assertRaises(ValueError):
+                self.index.map(path)
+
+            smaller = IdIndex()
+            smaller.load([{"mal_id": 2, "kitsu_id": 20}])
+            smaller.save(path)
+            with self.assertRaises(ValueError):
+                self.index.map(path)
+        self.assertEqual(10, self.index.kitsu_id(1))
+
+    def test_refused_map_is_closed(self):
+        """
+        Test that the file mapped for an index that is refused is unmapped again
+        """
+        buffers = []
+        real_mmap = mmap.mmap
+
+        def mapping(*args, **kwargs):
+            buffers.append(real_mmap(*args, **kwargs))
+            return buffers[-1]
+
+        self.index.load(MAPPINGS)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "index.bin")
+            IdIndex().save(path)
+            with patch("app.db.id_index.mmap.mmap", side_effect=mapping):
+                with self.assertRaises(ValueError):
+                    self.index.map(path)
+        self.assertTrue(buffers[0].closed)
+
+
+@patch("app.db.db.anime_mapping")
+class TestIdLookups(unittest.TestCase):
+    def setUp(self):
+        db.id_cache.clear()
+
+    def test_index_answers_without_database(self, mock_mapping):
+        """
+        Test that a loaded index answers every lookup, found or not
+        """
+        index = IdIndex()
+        index.load(MAPPINGS)
+        with patch("app.db.db.id_index", index):
+            self.assertEqual((True, 10), db.get_kitsu_id_from_mal_id("mal_1"))
+            self.assertEqual((True, 5), db.get_mal_id_from_kitsu_id("3"))
+            self.assertEqual((False, ""), db.get_kitsu_id_from_mal_id("mal_8"))
+            self.assertEqual((False, ""), db.get_mal_id_from_kitsu_id(""))
+        mock_mapping.find_one.assert_not_called()
+
+    def test_database_until_loaded(self, mock_mapping):
+        """
+        Test that lookups use the database while the index is not loaded
+        """
+        mock_mapping.find_one.return_value = {"mal_id": 1, "kitsu_id": 10}
+        with patch("app.db.db.id_index", IdIndex()):
+            self.assertEqual((True, 10), db.get_kitsu_id_from_mal_id("mal_1"))
+        mock_mapping.find_one.assert_called_once_with({"mal_id": 1})
+
+    def test_batch_with_index(self, mock_mapping):
+        """
+        Test that a loaded index resolves a batch without the database
+        """
+        index = IdIndex()
+        index.load(MAPPINGS)
+        with patch("app.db.db.id_index", index):
+            self.assertEqual(
+                {"mal_1": (True, 10), 3: (True, 7), "mal_8": (False, "")},
+                db.get_kitsu_ids_from_mal_ids(["mal_1", 3, "mal_8"]),
+            )
+            self.assertEqual({"10": (True, 1)}, db.get_mal_ids_from_kitsu_ids(["10"]))
+        mock_mapping.find.assert_not_called()
+
+    def test_batch_one_query(self, mock_mapping):
+        """
+        Test that the IDs of a batch missing from the cache are resolved in one query,
+        and cached whether they were found or not
+        """
+        db.id_cache.set("mal:1", (True, 10))
+        mock_mapping.find.return_value = [
+            {"mal_id": 3, "kitsu_id": 7},
+            {"mal_id": 3, "kitsu_id": 70},
+            {"mal_id": 8},
+        ]
+        with patch("app.db.db.id_index", IdIndex()):
+            resolved = db.get_kitsu_ids_from_mal_ids(
+                ["mal_1", "mal_3", 3, "mal_8", "mal_9", "invalid"]
+            )
+            self.assertEqual(
+                {
+                    "mal_1": (True, 10),
+                    "mal_3": (True, 7),
+                    3: (True, 7),
+                    "mal_8": (False, ""),
+                    "mal_9": (False, ""),
+                    "invalid": (False, ""),
+                },
+                resolved,
+            )
+            mock_mapping.find.assert_called_once_with(
+                {"mal_id": {"$in": [3, 8, 9]}}, {"_id": 0, "mal_id": 1, "kitsu_id": 1}
+            )
+
+            # Every ID of the batch is now cached, found or not
+            self.assertEqual((True, 7), db.get_kitsu_id_from_mal_id("mal_3"))
+            self.assertEqual((False, ""), db.get_kitsu_id_from_mal_id("mal_9"))
+            db.get_kitsu_ids_from_mal_ids(["mal_3", "mal_9"])
+        mock_mapping.find.assert_called_once()
+        mock_mapping.find_one.assert_not_called()
+
+    def test_batch_size(self, mock_mapping):
+        """
+        Test that large batches are split into several queries
+        """
+        mock_mapping.find.return_value = []
+        with patch("app.db.db.id_index", IdIndex()), patch("config.ID_BATCH_SIZE", 2):
+            resolved = db.get_mal_ids_from_kitsu_ids(range(1, 6))
+        self.assertEqual(5, len(resolved))
+        self.assertEqual(3, mock_mapping.find.call_count)
+        first_query = mock_mapping.find.call_args_list[0].args[0]
+        self.assertEqual({"kitsu_id": {"$in": [1, 2]}}, first_query)
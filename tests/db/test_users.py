@@ -0,0 +1,116 @@
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock
+
+from app.db.users import PROFILE_FIELDS, SESSION_FIELDS, UserRepository
+
+
+def _user(expires_in=3600):
+    return {
+        "uid": "123",
+        "access_token": "token",
+        "refresh_token": "refresh",
+        "expires_in": expires_in,
+        "last_updated": datetime.utcnow(),
+        "catalogs": ["watching"],
+    }
+
+
+class TestUserRepository(unittest.TestCase):
+    def setUp(self):
+        self.collection = MagicMock()
+        self.collection.find_one.side_effect = lambda *_args: _user()
+        self.users = UserRepository(self.collection, ttl=60)
+
+    def test_session_fields_are_cached(self):
+        """
+        Test that session fields are fetched once, with a projection
+        """
+        self.assertEqual("token", self.users.get("123")["access_token"])
+        self.assertEqual("token", self.users.get("123")["access_token"])
+        self.collection.find_one.assert_called_once()
+        query, projection = self.collection.find_one.call_args.args
+        self.assertEqual({"uid": "123"}, query)
+        self.assertEqual(set(SESSION_FIELDS), projection.keys() - {"_id"})
+        self.assertEqual(0, projection["_id"])
+
+    def test_subset_of_session_fields(self):
+        """
+        Test that a subset of the session fields is served from the cache, with the
+        user's uid
+        """
+        self.users.get("123")
+        self.assertEqual(
+            {"uid": "123", "catalogs": ["watching"]},
+            self.users.get("123", ["catalogs"]),
+        )
+        self.collection.find_one.assert_called_once()
+
+    def test_cached_user_is_copied(self):
+        """
+        Test that updating a returned user does not change the cached one
+        """
+        user = self.users.get("123")
+        user |= {"access_token": "changed"}
+        self.assertEqual("token", self.users.get("123")["access_token"])
+
+    def test_other_fields_are_not_cached(self):
+        """
+        Test that fields outside the session fields are fetched with their own
+        projection, or the whole document
+        """
+        self.users.get("123", PROFILE_FIELDS)
+        self.users.get("123", PROFILE_FIELDS)
+        self.users.get("123", None)
+        self.assertEqual(3, self.collection.find_one.call_count)
+        projection = self.collection.find_one.call_args_list[0].args[1]
+        self.assertEqual(1, projection["picture"])
+        self.assertEqual(({"uid": "123"},), self.collection.find_one.call_args.args)
+
+    def test_missing_user_is_not_cached(self):
+        """
+        Test that a missing user is looked up again
+        """
+        self.collection.find_one.side_effect = lambda *_args: None
+        self.assertIsNone(self.users.get("123"))
+        self.assertIsNone(self.users.get("123"))
+        self.assertEqual(2, self.collection.find_one.call_count)
+
+    def test_expired_token_is_not_cached(self):
+        """
+        Test that a user is not cached past the expiry of their access token
+        """
+        self.collection.find_one.side_effect = lambda *_args: _user(expires_in=-10)
+        self.users.get("123")
+        self.users.get("123")
+        self.assertEqual(2, self.collection.find_one.call_count)
+
+    def test_store_upserts_and_invalidates(self):
+        """
+        Test that storing a user is a single upsert, which drops the cached user
+        """
+        self.users.get("123")
+        details = {"_id": "object_id", "id": "123", "access_token": "new"}
+        self.assertTrue(self.users.store(details))
+
+        self.assertEqual("123", details["uid"])
+        self.collection.update_one.assert_called_once_with(
+            {"uid": "123"},
+            {"$set": {"id": "123", "uid": "123", "access_token": "new"}},
+            upsert=True,
+        )
+        self.users.get("123")
+        self.assertEqual(2, self.collection.find_one.call_count)
+
+    def test_mark_watchlist_changed(self):
+        """
+        Test that a list change is stored for other workers, and drops the cached user
+        """
+        self.users.get("123")
+        self.users.mark_watchlist_changed("123")
+
+        query, update = self.collection.update_one.call_args.args
+        self.assertEqual({"uid": "123"}, query)
+        self.assertIn("watchlist_changed_at", update["$set"])
+        self.users.get("123")
+        self.assertEqual(2, self.collection.find_one.call_count)
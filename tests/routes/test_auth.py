@@ -83,33 +83,53 @@ class TestAuthBlueprint(unittest.TestCase):
             self.assertEqual("123", sess["user"]["uid"])
             self.assertEqual("test_refresh_token", sess["user"]["refresh_token"])
 
-    @patch("app.routes.mal_client.refresh_token")
-    @patch("app.db.db.store_user")
-    def test_refresh_token(self, mock_store_user, mock_refresh_token):
+    @patch("app.routes.auth.token_refresher.refresh_user")
+    @patch("app.routes.auth.get_user")
+    def test_refresh_token(self, mock_get_user, mock_refresh_user):
         """
-        Test that the user's session is refreshed and the user is redirected to the configuration page
+        Test that the user's stored tokens are refreshed, rather than the session's
+        refresh token, which the background refresh may have rotated
         """
-        # Mock the refresh token response
-        mock_refresh_token.return_value = {
+        stored = {"uid": "123", "refresh_token": "rotated_refresh_token"}
+        mock_get_user.return_value = stored
+        mock_refresh_user.return_value = {
+            "uid": "123",
             "access_token": "new_access_token",
             "refresh_token": "new_refresh_token",
-            "expires_in": 3600,
         }
-        mock_store_user.return_value = None
 
-        # Simulate a logged-in user session
         with self.client:
             with self.client.session_transaction() as sess:
                 sess["user"] = {"uid": "123", "refresh_token": "old_refresh_token"}
 
-            # Simulate the refresh endpoint
-            response = self.client.get("/refresh", follow_redirects=True)
+            response = self.client.get("/refresh")
+            self.assertEqual(302, response.status_code)
 
-            # Manually manage the session after redirect
             with self.client.session_transaction() as sess:
-                self.assertIn("user", sess)
-                self.assertIn("MyAnimeList session refreshed.", response.data.decode())
+                self.assertIn(
+                    ("success", "MyAnimeList session refreshed."), sess["_flashes"]
+                )
                 self.assertEqual("new_refresh_token", sess["user"]["refresh_token"])
+        mock_refresh_user.assert_called_once_with(stored)
+
+    @patch("app.routes.auth.token_refresher.refresh_user")
+    @patch("app.routes.auth.get_user")
+    def test_failed_refresh(self, mock_get_user, mock_refresh_user):
+        """
+        Test that the user is told when their session could not be refreshed
+        """
+        mock_get_user.return_value = {"uid": "123", "refresh_token": "revoked"}
+        mock_refresh_user.return_value = None
+
+        with self.client:
+            with self.client.session_transaction() as sess:
+                sess["user"] = {"uid": "123", "refresh_token": "revoked"}
+
+            self.client.get("/refresh")
+            with self.client.session_transaction() as sess:
+                category, _ = sess["_flashes"][0]
+                self.assertEqual("danger", category)
+                self.assertEqual("revoked", sess["user"]["refresh_token"])
 
     def test_session_expired(self):
         """
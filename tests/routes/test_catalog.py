@@ -1,8 +1,15 @@
 import unittest
 from unittest.mock import patch
 
+from app.api.watchlist import SNAPSHOT_FIELDS
+from app.routes.catalog import _mal_to_meta
 from run import app
 
+# Fields MAL returns for every anime, without them being requested
+MAL_DEFAULT_FIELDS = {"id", "title", "main_picture"}
+# Only returned by MAL's anime details endpoint, list metas are rendered without it
+DETAILS_ONLY_FIELDS = {"pictures"}
+
 DUMMY_MAL_RESPONSE = {
     "data": [
         {
@@ -21,7 +28,12 @@ DUMMY_MAL_RESPONSE = {
                 "start_date": "2002-02-15",
                 "end_date": "2002-02-15",
                 "media_type": "tv",
-            }
+            },
+            "list_status": {
+                "status": "watching",
+                "score": 1,
+                "updated_at": "2024-01-01T00:00:00+00:00",
+            },
         },
         {
             "node": {
@@ -39,7 +51,12 @@ DUMMY_MAL_RESPONSE = {
                 "start_date": "2002-02-15",
                 "end_date": "2002-02-15",
                 "media_type": "ova",
-            }
+            },
+            "list_status": {
+                "status": "watching",
+                "score": 2,
+                "updated_at": "2024-01-02T00:00:00+00:00",
+            },
         },
         {
             "node": {
@@ -53,7 +70,12 @@ DUMMY_MAL_RESPONSE = {
                 "start_date": None,
                 "end_date": None,
                 "media_type": "movie",
-            }
+            },
+            "list_status": {
+                "status": "watching",
+                "score": 3,
+                "updated_at": "2024-01-03T00:00:00+00:00",
+            },
         },
         {
             "node": {
@@ -67,7 +89,12 @@ DUMMY_MAL_RESPONSE = {
                 "start_date": "2002-02-15",
                 "end_date": "2002-02-15",
                 "media_type": "special",
-            }
+            },
+            "list_status": {
+                "status": "watching",
+                "score": 4,
+                "updated_at": "2024-01-04T00:00:00+00:00",
+            },
         },
         {
             "node": {
@@ -81,7 +108,12 @@ DUMMY_MAL_RESPONSE = {
                 "start_date": "2002-02-15",
                 "end_date": None,
                 "media_type": "unknown",
-            }
+            },
+            "list_status": {
+                "status": "watching",
+                "score": 5,
+                "updated_at": "2024-01-05T00:00:00+00:00",
+            },
         },
         {
             "node": {
@@ -95,12 +127,34 @@ DUMMY_MAL_RESPONSE = {
                 "start_date": "2002-02-15",
                 "end_date": "2002-02-15",
                 "media_type": "movie",
-            }
+            },
+            "list_status": {
+                "status": "watching",
+                "score": 6,
+                "updated_at": "2024-01-06T00:00:00+00:00",
+            },
         },
     ]
 }
 
 
+async def _stream_dummy_list(*args, **kwargs):
+    for item in DUMMY_MAL_RESPONSE["data"]:
+        yield item
+
+
+class _RecordingDict(dict):
+    """A dict recording the keys read from it"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read = set()
+
+    def get(self, key, default=None):
+        self.read.add(key)
+        return super().get(key, default)
+
+
 class TestCatalog(unittest.TestCase):
     def setUp(self):
         """Set up the Flask test client."""
@@ -147,11 +201,10 @@ class TestCatalog(unittest.TestCase):
                 anime["description"], ["Naruto anime", "Naruto Shippuden anime", None]
             )
 
-    @patch("app.routes.mal_client.get_user_anime_list")
+    @patch("app.routes.async_mal_client.stream_user_anime_list", new=_stream_dummy_list)
     @patch("app.routes.mal_client.get_anime_list")
-    def test_catalog(self, mock_get_user_anime_list, mock_get_anime_list):
+    def test_catalog(self, mock_get_anime_list):
         """Test valid catalog request."""
-        mock_get_user_anime_list.return_value = DUMMY_MAL_RESPONSE
         mock_get_anime_list.return_value = DUMMY_MAL_RESPONSE
 
         response = self.client.get("123/catalog/anime/watching.json")
@@ -159,6 +212,14 @@ class TestCatalog(unittest.TestCase):
         response_data = response.json
         self._meta_asserts(response_data)
 
+    def test_snapshot_fields_cover_rendered_fields(self):
+        """Test that watchlist snapshots request every field a catalog meta reads"""
+        anime_item = _RecordingDict(DUMMY_MAL_RESPONSE["data"][0]["node"])
+        _mal_to_meta(anime_item, "anime", "watching", "")
+
+        requested = set(SNAPSHOT_FIELDS.split(",")) | MAL_DEFAULT_FIELDS
+        self.assertSetEqual(set(), anime_item.read - requested - DETAILS_ONLY_FIELDS)
+
     @patch("app.routes.mal_client.get_anime_list")
     def test_search(self, mock_get_anime_list):
         """Test catalog request with a search query."""
@@ -174,20 +235,18 @@ class TestCatalog(unittest.TestCase):
         response = self.client.get("123/catalog/anime/search_list/search=N.json")
         self.assertEqual(400, response.status_code)
 
-    @patch("app.routes.mal_client.get_user_anime_list")
-    def test_genre_filtering_no_results(self, mock_get_user_anime_list):
+    @patch("app.routes.async_mal_client.stream_user_anime_list", new=_stream_dummy_list)
+    def test_genre_filtering_no_results(self):
         """Test catalog request with a search query."""
-        mock_get_user_anime_list.return_value = DUMMY_MAL_RESPONSE
 
         response = self.client.get("123/catalog/anime/watching/genre=Adventure.json")
         self.assertEqual(200, response.status_code)
         response_data = response.json
         self.assertListEqual([], response_data["metas"])
 
-    @patch("app.routes.mal_client.get_user_anime_list")
-    def test_genre_filtering(self, mock_get_user_anime_list):
+    @patch("app.routes.async_mal_client.stream_user_anime_list", new=_stream_dummy_list)
+    def test_genre_filtering(self):
         """Test catalog request with a search query."""
-        mock_get_user_anime_list.return_value = DUMMY_MAL_RESPONSE
 
         response = self.client.get("123/catalog/anime/watching/genre=Action.json")
         self.assertEqual(200, response.status_code)
@@ -9,7 +9,7 @@ from app.routes.content_sync import (
     handle_content_id,
     handle_current_status,
 )
-from run import app
+from run import app, response_cache
 
 
 class TestContentSync(unittest.TestCase):
@@ -18,6 +18,8 @@ class TestContentSync(unittest.TestCase):
         app.config["TESTING"] = True
         app.config["SECRET"] = "Testing Secret"
         self.test_client = app.test_client()
+        if response_cache is not None:
+            response_cache.clear()
 
     def test_handle_mal_id(self):
         content_id, episode = handle_content_id("mal_12345")
@@ -2,7 +2,7 @@ import unittest
 from unittest.mock import patch
 
 from app.routes.manifest import MANIFEST
-from run import app
+from run import app, response_cache
 
 
 class TestManifestBlueprint(unittest.TestCase):
@@ -13,6 +13,8 @@ class TestManifestBlueprint(unittest.TestCase):
         app.config["TESTING"] = True
         app.config["SECRET"] = "Testing Secret"
         self.client = app.test_client()
+        if response_cache is not None:
+            response_cache.clear()
 
     def test_manifest(self):
         """
@@ -1,7 +1,7 @@
 import unittest
 
 from app.routes.meta import kitsu_to_meta
-from run import app
+from run import app, response_cache
 
 KITSU_RESPONSE = {
     "meta": {
@@ -253,8 +253,10 @@ class TestMeta(unittest.TestCase):
         app.config["TESTING"] = True
         app.config["SECRET"] = "Testing Secret"
         self.client = app.test_client()
+        if response_cache is not None:
+            response_cache.clear()
 
-    @unittest.mock.patch("app.routes.meta.requests.get")
+    @unittest.mock.patch("app.api.transport.get")
     def test_meta(self, mock_get=None):
         """Test the /meta endpoint with a mocked Kitsu response"""
         mock_get.return_value.status_code = 200
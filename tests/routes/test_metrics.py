@@ -0,0 +1,64 @@
+import unittest
+from unittest.mock import patch
+
+from run import app
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        """Set up the Flask test client"""
+        app.config["TESTING"] = True
+        app.config["SECRET"] = "Testing Secret"
+        self.client = app.test_client()
+
+    @patch("app.routes.metrics.Config.METRICS_TOKEN", "")
+    def test_metrics_disabled(self):
+        """Test that metrics are not served without a configured token"""
+        response = self.client.get("/metrics")
+        self.assertEqual(404, response.status_code)
+
+    @patch("app.routes.metrics.Config.METRICS_TOKEN", "operator-token")
+    def test_metrics_forbidden(self):
+        """Test that metrics require the operator's token"""
+        response = self.client.get(
+            "/metrics", headers={"Authorization": "Bearer wrong-token"}
+        )
+        self.assertEqual(403, response.status_code)
+
+    @patch("app.routes.metrics.Config.METRICS_TOKEN", "operator-token")
+    def test_metrics(self):
+        """Test that the scheduler's counters are reported"""
+        response = self.client.get(
+            "/metrics", headers={"Authorization": "Bearer operator-token"}
+        )
+        self.assertEqual(200, response.status_code)
+
+        scheduler_stats = response.json["mal_scheduler"]
+        for key in ["queue_depth", "granted", "queued", "rejected", "throttled"]:
+            self.assertIn(key, scheduler_stats)
+        self.assertIn("upstreams", response.json)
+
+        cache_names = [cache["name"] for cache in response.json["caches"]]
+        self.assertIn("kitsu_meta", cache_names)
+        self.assertIn("torrentio_streams", cache_names)
+
+    @patch("app.routes.metrics.Config.METRICS_TOKEN", "operator-token")
+    def test_cache_metrics(self):
+        """Test that every cache is reported with its hit ratios and top keys"""
+        response = self.client.get(
+            "/metrics/caches?top=3", headers={"Authorization": "Bearer operator-token"}
+        )
+        self.assertEqual(200, response.status_code)
+
+        caches = {cache["name"]: cache for cache in response.json["caches"]}
+        for name in ["anime_ids", "kitsu_meta", "torrentio_streams", "watchlists"]:
+            self.assertIn(name, caches)
+        for key in ["size", "bytes", "hits", "misses", "evictions", "hit_ratios"]:
+            self.assertIn(key, caches["anime_ids"])
+        self.assertLessEqual(len(caches["kitsu_meta"]["top_keys"]), 3)
+
+    @patch("app.routes.metrics.Config.METRICS_TOKEN", "operator-token")
+    def test_cache_metrics_forbidden(self):
+        """Test that cache metrics require the operator's token"""
+        response = self.client.get("/metrics/caches")
+        self.assertEqual(403, response.status_code)
@@ -1,7 +1,7 @@
 import unittest
 from unittest.mock import patch
 
-from run import app
+from run import app, response_cache
 
 
 class TestStream(unittest.TestCase):
@@ -10,6 +10,8 @@ class TestStream(unittest.TestCase):
         app.config["TESTING"] = True
         app.config["SECRET"] = "Testing Secret"
         self.client = app.test_client()
+        if response_cache is not None:
+            response_cache.clear()
 
     @patch("app.routes.stream.get_valid_user")
     def test_fetch_streams_disabled(self, mock_user):
@@ -0,0 +1,79 @@
+import gzip
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from app.cache.ttl import TTLCache
+from app.tasks.cache_snapshot import CacheSnapshotter
+
+
+class TestCacheSnapshotter(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "snapshot.json.gz")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _caches(self):
+        return [
+            TTLCache("meta", maxsize=10, ttl=60, decode=tuple),
+            TTLCache("ids", maxsize=10, ttl=60, decode=tuple),
+        ]
+
+    def test_save_and_restore(self):
+        """
+        Test that saved entries are restored into fresh caches, decoded
+        """
+        meta, ids = self._caches()
+        meta.set("url", (200, {"meta": {}}))
+        ids.set("mal:1", (True, "42"))
+        self.assertEqual(2, CacheSnapshotter([meta, ids], self.path).save())
+
+        meta, ids = self._caches()
+        snapshotter = CacheSnapshotter([meta, ids], self.path)
+        self.assertEqual(2, snapshotter.restore())
+        self.assertEqual((200, {"meta": {}}), meta.get("url"))
+        self.assertEqual((True, "42"), ids.get("mal:1"))
+        self.assertEqual(2, snapshotter.stats()["restored"])
+
+    def test_save_limits_entries(self):
+        """
+        Test that only the most recently used entries of each cache are saved
+        """
+        meta, ids = self._caches()
+        for i in range(5):
+            meta.set(f"url{i}", (200, i))
+        CacheSnapshotter([meta, ids], self.path, max_entries=2).save()
+
+        with open(self.path, "rb") as f:
+            snapshot = json.loads(gzip.decompress(f.read()))
+        keys = [key for key, _, _ in snapshot["caches"]["meta"]]
+        self.assertEqual(["url4", "url3"], keys)
+
+    def test_restore_skips_expired_entries(self):
+        """
+        Test that entries which expired since the snapshot are not restored
+        """
+        meta, ids = self._caches()
+        meta.set("url", (200, {}))
+        snapshotter = CacheSnapshotter([meta, ids], self.path)
+        snapshotter.save()
+
+        with open(self.path, "rb") as f:
+            snapshot = json.loads(gzip.decompress(f.read()))
+        snapshot["caches"]["meta"][0][1] = time.time() - 1
+        with open(self.path, "wb") as f:
+            f.write(gzip.compress(json.dumps(snapshot).encode()))
+
+        meta, ids = self._caches()
+        self.assertEqual(0, CacheSnapshotter([meta, ids], self.path).restore())
+        self.assertEqual(0, len(meta))
+
+    def test_restore_without_snapshot(self):
+        """
+        Test that a missing snapshot file restores nothing
+        """
+        self.assertEqual(0, CacheSnapshotter(self._caches(), self.path).restore())
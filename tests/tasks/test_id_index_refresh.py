@@ -0,0 +1,182 @@
+import fcntl
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from app.db.id_index import IdIndex
+from app.tasks.id_index_refresh import IdIndexRefresher
+
+
+@patch("app.tasks.id_index_refresh.load_id_mappings")
+class TestIdIndexRefresher(unittest.TestCase):
+    def setUp(self):
+        self.index = IdIndex()
+        self.refresher = IdIndexRefresher(self.index)
+
+    def test_refresh(self, mock_load):
+        """
+        Test that refreshing loads the mappings into the index
+        """
+        mock_load.return_value = [{"mal_id": 1, "kitsu_id": 10}]
+        self.assertEqual(1, self.refresher.refresh())
+        self.assertEqual(10, self.index.kitsu_id(1))
+
+        stats = self.refresher.stats()
+        self.assertTrue(stats["loaded"])
+        self.assertEqual(1, stats["mappings"])
+        self.assertEqual(1, stats["refreshes"])
+
+    def test_failed_refresh_keeps_index(self, mock_load):
+        """
+        Test that the index keeps its mappings when reloading fails
+        """
+        mock_load.return_value = [{"mal_id": 1, "kitsu_id": 10}]
+        self.refresher.refresh()
+        mock_load.side_effect = ConnectionError
+        with self.assertRaises(ConnectionError):
+            self.refresher.refresh()
+        self.assertEqual(10, self.index.kitsu_id(1))
+        self.assertEqual(1, self.refresher.stats()["refreshes"])
+
+    def test_empty_reload_keeps_index(self, mock_load):
+        """
+        Test that an empty reload is refused, keeping the index's mappings
+        """
+        mock_load.return_value = [{"mal_id": 1, "kitsu_id": 10}]
+        self.refresher.refresh()
+        mock_load.return_value = []
+        with self.assertRaises(ValueError):
+            self.refresher.refresh()
+        self.assertEqual(10, self.index.kitsu_id(1))
+
+    def test_start_loads_in_background(self, mock_load):
+        """
+        Test that starting the refresher loads the index in a background thread
+        """
+        loaded = threading.Event()
+
+        def load():
+            loaded.set()
+            return [{"mal_id": 1, "kitsu_id": 10}]
+
+        mock_load.side_effect = load
+        self.refresher.start()
+        self.assertTrue(loaded.wait(1))
+        self.refresher.stop()
+        self.refresher._thread.join(1)
+        self.assertEqual(10, self.index.kitsu_id(1))
+
+
+@patch("app.tasks.id_index_refresh.load_id_mappings")
+class TestSharedIdIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "index.bin")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _refresher(self):
+        return IdIndexRefresher(IdIndex(), interval=60, path=self.path)
+
+    def test_workers_share_one_load(self, mock_load):
+        """
+        Test that only the first worker loads the mapping, the others map its file
+        """
+        mock_load.return_value = [{"mal_id": 1, "kitsu_id": 10}]
+        first, second = self._refresher(), self._refresher()
+        self.assertEqual(1, first.refresh())
+        self.assertEqual(1, second.refresh())
+        mock_load.assert_called_once()
+        self.assertEqual(10, second.index.kitsu_id(1))
+        self.assertEqual(1, second.stats()["maps"])
+
+        # An unchanged file is not mapped again
+        second.refresh()
+        self.assertEqual(1, second.stats()["maps"])
+
+    def test_out_of_date_file_is_reloaded(self, mock_load):
+        """
+        Test that a file older than the interval is reloaded, and mapped again
+        """
+        mock_load.return_value = [{"mal_id": 1, "kitsu_id": 10}]
+        refresher = self._refresher()
+        refresher.refresh()
+        past = time.time() - 120
+        os.utime(self.path, (past, past))
+
+        mock_load.return_value = [{"mal_id": 1, "kitsu_id": 11}]
+        refresher.refresh()
+        self.assertEqual(2, mock_load.call_count)
+        self.assertEqual(11, refresher.index.kitsu_id(1))
+
+    def test_truncated_reload_is_not_shared(self, mock_load):
+        """
+        Test that a reload much smaller than the index does not replace the file
+        """
+        mock_load.return_value = [{"mal_id": i, "kitsu_id": i} for i in range(1, 5)]
+        refresher = self._refresher()
+        refresher.refresh()
+        past = time.time() - 120
+        os.utime(self.path, (past, past))
+
+        mock_load.return_value = [{"mal_id": 1, "kitsu_id": 11}]
+        with self.assertRaises(ValueError):
+            refresher.refresh()
+        self.assertEqual(4, IdIndex().map(self.path))
+        self.assertEqual(1, refresher.index.kitsu_id(1))
+
+    def test_failed_reload_backs_off(self, mock_load):
+        """
+        Test that after a failed reload, no worker reloads the file again before the
+        interval has passed
+        """
+        mock_load.return_value = [{"mal_id": i, "kitsu_id": i} for i in range(1, 5)]
+        first, second = self._refresher(), self._refresher()
+        first.refresh()
+        past = time.time() - 120
+        os.utime(self.path, (past, past))
+
+        mock_load.return_value = []
+        with self.assertRaises(ValueError):
+            first.refresh()
+        first.refresh()
+        second.refresh()
+        self.assertEqual(2, mock_load.call_count)
+        self.assertEqual(4, second.index.kitsu_id(4))
+
+        os.utime(f"{self.path}.failed", (past, past))
+        mock_load.return_value = [{"mal_id": i, "kitsu_id": i} for i in range(1, 6)]
+        self.assertEqual(5, second.refresh())
+        self.assertEqual(3, mock_load.call_count)
+
+    def test_failed_first_load_is_retried_sooner(self, mock_load):
+        """
+        Test that a failed first load is retried before the interval
+        """
+        refresher = IdIndexRefresher(IdIndex(), interval=3600, path=self.path)
+        mock_load.side_effect = ConnectionError
+        with self.assertRaises(ConnectionError):
+            refresher.refresh()
+        self.assertEqual(0, refresher.refresh())
+        mock_load.assert_called_once()
+
+        past = time.time() - 60
+        os.utime(f"{self.path}.failed", (past, past))
+        mock_load.side_effect = None
+        mock_load.return_value = [{"mal_id": 1, "kitsu_id": 10}]
+        self.assertEqual(1, refresher.refresh())
+
+    def test_locked_file_is_not_reloaded(self, mock_load):
+        """
+        Test that a worker does not load the mapping while another one holds the lock
+        """
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            refresher = self._refresher()
+            self.assertEqual(0, refresher.refresh())
+        mock_load.assert_not_called()
+        self.assertFalse(refresher.index.loaded)
@@ -0,0 +1,198 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from app.tasks.token_refresh import TokenRefresher
+
+USER = {"uid": "123", "refresh_token": "old_refresh_token"}
+AUTH_DATA = {
+    "token_type": "Bearer",
+    "expires_in": 2678400,
+    "access_token": "new_access_token",
+    "refresh_token": "new_refresh_token",
+}
+
+
+def _http_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(response=response)
+
+
+def _raise(error):
+    raise error
+
+
+@patch("app.tasks.token_refresh.complete_token_refresh")
+@patch("app.tasks.token_refresh.acquire_refresh_lock")
+class TestTokenRefresher(unittest.TestCase):
+    def setUp(self):
+        self.client = MagicMock()
+        self.client.refresh_token.return_value = AUTH_DATA
+        self.refresher = TokenRefresher(self.client, rate=1000, poll_interval=0.01)
+
+    def test_refresh_user(self, mock_lock, mock_complete):
+        """
+        Test that refreshed tokens are stored and the lock released
+        """
+        mock_lock.return_value = USER
+        mock_complete.side_effect = lambda uid, tokens: {"uid": uid, **tokens}
+
+        user = self.refresher.refresh_user(USER)
+        self.assertEqual("new_access_token", user["access_token"])
+        mock_lock.assert_called_once_with("123", "old_refresh_token", 60)
+        self.client.refresh_token.assert_called_once_with("old_refresh_token")
+
+        tokens = mock_complete.call_args.args[1]
+        self.assertEqual("new_refresh_token", tokens["refresh_token"])
+        self.assertAlmostEqual(
+            datetime.utcnow(), tokens["last_updated"], delta=timedelta(seconds=5)
+        )
+
+    def test_locked_user_is_skipped(self, mock_lock, mock_complete):
+        """
+        Test that a user locked by another worker is not refreshed again
+        """
+        mock_lock.return_value = None
+
+        self.assertIsNone(self.refresher.refresh_user(USER, wait=False))
+        self.client.refresh_token.assert_not_called()
+        mock_complete.assert_not_called()
+
+    @patch("app.tasks.token_refresh.get_user")
+    def test_waits_for_refresh_by_other_worker(
+        self, mock_get_user, mock_lock, mock_complete
+    ):
+        """
+        Test that a user locked by another worker is returned once it stored the tokens
+        """
+        mock_lock.return_value = None
+        locked = {**USER, "refresh_lock": datetime.utcnow() + timedelta(seconds=60)}
+        refreshed = {"uid": "123", "refresh_token": "new_refresh_token"}
+        mock_get_user.side_effect = [locked, locked, refreshed]
+
+        self.assertEqual(refreshed, self.refresher.refresh_user(USER))
+        self.assertEqual(3, mock_get_user.call_count)
+        self.client.refresh_token.assert_not_called()
+        mock_complete.assert_not_called()
+
+    @patch("app.tasks.token_refresh.get_user")
+    def test_failed_refresh_by_other_worker(
+        self, mock_get_user, mock_lock, mock_complete
+    ):
+        """
+        Test that waiting ends when the other worker released the lock without new tokens
+        """
+        mock_lock.return_value = None
+        mock_get_user.return_value = USER
+
+        self.assertIsNone(self.refresher.refresh_user(USER))
+        mock_get_user.assert_called_once()
+
+    @patch("app.tasks.token_refresh.get_user")
+    def test_waiting_for_other_worker_times_out(
+        self, mock_get_user, mock_lock, mock_complete
+    ):
+        """
+        Test that a refresh held up in another worker is not waited for indefinitely
+        """
+        mock_lock.return_value = None
+        locked = {**USER, "refresh_lock": datetime.utcnow() + timedelta(seconds=60)}
+        mock_get_user.return_value = locked
+        self.refresher.wait_timeout = 0.05
+
+        self.assertIsNone(self.refresher.refresh_user(USER))
+        self.assertLess(mock_get_user.call_count, 10)
+
+    def test_concurrent_refreshes_are_coalesced(self, mock_lock, mock_complete):
+        """
+        Test that concurrent requests for a user's tokens share a single refresh
+        """
+        started = threading.Event()
+        mock_lock.return_value = USER
+        mock_complete.side_effect = lambda uid, tokens: {"uid": uid, **tokens}
+
+        def refresh(token):
+            started.set()
+            time.sleep(0.2)
+            return AUTH_DATA
+
+        self.client.refresh_token.side_effect = refresh
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            leader = pool.submit(self.refresher.refresh_user, USER)
+            started.wait()
+            followers = [
+                pool.submit(self.refresher.refresh_user, USER) for _ in range(4)
+            ]
+            results = [leader.result()] + [f.result() for f in followers]
+
+        for user in results:
+            self.assertEqual("new_access_token", user["access_token"])
+        self.client.refresh_token.assert_called_once()
+        mock_lock.assert_called_once()
+
+    def test_failed_refresh_releases_lock(self, mock_lock, mock_complete):
+        """
+        Test that a transient failure releases the lock without changing the tokens
+        """
+        mock_lock.return_value = USER
+        self.client.refresh_token.side_effect = _http_error(500)
+
+        self.assertIsNone(self.refresher.refresh_user(USER))
+        mock_complete.assert_called_once_with("123", None)
+        self.assertEqual(1, self.refresher.failed)
+
+    def test_rejected_refresh_token(self, mock_lock, mock_complete):
+        """
+        Test that a refresh token rejected by MAL is not retried
+        """
+        mock_lock.return_value = USER
+        self.client.refresh_token.side_effect = _http_error(401)
+
+        self.assertIsNone(self.refresher.refresh_user(USER))
+        mock_complete.assert_called_once_with(
+            "123", {"rejected_refresh_token": "old_refresh_token"}
+        )
+        self.assertEqual(1, self.refresher.rejected)
+
+    @patch("app.tasks.token_refresh.find_expiring_users")
+    def test_refresh_expiring_in_batches(self, mock_find, mock_lock, mock_complete):
+        """
+        Test that expiring users are refreshed batch by batch
+        """
+        users = [{"uid": str(i), "refresh_token": f"token_{i}"} for i in range(5)]
+        mock_find.side_effect = [users[:2], users[2:4], users[4:]]
+        mock_lock.side_effect = lambda uid, token, lease: {"uid": uid}
+        mock_complete.side_effect = lambda uid, tokens: {"uid": uid, **tokens}
+        self.refresher.batch_size = 2
+
+        self.assertEqual(5, self.refresher.refresh_expiring())
+        self.assertEqual(3, mock_find.call_count)
+        expires_before = mock_find.call_args.args[0]
+        self.assertGreater(expires_before, datetime.utcnow() + timedelta(days=1))
+
+    @patch("app.tasks.token_refresh.find_expiring_users")
+    def test_failing_users_do_not_block_sweep(
+        self, mock_find, mock_lock, mock_complete
+    ):
+        """
+        Test that users failing to refresh are skipped for the rest of the sweep
+        """
+        failing = [{"uid": str(i), "refresh_token": "revoked"} for i in range(2)]
+        healthy = [{"uid": "2", "refresh_token": "token_2"}]
+        mock_find.side_effect = [failing, healthy]
+        mock_lock.side_effect = lambda uid, token, lease: {"uid": uid}
+        mock_complete.side_effect = lambda uid, tokens: {"uid": uid, **(tokens or {})}
+        self.client.refresh_token.side_effect = lambda token: (
+            AUTH_DATA if token == "token_2" else _raise(_http_error(500))
+        )
+        self.refresher.batch_size = 2
+
+        self.assertEqual(1, self.refresher.refresh_expiring())
+        self.assertEqual(2, mock_find.call_count)
+        self.assertEqual({"0", "1"}, mock_find.call_args_list[1].args[2])